@@ -0,0 +1,90 @@
+"""
+Shared helpers for the scripts in ``benchmarks/``.
+
+Benchmarks run against a throwaway test database created from
+``books.settings``, exactly like ``manage.py test`` does, so they never
+touch real data. Run them from the ``books/`` directory, e.g.::
+
+    python -m benchmarks.bench_rating
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'books.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database(verbosity=0, name=None):
+    """
+    ``name`` overrides the test database name; on SQLite that gives a file
+    database instead of the in-memory one, which rejects concurrent writers.
+    """
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+
+    old_name = connection.settings_dict['NAME']
+    if name is not None:
+        connection.settings_dict['TEST']['NAME'] = name
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True,
+                                       serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+        teardown_test_environment()
+
+
+@contextmanager
+def timer():
+    result = {}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def without_response_cache():
+    """Point the store response cache at a dummy backend."""
+    from django.test.utils import override_settings
+
+    return override_settings(
+        STORE_CACHE_ALIAS='benchmark',
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'benchmark': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        }
+    )
+
+
+def without_throttling():
+    """
+    Turn the relation write throttle off.
+
+    The benchmark client replays writes far faster than the throttle's
+    rate, so left on it would measure ``429`` responses.
+    """
+    from django.test.utils import override_settings
+
+    return override_settings(STORE_RELATION_THROTTLE_RATE=None)
@@ -0,0 +1,312 @@
+"""
+Latency, throughput and memory of the book API over a synthetic catalogue.
+
+Generates a catalogue with ``generate_catalogue`` and replays list, filter,
+search, ordering and relation PATCH requests through the Django test
+client and, when ``uvicorn`` is installed, through a local ASGI server::
+
+    python -m benchmarks.bench_api --books 10000 --requests 200 \\
+        --output results.json --compare baseline.json
+
+Latency and throughput come from a plain pass; peak memory is measured
+with ``tracemalloc`` in a separate, shorter pass so tracing does not skew
+the timings. The response cache is disabled unless ``--cache`` is given;
+the relation write throttle is always off.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import StringIO
+
+from benchmarks.base import (BASE_DIR, percentile, setup_django,
+                             test_database, without_response_cache,
+                             without_throttling)
+
+SCENARIOS = ['list', 'filter', 'search', 'ordering', 'relation_patch']
+
+
+class Scenario:
+    def __init__(self, name, book_ids, prefix=''):
+        self.name = name
+        self.book_ids = book_ids
+        self.prefix = prefix
+        self.calls = 0
+
+    def next_request(self):
+        """Return ``(method, path, data)`` of the next request to send."""
+        method, path, data = self.build_request()
+        return method, self.prefix + path, data
+
+    def build_request(self):
+        self.calls += 1
+        if self.name == 'list':
+            return 'get', '/book/', {'page_size': 20}
+        if self.name == 'filter':
+            return 'get', '/book/', {'price': f'{10 + self.calls % 90}.00'}
+        if self.name == 'search':
+            words = ['silver', 'storm win', 'murakami', 'garden night']
+            return 'get', '/book/', {'search': words[self.calls % len(words)]}
+        if self.name == 'ordering':
+            orderings = ['-price', 'author_name', 'price']
+            return 'get', '/book/', {
+                'ordering': orderings[self.calls % len(orderings)]}
+        # Votes go to the most read books, like they would in production.
+        book_id = self.book_ids[self.calls % len(self.book_ids)]
+        return 'patch', f'/book_relation/{book_id}/', {
+            'rate': self.calls % 5 + 1, 'like': bool(self.calls % 2)}
+
+
+class TestClientDriver:
+    name = 'client'
+
+    def __init__(self, user):
+        from rest_framework.test import APIClient
+
+        self.client = APIClient()
+        self.client.force_login(user)
+
+    def send(self, method, path, data):
+        if method == 'get':
+            response = self.client.get(path, data)
+        else:
+            response = getattr(self.client, method)(path, data, format='json')
+        assert response.status_code < 300, response.status_code
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+    def close(self):
+        pass
+
+
+def start_uvicorn(application, port):
+    """Serve ``application`` with uvicorn in a thread of this process."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(
+        application, host='127.0.0.1', port=port, log_level='warning',
+        lifespan='off'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return stop
+
+
+class HttpDriver:
+    """Sends requests over HTTP with one session per client thread."""
+    def __init__(self, name, base_url, user, stop=None, timeout=30):
+        import requests
+        from django.test import Client
+
+        self.name = name
+        self.base_url = base_url
+        self.stop = stop
+        self.timeout = timeout
+        client = Client()
+        client.force_login(user)
+        csrf_token = 'b' * 32
+        self.cookies = {'sessionid': client.cookies['sessionid'].value,
+                        'csrftoken': csrf_token}
+        self.headers = {'X-CSRFToken': csrf_token}
+        self.local = threading.local()
+        self.requests = requests
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+            self.local.session.cookies.update(self.cookies)
+            self.local.session.headers.update(self.headers)
+        return self.local.session
+
+    def send(self, method, path, data):
+        url = self.base_url + path
+        if method == 'get':
+            response = self.session().get(url, params=data,
+                                          timeout=self.timeout)
+        else:
+            response = self.session().request(method, url, json=data,
+                                              timeout=self.timeout)
+        assert response.status_code < 300, response.status_code
+
+    def close(self):
+        if self.stop is not None:
+            self.stop()
+
+
+def get_asgi_driver(user, port):
+    from books.asgi import application
+
+    stop = start_uvicorn(application, port)
+    return HttpDriver('asgi', f'http://127.0.0.1:{port}', user, stop)
+
+
+def measure(driver, scenario, requests, concurrency, memory_requests):
+    for _ in range(min(10, requests)):
+        driver.send(*scenario.next_request())
+
+    def timed_send(request):
+        start = time.perf_counter()
+        driver.send(*request)
+        return time.perf_counter() - start
+
+    work = [scenario.next_request() for _ in range(requests)]
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            samples = list(pool.map(timed_send, work))
+    else:
+        samples = [timed_send(request) for request in work]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in range(memory_requests):
+        driver.send(*scenario.next_request())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'driver': driver.name,
+        'scenario': scenario.name,
+        'requests': requests,
+        'concurrency': concurrency,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_drivers(names, user, port):
+    drivers = []
+    for name in names:
+        if name == 'client':
+            drivers.append(TestClientDriver(user))
+        elif name == 'asgi':
+            try:
+                drivers.append(get_asgi_driver(user, port))
+            except ImportError as exc:
+                print(f'Skipping the asgi driver: {exc}')
+    return drivers
+
+
+def run(args):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+
+    from store.models import Book
+
+    call_command('generate_catalogue', books=args.books, users=args.users,
+                 relations=args.relations, seed=args.seed, stdout=StringIO())
+    user = User.objects.create(username='bench_api')
+    hot_books = list(Book.objects.order_by('-readers_count')
+                     .values_list('id', flat=True)[:50])
+
+    results = []
+    for driver in get_drivers(args.drivers, user, args.port):
+        try:
+            for name in args.scenarios:
+                concurrency = args.concurrency if driver.name == 'asgi' else 1
+                results.append(measure(driver, Scenario(name, hot_books),
+                                       args.requests, concurrency,
+                                       args.memory_requests))
+        finally:
+            driver.close()
+    return results
+
+
+def print_results(results, baseline=None):
+    previous = {(row['driver'], row['scenario']): row
+                for row in (baseline or {}).get('results', [])}
+    print(f'{"driver":>7} {"scenario":>15} {"p50 ms":>9} {"p99 ms":>9} '
+          f'{"req/s":>8} {"peak KiB":>9}' +
+          (f' {"p50 vs base":>12} {"req/s vs base":>14}' if previous else ''))
+    for row in results:
+        line = (f'{row["driver"]:>7} {row["scenario"]:>15} '
+                f'{row["p50_ms"]:>9.2f} {row["p99_ms"]:>9.2f} '
+                f'{row["throughput_rps"]:>8.1f} '
+                f'{row["peak_memory_kib"]:>9.1f}')
+        base = previous.get((row['driver'], row['scenario']))
+        if base:
+            line += (f' {row["p50_ms"] / base["p50_ms"]:>11.2f}x'
+                     f' {row["throughput_rps"] / base["throughput_rps"]:>13.2f}x')
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--relations', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--memory-requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Concurrent connections of the asgi driver; '
+                             'on SQLite also pass --database.')
+    parser.add_argument('--drivers', nargs='+', default=['client', 'asgi'],
+                        choices=['client', 'asgi'])
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS,
+                        choices=SCENARIOS)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--database', help='Test database name; pass a file '
+                                           'path to run concurrent writes on '
+                                           'SQLite.')
+    parser.add_argument('--cache', action='store_true',
+                        help='Keep the response cache enabled.')
+    parser.add_argument('--output', help='Write the results to this JSON '
+                                         'file.')
+    parser.add_argument('--compare', help='JSON results of an earlier run to '
+                                          'compare against.')
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database(name=args.database), without_throttling():
+        if args.cache:
+            results = run(args)
+        else:
+            with without_response_cache():
+                results = run(args)
+
+    import django
+
+    report = {
+        'commit': get_commit(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'dataset': {name: getattr(args, name)
+                    for name in ['books', 'users', 'relations', 'seed']},
+        'cache': args.cache,
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Throughput of the async endpoints under ``books.asgi`` against the DRF
+views under ASGI and under ``books.wsgi``.
+
+Each server runs in this process. The WSGI server has a fixed pool of
+``--threads`` workers, like a threaded gunicorn worker. ``--slow-clients``
+connections that send an incomplete request and then stall are held open
+during the measurement: under WSGI each of them pins a worker thread, while
+uvicorn only keeps a socket for them::
+
+    python -m benchmarks.bench_async --concurrency 16 --slow-clients 8 \\
+        --database /tmp/bench.sqlite3
+
+Requires ``uvicorn``. Pass ``--database`` on SQLite when measuring
+``relation_patch`` with concurrency, see ``bench_api``. The response cache
+and the relation write throttle are off.
+"""
+import argparse
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from benchmarks.base import (percentile, setup_django, test_database,
+                             without_response_cache, without_throttling)
+from benchmarks.bench_api import HttpDriver, Scenario, start_uvicorn
+
+SCENARIOS = ['list', 'filter', 'ordering', 'relation_patch']
+SERVERS = ['wsgi', 'asgi', 'asgi-async']
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """A WSGI server handling connections on a bounded thread pool."""
+    daemon_threads = True
+
+    def __init__(self, address, threads):
+        super().__init__(address, QuietHandler)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_wsgi(port, threads):
+    from books.wsgi import application
+
+    server = PooledWSGIServer(('127.0.0.1', port), threads)
+    server.set_app(application)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.pool.shutdown(wait=False, cancel_futures=True)
+    return stop
+
+
+def open_slow_clients(port, count):
+    sockets = []
+    for _ in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(b'GET /book/ HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+        sockets.append(sock)
+    return sockets
+
+
+def measure(driver, scenario, requests, concurrency):
+    def timed_send(request):
+        start = time.perf_counter()
+        try:
+            driver.send(*request)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    timed_send(scenario.next_request())
+    work = [scenario.next_request() for _ in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = list(pool.map(timed_send, work))
+    elapsed = time.perf_counter() - start
+    completed = [sample for sample in samples if sample is not None]
+    return {
+        'server': driver.name,
+        'scenario': scenario.name,
+        'p50_ms': percentile(completed, 50) * 1000 if completed else None,
+        'p99_ms': percentile(completed, 99) * 1000 if completed else None,
+        'throughput_rps': len(completed) / elapsed,
+        'errors': len(samples) - len(completed),
+    }
+
+
+def run(args):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+
+    from books.asgi import application
+    from store.models import Book
+
+    call_command('generate_catalogue', books=args.books, users=args.users,
+                 relations=args.relations, seed=args.seed, stdout=StringIO())
+    user = User.objects.create(username='bench_async')
+    hot_books = list(Book.objects.order_by('-readers_count')
+                     .values_list('id', flat=True)[:50])
+
+    rows = []
+    for offset, server in enumerate(args.servers):
+        port = args.port + offset
+        if server == 'wsgi':
+            stop = start_wsgi(port, args.threads)
+        else:
+            stop = start_uvicorn(application, port)
+        driver = HttpDriver(server, f'http://127.0.0.1:{port}', user, stop,
+                            timeout=args.timeout)
+        slow = open_slow_clients(port, args.slow_clients)
+        try:
+            prefix = '/async' if server == 'asgi-async' else ''
+            for name in args.scenarios:
+                rows.append(measure(driver, Scenario(name, hot_books, prefix),
+                                    args.requests, args.concurrency))
+        finally:
+            for sock in slow:
+                sock.close()
+            driver.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--relations', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Worker threads of the WSGI server.')
+    parser.add_argument('--slow-clients', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='Seconds before a request counts as an error.')
+    parser.add_argument('--servers', nargs='+', default=SERVERS,
+                        choices=SERVERS)
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS,
+                        choices=SCENARIOS)
+    parser.add_argument('--port', type=int, default=8775)
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database(name=args.database), without_response_cache(), \
+            without_throttling():
+        rows = run(args)
+
+    print(f'{"server":>10} {"scenario":>15} {"p50 ms":>9} {"p99 ms":>9} '
+          f'{"req/s":>8} {"errors":>7}')
+    for row in rows:
+        p50 = f'{row["p50_ms"]:.2f}' if row['p50_ms'] is not None else '-'
+        p99 = f'{row["p99_ms"]:.2f}' if row['p99_ms'] is not None else '-'
+        print(f'{row["server"]:>10} {row["scenario"]:>15} {p50:>9} '
+              f'{p99:>9} {row["throughput_rps"]:>8.1f} '
+              f'{row["errors"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
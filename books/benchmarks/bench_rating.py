@@ -0,0 +1,79 @@
+"""
+Cost of a single vote as the number of readers of a book grows.
+
+Compares the incremental ``update_rating`` path used by
+``UserBookRelation.save`` with the full ``Avg('rate')`` recompute done by
+``set_rating``::
+
+    python -m benchmarks.bench_rating --readers 10 100 1000 10000
+"""
+import argparse
+import random
+
+from benchmarks.base import setup_django, test_database, timer
+
+
+def populate(readers):
+    from django.contrib.auth.models import User
+
+    from store.logic import rebuild_ratings
+    from store.models import Book, UserBookRelation
+
+    book = Book.objects.create(name=f'Book with {readers} readers',
+                               price=10, author_name='Bench')
+    users = User.objects.bulk_create(
+        User(username=f'bench_{readers}_{i}') for i in range(readers))
+    UserBookRelation.objects.bulk_create(
+        UserBookRelation(user=user, book=book, rate=random.randint(1, 5))
+        for user in users)
+    rebuild_ratings(Book.objects.filter(pk=book.pk))
+    return book
+
+
+def run(readers_sizes, votes):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from store.logic import set_rating
+    from store.models import UserBookRelation
+
+    rows = []
+    for readers in readers_sizes:
+        book = populate(readers)
+        relations = list(UserBookRelation.objects.filter(book=book)[:votes])
+
+        with CaptureQueriesContext(connection) as queries, \
+                timer() as incremental:
+            for relation in relations:
+                relation.rate = relation.rate % 5 + 1
+                relation.save()
+
+        with timer() as full:
+            for _ in relations:
+                set_rating(book)
+
+        rows.append((readers, len(queries) / len(relations),
+                     incremental['seconds'] / len(relations) * 1000,
+                     full['seconds'] / len(relations) * 1000))
+
+    print(f'{"readers":>10} {"queries/vote":>13} {"incremental ms":>15} '
+          f'{"full recompute ms":>18}')
+    for readers, queries, incremental_ms, full_ms in rows:
+        print(f'{readers:>10} {queries:>13.1f} {incremental_ms:>15.3f} '
+              f'{full_ms:>18.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--readers', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('--votes', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        run(args.readers, args.votes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Search latency as the catalogue grows, full-text index vs ``icontains``.
+
+Drives ``BookViewSet`` through the Django test client with ``?search=`` and
+times the same request served by DRF's plain ``SearchFilter``. Every book
+name carries a rare word drawn from a large synthetic vocabulary, so the
+benchmark covers both selective and broad queries. Selective queries stay
+flat with the index while ``icontains`` grows with the table; broad queries
+cost in proportion to their matches, since all of them are ranked::
+
+    python -m benchmarks.bench_search --books 10000 100000 1000000
+"""
+import argparse
+import itertools
+import random
+import statistics
+
+from benchmarks.base import (setup_django, test_database, timer,
+                             without_response_cache)
+
+WORDS = ('river', 'shadow', 'garden', 'winter', 'silver', 'harbor', 'empire',
+         'forest', 'letter', 'mirror', 'island', 'storm', 'voyage', 'secret',
+         'castle', 'summer', 'hunter', 'window', 'memory', 'station')
+AUTHORS = ('Haighley', 'Linch', 'Tolstoy', 'Austen', 'Dickens', 'Murakami',
+           'Borges', 'Calvino', 'Woolf', 'Nabokov')
+SYLLABLES = ('ka', 'lo', 'mi', 'ren', 'tu', 'sha', 'vor', 'el', 'din', 'qua',
+             'bri', 'zon', 'pe', 'gal', 'nyx', 'ost', 'fe', 'ru', 'wan', 'ix')
+RARE_WORDS = [''.join(parts) for parts in itertools.product(SYLLABLES,
+                                                            repeat=4)]
+BROAD_QUERIES = ['silver harbor', 'murakami', 'storm win']
+
+
+def grow_catalogue(total, batch_size=10000):
+    from store.models import Book
+
+    rng = random.Random(total)
+    missing = total - Book.objects.count()
+    while missing > 0:
+        size = min(batch_size, missing)
+        Book.objects.bulk_create(
+            Book(name=' '.join([*rng.sample(WORDS, 2),
+                                rng.choice(RARE_WORDS)]).title(),
+                 author_name=f'{rng.choice(WORDS).title()} '
+                             f'{rng.choice(AUTHORS)}',
+                 price=rng.randrange(100, 10000) / 100)
+            for _ in range(size))
+        missing -= size
+
+
+def measure(client, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        with timer() as elapsed:
+            response = client.get('/book/', params)
+        assert response.status_code == 200, response.status_code
+        samples.append(elapsed['seconds'] * 1000)
+    return statistics.median(samples)
+
+
+def run(sizes, repeat):
+    from django.test import Client
+    from rest_framework.filters import SearchFilter
+
+    from store.models import Book
+    from store.search import BookSearchFilter
+    from store.views import BookViewSet
+
+    client = Client()
+    filter_backends = BookViewSet.filter_backends
+    plain_backends = [SearchFilter if backend is BookSearchFilter else backend
+                      for backend in filter_backends]
+    rows = []
+    for size in sizes:
+        grow_catalogue(size)
+        rare = Book.objects.order_by('-id').values_list(
+            'name', flat=True).first().split()[-1].lower()
+        for query in [rare, rare[:5], *BROAD_QUERIES]:
+            params = {'search': query, 'page_size': 20}
+            indexed = measure(client, params, repeat)
+            BookViewSet.filter_backends = plain_backends
+            try:
+                scan = measure(client, params, repeat)
+            finally:
+                BookViewSet.filter_backends = filter_backends
+            rows.append((size, query, indexed, scan))
+
+    print(f'{"books":>10} {"query":>18} {"fts ms":>10} {"icontains ms":>13}')
+    for size, query, indexed, scan in rows:
+        print(f'{size:>10} {query:>18} {indexed:>10.2f} {scan:>13.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--books', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database(), without_response_cache():
+        run(sorted(args.books), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Per-row cost of serializing a book list page, ``BooksSerializer`` vs the
+compiled ``BookRowSerializer``.
+
+Each stage is timed separately on the same page of books: fetching
+(model instances with the prefetch vs ``values_list`` plus the readers
+preview query), serializing the fetched page and rendering it with
+``JSONRenderer`` vs ``FastJSONRenderer``. The bytes of both paths are
+compared before anything is timed::
+
+    python -m benchmarks.bench_serializer --page-size 20 100
+"""
+import argparse
+import statistics
+from io import StringIO
+
+from benchmarks.base import setup_django, test_database, timer
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        with timer() as elapsed:
+            func()
+        samples.append(elapsed['seconds'])
+    return statistics.median(samples)
+
+
+def run(args):
+    from django.core.management import call_command
+    from rest_framework.renderers import JSONRenderer
+
+    from store.renderers import FastJSONRenderer, orjson
+    from store.row_serializers import (BookRowSerializer, RowSerializer,
+                                       load_readers_preview)
+    from store.serializers import BooksSerializer
+    from store.views import BookViewSet
+
+    call_command('generate_catalogue', books=args.books, users=args.users,
+                 relations=args.relations, seed=args.seed, stdout=StringIO())
+    row_serializer = BookRowSerializer()
+    json_renderer = JSONRenderer()
+    fast_renderer = FastJSONRenderer()
+    if orjson is None:
+        print('orjson is not installed, FastJSONRenderer falls back to json')
+
+    rows = []
+    for page_size in args.page_size:
+        queryset = BookViewSet.queryset.order_by('-readers_count',
+                                                 'id')[:page_size]
+        values = queryset.prefetch_related(None).values_list(
+            *row_serializer.columns, named=True)
+
+        def fetch_rows():
+            page = list(values.all())
+            return page, load_readers_preview([row.pk for row in page])
+
+        books = list(queryset)
+        page, previews = fetch_rows()
+        # Serializing alone, with the readers preview already loaded.
+        loaded = RowSerializer(BooksSerializer, nested_loaders={
+            'readers_preview': lambda book_ids: previews})
+        data = BooksSerializer(books, many=True).data
+        row_data = loaded.to_representation(page)
+        assert (json_renderer.render(data) ==
+                fast_renderer.render(row_data)), 'outputs differ'
+
+        stages = [
+            ('fetch', lambda: list(queryset.all()), fetch_rows),
+            ('serialize', lambda: BooksSerializer(books, many=True).data,
+             lambda: loaded.to_representation(page)),
+            ('render', lambda: json_renderer.render(data),
+             lambda: fast_renderer.render(row_data)),
+        ]
+        for stage, drf, fast in stages:
+            drf_time = measure(drf, args.repeat) / page_size * 1e6
+            fast_time = measure(fast, args.repeat) / page_size * 1e6
+            rows.append((page_size, stage, drf_time, fast_time))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--relations', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--page-size', type=int, nargs='+',
+                        default=[20, 100])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        rows = run(args)
+
+    print(f'{"rows":>6} {"stage":>10} {"drf us/row":>11} '
+          f'{"fast us/row":>12} {"speedup":>8}')
+    for page_size, stage, drf_time, fast_time in rows:
+        print(f'{page_size:>6} {stage:>10} {drf_time:>11.1f} '
+              f'{fast_time:>12.1f} {drf_time / fast_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
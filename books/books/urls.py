@@ -19,17 +19,25 @@ from django.urls import path, include, re_path
 from rest_framework.routers import SimpleRouter
 
 
-from store.views import BookViewSet, auth, UserBookRelationView
+from store import async_views
+from store.views import (BookViewSet, LibraryViewSet, auth,
+                         UserBookRelationView)
 
 router = SimpleRouter()
 
 router.register(r'book', BookViewSet)
 router.register(r'book_relation', UserBookRelationView)
+router.register(r'me/books', LibraryViewSet, basename='library')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path(r'', include('social_django.urls', namespace='social')),
-    path('auth/', auth)
+    path('auth/', auth),
+    path('async/book/', async_views.book_list, name='async-book-list'),
+    path('async/book/<int:pk>/', async_views.book_detail,
+         name='async-book-detail'),
+    path('async/book_relation/<int:book>/', async_views.book_relation,
+         name='async-userbookrelation-detail'),
 ]
 
 urlpatterns += router.urls
@@ -1,14 +1,90 @@
 from django.contrib import admin
 from django.contrib.admin import ModelAdmin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
 
+from store.cache import invalidate_books
+from store.logic import rebuild_counters, rebuild_ratings
 from store.models import Book, UserBookRelation
 
 
+def estimate_count(model, using):
+    """
+    Row count of ``model``'s table from the planner statistics, or None
+    when there are none (e.g. on SQLite before ``ANALYZE``).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class '
+                               'WHERE oid = %s::regclass', [table])
+                rows = [row[0] for row in cursor.fetchall()]
+            elif connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s',
+                               [table])
+                rows = [int(row[0].split()[0]) for row in cursor.fetchall()]
+            else:
+                return None
+    except DatabaseError:
+        return None
+    rows = [count for count in rows if count >= 0]
+    return max(rows) if rows else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Takes the size of an unfiltered changelist from the planner statistics
+    instead of a ``COUNT(*)`` once the table has more than
+    ``estimate_threshold`` rows.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return super().count
+
+
 @admin.register(Book)
 class BookAdmin(ModelAdmin):
-    pass
+    list_display = ('id', 'name', 'author_name', 'price', 'owner', 'rating',
+                    'likes_count', 'readers_count')
+    list_select_related = ('owner',)
+    search_fields = ('name', 'author_name')
+    autocomplete_fields = ('owner',)
+    # Maintained by the relation writes, see store.logic.
+    readonly_fields = (*Book.counter_fields, 'version', 'updated_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['recompute_ratings', 'recount_relations']
+
+    @admin.action(description='Recompute ratings of selected books')
+    def recompute_ratings(self, request, queryset):
+        updated = rebuild_ratings(queryset)
+        invalidate_books(queryset.values_list('id', flat=True))
+        self.message_user(request, f'Recomputed the rating of {updated} '
+                                   f'books.')
+
+    @admin.action(description='Recount likes, readers and ratings of '
+                              'selected books')
+    def recount_relations(self, request, queryset):
+        updated = rebuild_counters(queryset)
+        invalidate_books(queryset.values_list('id', flat=True))
+        self.message_user(request, f'Recounted {updated} books.')
 
 
 @admin.register(UserBookRelation)
 class UserBookRelAdmin(ModelAdmin):
-    pass
+    list_display = ('id', 'user', 'book', 'like', 'in_bookmarks', 'rate')
+    list_select_related = ('user', 'book')
+    list_filter = ('like', 'in_bookmarks', 'rate')
+    autocomplete_fields = ('user', 'book')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.core.checks import register
+from django.db.models.signals import post_migrate
 
 
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        from store.instrumentation import check_middleware
+        from store.search import reinstall_search_index
+
+        post_migrate.connect(reinstall_search_index, sender=self)
+        register(check_middleware)
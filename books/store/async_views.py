@@ -0,0 +1,136 @@
+"""
+Async variants of the book list/detail and relation update endpoints,
+served under ``/async/``.
+
+They share filtering, pagination, serializers and the response cache with
+``BookViewSet`` but reach the database through Django's async ORM, so
+under ``books.asgi`` a request only occupies a thread while one of its
+queries runs instead of for its whole lifetime. The relation update runs
+``UserBookRelationView`` on a thread instead, as it must hold a row lock
+inside a transaction.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_GET, require_http_methods
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from store.cache import (BOOK_VERSION_KEY, CATALOGUE_VERSION_KEY,
+                         aget_versions, get_cache)
+from store.coalescing import show_pending_changes
+from store.instrumentation import query_budget
+from store.routers import reads_from_replica
+from store.views import BookViewSet, UserBookRelationView
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status_code,
+                        content_type='application/json', headers=headers)
+
+
+def handle_api_errors(view_func):
+    """Turn DRF exceptions into the responses a DRF view would give."""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view_func(request, *args, **kwargs)
+        except Http404:
+            return json_response({'detail': 'No Book matches the given '
+                                            'query.'},
+                                 status.HTTP_404_NOT_FOUND)
+        except APIException as exc:
+            data = exc.detail
+            if not isinstance(data, (list, dict)):
+                data = {'detail': data}
+            return json_response(data, exc.status_code)
+    return wrapper
+
+
+async def get_book_view(request, action, **kwargs):
+    view = BookViewSet(action=action, args=(), kwargs=kwargs,
+                       format_kwarg=None)
+    view.request = Request(request, authenticators=view.get_authenticators())
+    # The authenticators may query the database, which only a thread can.
+    await sync_to_async(view.perform_authentication)(view.request)
+    return view
+
+
+async def get_cached_response(view, version_key, build):
+    """Async counterpart of ``CachedResponseMixin.get_cached_response``."""
+    request = view.request
+    if not view.is_cacheable(request):
+        return json_response(await build())
+    cache_key = view.get_cache_key(request,
+                                   await aget_versions([version_key]))
+    etag = view.get_etag(cache_key)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return HttpResponse(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+
+    cache = get_cache()
+    cached = await cache.aget(cache_key)
+    if cached is None:
+        data = await build()
+        if reads_from_replica():
+            return json_response(data)
+        cached = (data, {'ETag': etag})
+        await cache.aset(cache_key, cached, view.cache_timeout)
+    data, headers = cached
+    return json_response(data, headers=headers)
+
+
+@query_budget(BookViewSet.query_budgets['list'])
+@require_GET
+@handle_api_errors
+async def book_list(request):
+    view = await get_book_view(request, 'list')
+
+    async def build():
+        # The first search on a connection checks for the full-text index.
+        queryset = await sync_to_async(view.filter_queryset)(
+            view.get_queryset())
+        paginator = view.paginator
+        page = await paginator.apaginate_queryset(queryset, view.request,
+                                                  view)
+        data = view.get_serializer(page, many=True).data
+        return view.get_paginated_response(data).data
+
+    return await get_cached_response(view, CATALOGUE_VERSION_KEY, build)
+
+
+@query_budget(BookViewSet.query_budgets['retrieve'])
+@require_GET
+@handle_api_errors
+async def book_detail(request, pk):
+    view = await get_book_view(request, 'retrieve', pk=pk)
+
+    async def build():
+        book = await view.get_queryset().filter(pk=pk).afirst()
+        if book is None:
+            raise Http404
+        data = view.get_serializer(book).data
+        if view.with_user_state():
+            show_pending_changes(view.request.user, [data])
+        return data
+
+    return await get_cached_response(view, BOOK_VERSION_KEY.format(pk),
+                                     build)
+
+
+relation_view = UserBookRelationView.as_view({'patch': 'partial_update'})
+
+
+@query_budget(UserBookRelationView.query_budgets['partial_update'])
+@require_http_methods(['PATCH'])
+async def book_relation(request, book):
+    """
+    ``UserBookRelationView``'s PATCH, run on a thread: it is throttled,
+    coalesced and locked like the sync one, so the like and rate deltas
+    hold under concurrent votes.
+    """
+    return await sync_to_async(relation_view)(request, book=book)
@@ -0,0 +1,128 @@
+"""
+Response cache for the book endpoints.
+
+Cache keys embed version tokens: one for the whole catalogue (list
+responses) and one per book (detail responses). Writes invalidate by
+dropping the version tokens; the next read mints a new one, so stale
+entries simply stop being addressed and expire on their own. The cache
+alias is ``settings.STORE_CACHE_ALIAS`` (``'default'``, i.e. local memory,
+unless configured), so production can point it at a shared backend.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags, urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from store.routers import reads_from_replica
+
+CATALOGUE_VERSION_KEY = 'store:catalogue:version'
+BOOK_VERSION_KEY = 'store:book:{}:version'
+
+
+def get_cache():
+    return caches[getattr(settings, 'STORE_CACHE_ALIAS', 'default')]
+
+
+def get_versions(keys):
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(keys):
+    cache = get_cache()
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            versions[key] = await cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def _drop_versions(keys):
+    get_cache().delete_many(keys)
+
+
+def invalidate_books(book_ids=()):
+    """
+    Invalidate cached list responses and the detail responses of
+    ``book_ids``. Done immediately and again on commit, so a reader that
+    raced with the transaction cannot keep stale data under the new version.
+    """
+    keys = [CATALOGUE_VERSION_KEY]
+    keys += [BOOK_VERSION_KEY.format(book_id) for book_id in book_ids]
+    _drop_versions(keys)
+    transaction.on_commit(lambda: _drop_versions(keys))
+
+
+class CachedResponseMixin:
+    """
+    Caches ``list``/``retrieve`` responses keyed on the normalized query
+    string and answers ``If-None-Match`` with ``304 Not Modified`` without
+    touching the database. A response that sets its own ``ETag`` keeps it;
+    ``cached_headers`` are stored and replayed along with the data.
+    Responses read from a replica are served but not stored.
+    """
+    cache_timeout = getattr(settings, 'STORE_CACHE_TIMEOUT', 300)
+    cached_headers = ('ETag', 'Last-Modified')
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            [CATALOGUE_VERSION_KEY], super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.get_cached_response(
+            [BOOK_VERSION_KEY.format(lookup)], super().retrieve,
+            request, *args, **kwargs)
+
+    def get_cache_key(self, request, versions):
+        query = urlencode(sorted(
+            (name, value) for name, values in request.query_params.lists()
+            for value in values
+        ))
+        raw = ':'.join([request.get_host(), request.path, query,
+                        *map(str, versions)])
+        digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+        # v2: entries are (data, headers) pairs.
+        return 'store:response:v2:' + digest
+
+    def get_etag(self, cache_key):
+        return '"{}"'.format(cache_key.rsplit(':', 1)[-1])
+
+    def is_cacheable(self, request):
+        """Whether the response is the same for every user."""
+        return True
+
+    def get_cached_response(self, version_keys, handler, request, *args,
+                            **kwargs):
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+        cache_key = self.get_cache_key(request, get_versions(version_keys))
+        etag = self.get_etag(cache_key)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+
+        cache = get_cache()
+        cached = cache.get(cache_key)
+        if cached is not None:
+            data, headers = cached
+            return Response(data, headers=headers)
+        response = handler(request, *args, **kwargs)
+        if (response.status_code == status.HTTP_200_OK and
+                not reads_from_replica()):
+            response.headers.setdefault('ETag', etag)
+            headers = {name: response[name] for name in self.cached_headers
+                       if name in response}
+            cache.set(cache_key, (response.data, headers), self.cache_timeout)
+        return response
@@ -0,0 +1,172 @@
+"""
+Write coalescing for relation PATCHes.
+
+With ``STORE_RELATION_COALESCE_WINDOW`` set to a number of seconds, a
+``PATCH /book_relation/<book>/`` is merged into the pending state of its
+(user, book) pair instead of being written. A daemon thread writes every
+pending pair once the window has passed, each user's pairs with one
+``upsert_relations`` call, so a burst of toggles costs one write however
+long it is. The first PATCH of a burst reads the stored state of the pair,
+the following ones touch no database at all.
+
+The buffer lives in the process, like the ``'thread'`` rating queue: the
+pending state shows in that process's responses to the same user (the
+PATCH itself, ``?user_state=1`` book pages and ``/me/books/``), while
+``/me/books/?shelf=`` filters on the stored state until the flush. What is
+pending is also flushed when the process exits.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404
+
+from store.models import Book
+
+logger = logging.getLogger(__name__)
+
+# Relation fields and the UserBookStateSerializer fields showing them.
+STATE_FIELDS = {'like': 'is_liked', 'in_bookmarks': 'in_bookmarks',
+                'rate': 'my_rate'}
+
+
+def get_window():
+    return getattr(settings, 'STORE_RELATION_COALESCE_WINDOW', None)
+
+
+class RelationWriteBuffer:
+    def __init__(self, window=None):
+        self.window = window
+        # (user id, book id) -> {'user', 'state', 'changed'}
+        self.pending = {}
+        # Drained but not written yet, still shown to readers.
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def get_state(self, user_id, book_id):
+        """Pending state of the pair, every relation field, or None."""
+        with self.lock:
+            entry = (self.pending.get((user_id, book_id)) or
+                     self.flushing.get((user_id, book_id)))
+            return None if entry is None else dict(entry['state'])
+
+    def get_changes(self, user_id, book_ids):
+        """Pending changes of ``user_id`` to ``book_ids``, by book id."""
+        changes = {}
+        with self.lock:
+            for entries in (self.flushing, self.pending):
+                for book_id in book_ids:
+                    entry = entries.get((user_id, book_id))
+                    if entry is not None:
+                        changes.setdefault(book_id, {}).update(
+                            (name, entry['state'][name])
+                            for name in entry['changed'])
+        return changes
+
+    def add(self, user, book_id, state, changes):
+        """
+        Merge ``changes`` into the pending entry of the pair, which starts
+        from ``state`` when there is none, and return the merged state.
+        """
+        with self.lock:
+            entry = self.pending.setdefault((user.pk, book_id), {
+                'user': user, 'state': dict(state), 'changed': set()})
+            entry['state'].update(changes)
+            entry['changed'].update(changes)
+            state = dict(entry['state'])
+            self.start()
+        self.wakeup.set()
+        return state
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            if self.thread is None:
+                atexit.register(self.flush)
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name='relation-writes')
+            self.thread.start()
+
+    def drain(self):
+        with self.lock:
+            self.flushing.update(self.pending)
+            self.pending = {}
+            self.wakeup.clear()
+            return dict(self.flushing)
+
+    def flush(self):
+        """Write everything pending in the calling thread."""
+        from store.logic import upsert_relations
+
+        entries = self.drain()
+        users = {}
+        for (user_id, book_id), entry in entries.items():
+            user, rows = users.setdefault(user_id, (entry['user'], []))
+            rows.append({'book': book_id, **{
+                name: entry['state'][name] for name in entry['changed']}})
+        written = 0
+        try:
+            for user, rows in users.values():
+                try:
+                    upsert_relations(user, rows)
+                    written += len(rows)
+                except Exception:
+                    logger.exception('Dropped %d relation writes of user %s',
+                                     len(rows), user.pk)
+        finally:
+            with self.lock:
+                for key in entries:
+                    self.flushing.pop(key, None)
+        return written
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(get_window() if self.window is None else self.window)
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+
+
+_buffer = RelationWriteBuffer()
+
+
+def get_relation_buffer():
+    """The process's buffer when coalescing is on, otherwise None."""
+    return _buffer if get_window() else None
+
+
+def buffer_relation_changes(user, book_id, changes):
+    """
+    Queue ``changes`` of ``user``'s relation to ``book_id`` and return the
+    state of the relation with them, as the relation PATCH does.
+    """
+    buffer = get_relation_buffer()
+    state = buffer.get_state(user.pk, book_id)
+    if state is None:
+        stored = (Book.objects.with_user_state(user).filter(pk=book_id)
+                  .values(*STATE_FIELDS.values()).first())
+        if stored is None:
+            raise Http404
+        state = {name: stored[field] for name, field in STATE_FIELDS.items()}
+    return buffer.add(user, book_id, state, changes)
+
+
+def show_pending_changes(user, books):
+    """
+    Apply ``user``'s pending changes to ``books``, serialized with
+    ``UserBookStateSerializer``.
+    """
+    buffer = get_relation_buffer()
+    if buffer is None or not user.is_authenticated:
+        return books
+    changes = buffer.get_changes(user.pk, [book['id'] for book in books])
+    for book in books:
+        for name, value in changes.get(book['id'], {}).items():
+            book[STATE_FIELDS[name]] = value
+    return books
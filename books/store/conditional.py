@@ -0,0 +1,134 @@
+"""
+Conditional requests on book detail.
+
+Detail responses carry a weak ``ETag`` and a ``Last-Modified`` taken from
+``Book.version`` and ``Book.updated_at``. A request with ``If-None-Match``
+or ``If-Modified-Since`` is checked against those two columns with one
+primary key lookup and answered with ``304 Not Modified`` before the book
+is loaded and serialized. Writes sent with ``If-Match`` lock the row and
+fail with ``412 Precondition Failed`` if it changed since the client read
+it, instead of silently overwriting a concurrent edit. List responses keep
+the ETag of their cache entry, see ``store.cache``.
+
+``If-Modified-Since`` is only as precise as an HTTP date, one second: a
+client that read the book between two writes made in the same second is
+told its copy is current. The version is exact, so ``If-None-Match`` wins
+whenever a request carries both, and clients should revalidate with the
+ETag.
+"""
+from contextlib import nullcontext
+
+from django.db import transaction
+from django.http import Http404
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The resource was modified since it was read.'
+    default_code = 'precondition_failed'
+
+
+def get_version_etag(version):
+    return f'W/"{version}"'
+
+
+def get_version_headers(version, updated_at):
+    return {'ETag': get_version_etag(version),
+            'Last-Modified': http_date(updated_at.timestamp())}
+
+
+def etag_matches(header, etag):
+    """
+    Weak comparison of ``etag`` with the list in an ``If-Match`` or
+    ``If-None-Match`` header; the version ETags are weak on both sides.
+    """
+    etags = parse_etags(header)
+    return '*' in etags or etag.removeprefix('W/') in {
+        tag.removeprefix('W/') for tag in etags}
+
+
+def is_not_modified(request, version, updated_at):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        # Takes precedence over If-Modified-Since (RFC 9110, 13.1.3),
+        # which is ignored even if the ETag does not match.
+        return etag_matches(if_none_match, get_version_etag(version))
+    # Whole seconds: misses a second write within the same second.
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since'))
+    return since is not None and int(updated_at.timestamp()) <= since
+
+
+class RowVersionMixin:
+    """
+    Version headers on ``retrieve`` and ``If-Match`` on ``update`` and
+    ``destroy`` for a model with ``version`` and ``updated_at`` fields.
+    Goes after ``CachedResponseMixin`` so the headers are cached with the
+    response; the view calls ``get_not_modified_response`` before the cache.
+    """
+
+    def get_not_modified_response(self, request, *args, **kwargs):
+        """
+        ``304 Not Modified`` if the validators of a conditional request
+        still match the row, otherwise None.
+        """
+        if not {'If-None-Match', 'If-Modified-Since'} & set(request.headers):
+            return None
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = (self.get_queryset().model._default_manager
+               .filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+               .values_list('version', 'updated_at').first())
+        if row is None:
+            raise Http404
+        if not is_not_modified(request, *row):
+            return None
+        return Response(status=status.HTTP_304_NOT_MODIFIED,
+                        headers=get_version_headers(*row))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data, headers=get_version_headers(
+            instance.version, instance.updated_at))
+
+    def checks_if_match(self):
+        return (self.request.method not in SAFE_METHODS and
+                'If-Match' in self.request.headers)
+
+    def if_match_lock(self):
+        """Holds the row lock of get_object until the write commits."""
+        if self.checks_if_match():
+            return transaction.atomic()
+        return nullcontext()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.checks_if_match():
+            queryset = queryset.select_for_update(of=('self',))
+        return queryset
+
+    def get_object(self):
+        instance = super().get_object()
+        if self.checks_if_match() and not etag_matches(
+                self.request.headers['If-Match'],
+                get_version_etag(instance.version)):
+            raise PreconditionFailed
+        return instance
+
+    def update(self, request, *args, **kwargs):
+        with self.if_match_lock():
+            return super().update(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        instance = serializer.instance
+        self.headers.update(get_version_headers(instance.version,
+                                                instance.updated_at))
+
+    def destroy(self, request, *args, **kwargs):
+        with self.if_match_lock():
+            return super().destroy(request, *args, **kwargs)
@@ -0,0 +1,240 @@
+"""
+Per-request query budgets and timings.
+
+``QueryBudgetMiddleware`` counts the queries a request runs and how long
+they take, how long the view spent outside the database and how long the
+response took to render. Add it to ``MIDDLEWARE`` as
+``'store.instrumentation.QueryBudgetMiddleware'``, after
+``AuthenticationMiddleware``. With ``DEBUG`` on the
+numbers are sent back in a ``Server-Timing`` header; otherwise they are
+logged to the ``store.instrumentation`` logger with the values in the
+``query_metrics`` attribute of the log record.
+
+``books/settings.py`` is kept out of the repository, so nothing adds the
+middleware for you: the ``store.W001`` system check warns while it is
+missing, and the query budget tests add it themselves.
+
+Views declare their budget with ``query_budgets = {action: queries}`` on a
+viewset or with the ``query_budget`` decorator on a function view. Budgets
+cover the view's own queries: the session and user lookups are done before
+the view runs and reported separately as ``auth_queries``. A request over
+budget is logged as a warning, in every mode. One-off work the view does
+on behalf of the process, such as probing the database for a feature, is
+charged to ``setup_queries`` with the ``setup_queries()`` context manager.
+Savepoints are counted apart, as ``savepoints``.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.checks import Warning
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger('store.instrumentation')
+
+current_metrics = ContextVar('store_query_metrics', default=None)
+
+# Emitted by nested ``atomic`` blocks, and by every ``atomic`` block under
+# ``TestCase``; not charged to the budget.
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT',
+                        'ROLLBACK TO SAVEPOINT')
+
+
+def check_middleware(app_configs, **kwargs):
+    path = f'{__name__}.{QueryBudgetMiddleware.__name__}'
+    if path in settings.MIDDLEWARE:
+        return []
+    return [Warning(
+        'Query budgets are not enforced.',
+        hint=f"Add '{path}' to MIDDLEWARE, after AuthenticationMiddleware.",
+        id='store.W001')]
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender=None, connection=None, **kwargs):
+    """
+    Queries are attributed to requests through a context variable rather
+    than per-request wrappers, so the ones async views run on
+    ``sync_to_async`` threads are counted too.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def setup_queries():
+    """Charge the queries run inside to ``setup_queries``, not the view."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    start = metrics.queries
+    try:
+        yield
+    finally:
+        metrics.setup_queries += metrics.queries - start
+
+
+def query_budget(queries):
+    """Set the query budget of a function view."""
+    def decorator(view_func):
+        view_func.query_budget = queries
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func, request):
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, 'query_budget', None)
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower())
+    return getattr(view_class, 'query_budgets', {}).get(action)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.savepoints = 0
+        self.auth_queries = 0
+        self.setup_queries = 0
+        self.db_time = 0.0
+        self.view_time = 0.0
+        self.render_time = 0.0
+        self.budget = None
+        self.view_name = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            if sql.startswith(SAVEPOINT_STATEMENTS):
+                self.savepoints += 1
+            else:
+                self.queries += 1
+
+    @property
+    def view_queries(self):
+        return self.queries - self.auth_queries - self.setup_queries
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.view_queries > self.budget
+
+    def as_dict(self):
+        return {
+            'view': self.view_name,
+            'queries': self.view_queries,
+            'auth_queries': self.auth_queries,
+            'setup_queries': self.setup_queries,
+            'savepoints': self.savepoints,
+            'budget': self.budget,
+            'db_ms': round(self.db_time * 1000, 3),
+            'view_ms': round(max(self.view_time - self.db_time, 0) * 1000, 3),
+            'serialize_ms': round(self.render_time * 1000, 3),
+        }
+
+    def server_timing(self):
+        metrics = self.as_dict()
+        return ', '.join([
+            f'db;dur={metrics["db_ms"]};desc="{self.queries} queries"',
+            f'view;dur={metrics["view_ms"]}',
+            f'serialize;dur={metrics["serialize_ms"]}',
+        ])
+
+
+class QueryBudgetMiddleware:
+    """
+    ``db`` covers every query of the request, ``view`` the rest of the
+    view (for the book endpoints mostly serializer field conversion) and
+    ``serialize`` the rendering of the response body.
+
+    The middleware runs natively in both modes, so it does not force
+    async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all():
+            install_query_recorder(connection=connection)
+        metrics = self.start(request)
+        if hasattr(request, 'user'):
+            # Load the session and user now so they are not charged to the
+            # view.
+            request.user.is_authenticated
+        metrics.auth_queries = metrics.queries
+        return self.finish(request, metrics, self.get_response(request))
+
+    async def __acall__(self, request):
+        metrics = self.start(request)
+        if hasattr(request, 'auser'):
+            # Also hand the user to sync views, which would otherwise load it
+            # again through request.user.
+            request.user = await request.auser()
+        metrics.auth_queries = metrics.queries
+        return self.finish(request, metrics,
+                           await self.get_response(request))
+
+    def start(self, request):
+        metrics = request.query_metrics = RequestMetrics()
+        metrics.token = current_metrics.set(metrics)
+        metrics.start = time.perf_counter()
+        return metrics
+
+    def finish(self, request, metrics, response):
+        # Queries of a streamed body run after this point and are not
+        # counted.
+        metrics.view_time = (time.perf_counter() - metrics.start -
+                             metrics.render_time)
+        current_metrics.reset(metrics.token)
+        match = request.resolver_match
+        if match is not None:
+            metrics.budget = get_query_budget(match.func, request)
+            metrics.view_name = match.view_name
+        self.report(request, response, metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        metrics = request.query_metrics
+        start = time.perf_counter()
+
+        def rendered(response):
+            metrics.render_time = time.perf_counter() - start
+        response.add_post_render_callback(rendered)
+        return response
+
+    def report(self, request, response, metrics):
+        record = dict(metrics.as_dict(), method=request.method,
+                      path=request.path, status=response.status_code)
+        if metrics.over_budget:
+            logger.warning('%s %s ran %d queries, budget is %d',
+                           request.method, request.path, metrics.view_queries,
+                           metrics.budget, extra={'query_metrics': record})
+        if settings.DEBUG:
+            response['Server-Timing'] = metrics.server_timing()
+        else:
+            logger.info('%s %s: %d queries in %.1fms', request.method,
+                        request.path, metrics.view_queries, record['db_ms'],
+                        extra={'query_metrics': record})
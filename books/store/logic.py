@@ -1,10 +1,258 @@
-from django.db.models import Avg
+from itertools import islice
 
-from store.models import UserBookRelation
+from django.db import connections, transaction
+from django.db.models import (Avg, Case, Count, DecimalField, F, FloatField,
+                              OuterRef, Q, Subquery, Sum, Value, When)
+from django.db.models.functions import Cast, Coalesce
+from rest_framework.exceptions import ValidationError
+
+from store.cache import invalidate_books
+from store.models import Book, RatingRecomputation, UserBookRelation
+from store.serializers import BooksSerializer
 
 
 def set_rating(book):
-    rating = UserBookRelation.objects.filter(book=book).aggregate(
-        rating=Avg('rate')).get('rating')
-    book.rating = rating
-    book.save()
+    """
+    Recompute the rating of ``book`` from scratch with one
+    ``UPDATE ... SET rating = (subquery)``; ``book`` itself is not reloaded.
+    """
+    rebuild_ratings(Book.objects.filter(pk=book.pk))
+    invalidate_books([book.pk])
+
+
+def _rating_changes(old_rate, new_rate):
+    sum_delta = (new_rate or 0) - (old_rate or 0)
+    count_delta = (new_rate is not None) - (old_rate is not None)
+    if not sum_delta and not count_delta:
+        return {}
+    rating_sum = F('rating_sum') + sum_delta
+    rating_count = F('rating_count') + count_delta
+    histogram = {}
+    if old_rate is not None:
+        name = Book.rate_count_fields[old_rate]
+        histogram[name] = F(name) - 1
+    if new_rate is not None:
+        name = Book.rate_count_fields[new_rate]
+        histogram[name] = F(name) + 1
+    return {
+        **histogram,
+        'rating_sum': rating_sum,
+        'rating_count': rating_count,
+        'rating': Case(
+            When(rating_count__gt=-count_delta,
+                 then=Cast(rating_sum, FloatField()) / rating_count),
+            default=Value(None),
+            output_field=DecimalField(max_digits=3, decimal_places=2)
+        ),
+    }
+
+
+def update_book_counters(book_id, old_rate=None, new_rate=None,
+                         like_delta=0, reader_delta=0):
+    """
+    Apply one relation change to the denormalized counters of a book with a
+    single atomic ``UPDATE``; the cost does not depend on how many readers
+    the book has. In deferred rating mode the rating part is queued instead.
+    """
+    from store.rating_queue import is_deferred, schedule_recompute
+
+    if old_rate != new_rate and is_deferred():
+        schedule_recompute(book_id)
+        changes = {}
+    else:
+        changes = _rating_changes(old_rate, new_rate)
+    if like_delta:
+        changes['likes_count'] = F('likes_count') + like_delta
+    if reader_delta:
+        changes['readers_count'] = F('readers_count') + reader_delta
+    if changes:
+        Book.objects.filter(pk=book_id).update(**changes)
+
+
+def update_rating(book_id, old_rate, new_rate):
+    update_book_counters(book_id, old_rate=old_rate, new_rate=new_rate)
+
+
+def _relations_aggregate(aggregate):
+    return Subquery(
+        UserBookRelation.objects.filter(book=OuterRef('pk')).order_by()
+        .values('book').annotate(value=aggregate).values('value')
+    )
+
+
+def _rating_aggregates():
+    return {
+        'rating': _relations_aggregate(Avg('rate')),
+        'rating_sum': Coalesce(_relations_aggregate(Sum('rate')), 0),
+        'rating_count': Coalesce(_relations_aggregate(Count('rate')), 0),
+        **{name: Coalesce(_relations_aggregate(
+            Count('pk', filter=Q(rate=rate))), 0)
+           for rate, name in Book.rate_count_fields.items()},
+    }
+
+
+def _relations_count_aggregates():
+    return {
+        'likes_count': Coalesce(
+            _relations_aggregate(Count('pk', filter=Q(like=True))), 0),
+        'readers_count': Coalesce(_relations_aggregate(Count('pk')), 0),
+    }
+
+
+def rebuild_ratings(books=None):
+    """
+    Recompute the rating counters of ``books`` (all books by default) from
+    ``UserBookRelation`` rows in one set-based ``UPDATE``.
+    """
+    if books is None:
+        books = Book.objects.all()
+    return books.update(**_rating_aggregates())
+
+
+def rebuild_counters(books=None):
+    """
+    Like ``rebuild_ratings`` but recomputes every denormalized counter.
+    """
+    if books is None:
+        books = Book.objects.all()
+    return books.update(**_rating_aggregates(),
+                        **_relations_count_aggregates())
+
+
+def find_counter_drift(books=None):
+    """
+    Return the books whose stored counters disagree with their relations.
+    Each book gets an ``expected_counters`` dict of the recomputed values.
+    """
+    if books is None:
+        books = Book.objects.all()
+    expected = {**_rating_aggregates(), **_relations_count_aggregates()}
+    expected.pop('rating')
+    drift = Q()
+    for name in expected:
+        drift |= ~Q(**{name: F(f'expected_{name}')})
+    drifted = books.annotate(**{
+        f'expected_{name}': expression
+        for name, expression in expected.items()
+    }).filter(drift)
+    drifted = list(drifted)
+    for book in drifted:
+        book.expected_counters = {
+            name: getattr(book, f'expected_{name}') for name in expected
+        }
+    return drifted
+
+
+def upsert_relations(user, rows):
+    """
+    Insert or update the relations of ``user`` described by ``rows``, dicts
+    with a ``book`` id and any of ``like``, ``in_bookmarks`` and ``rate``.
+    Fields left out of a row keep their stored value (or the default for a
+    new relation); later rows for the same book override earlier ones.
+
+    Rows are written with one ``INSERT ... ON CONFLICT DO UPDATE`` per set
+    of provided fields, and the counters of every affected book are
+    recomputed once, after all of them.
+    """
+    merged = {}
+    for row in rows:
+        merged.setdefault(row['book'], {}).update(row)
+
+    groups = {}
+    for book_id, row in merged.items():
+        fields = tuple(sorted(name for name in UserBookRelation.tracked_fields
+                              if name in row))
+        groups.setdefault(fields, []).append(
+            UserBookRelation(user=user, book_id=book_id,
+                             **{name: row[name] for name in fields}))
+
+    # The base manager skips the per-call recount of
+    # UserBookRelationQuerySet.bulk_create.
+    relations_manager = UserBookRelation._base_manager
+    with transaction.atomic():
+        for fields, relations in groups.items():
+            if fields:
+                relations_manager.bulk_create(
+                    relations, update_conflicts=True,
+                    unique_fields=['user', 'book'], update_fields=fields)
+            else:
+                relations_manager.bulk_create(relations,
+                                              ignore_conflicts=True)
+        rebuild_counters(Book.objects.filter(id__in=merged))
+        invalidate_books(merged)
+    return UserBookRelation.objects.filter(user=user,
+                                           book_id__in=merged).order_by('book')
+
+
+def import_books(records, owner=None, batch_size=1000):
+    """
+    Create a book owned by ``owner`` for every dict in ``records``, which is
+    consumed ``batch_size`` records at a time. Every batch is validated with
+    ``BooksSerializer`` and written with one ``bulk_create``.
+
+    All or nothing: on the first invalid batch the import is rolled back
+    and ``ValidationError`` is raised with the errors keyed by record
+    number, counted from 1. Returns the number of books created.
+    """
+    records = iter(records)
+    created = 0
+    with transaction.atomic():
+        while batch := list(islice(records, batch_size)):
+            serializer = BooksSerializer(data=batch, many=True)
+            if not serializer.is_valid():
+                raise ValidationError({'records': {
+                    created + number: errors for number, errors
+                    in enumerate(serializer.errors, start=1) if errors
+                }})
+            Book.objects.bulk_create(
+                Book(owner=owner, **data)
+                for data in serializer.validated_data)
+            created += len(batch)
+        invalidate_books()
+    return created
+
+
+def update_books(book_ids, changes):
+    """
+    Apply the same validated ``changes`` to the books ``book_ids`` with one
+    ``UPDATE``. Returns the number of books updated.
+    """
+    with transaction.atomic(savepoint=False):
+        updated = Book.objects.filter(id__in=book_ids).update(**changes)
+        invalidate_books(book_ids)
+    return updated
+
+
+def _delete_relations(book_ids):
+    """
+    Delete the relations of ``book_ids`` with one ``DELETE``, where the
+    collector would load them and delete them a hundred at a time because
+    of their ``post_delete`` receiver. No signal is sent: the counters it
+    would maintain go with the books.
+    """
+    connection = connections[UserBookRelation._base_manager.db]
+    quote_name = connection.ops.quote_name
+    table = quote_name(UserBookRelation._meta.db_table)
+    column = quote_name(UserBookRelation._meta.get_field('book').column)
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN '
+                       f'({placeholders})', list(book_ids))
+
+
+def delete_books(book_ids):
+    """
+    Delete the books ``book_ids`` in one transaction. Their
+    ``UserBookRelation`` rows go first with one ``DELETE``, whatever their
+    number; the books are then deleted through Django's collector, so
+    their queued ``RatingRecomputation`` rows, and the rows of any other
+    table referencing ``store_book``, get their ``on_delete``. Returns the
+    number of books deleted.
+    """
+    if not book_ids:
+        return 0
+    with transaction.atomic(savepoint=False):
+        _delete_relations(book_ids)
+        _, deleted = Book._base_manager.filter(id__in=book_ids).delete()
+        invalidate_books(book_ids)
+    return deleted.get(Book._meta.label, 0)
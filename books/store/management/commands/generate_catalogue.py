@@ -0,0 +1,137 @@
+import random
+from bisect import bisect
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.cache import invalidate_books
+from store.logic import rebuild_counters
+from store.models import Book, UserBookRelation
+
+TITLE_WORDS = [
+    'silver', 'harbor', 'storm', 'winter', 'garden', 'shadow', 'river',
+    'empire', 'glass', 'night', 'iron', 'summer', 'letters', 'island',
+    'forest', 'dream', 'city', 'fire', 'secret', 'house', 'ocean', 'mountain',
+    'stranger', 'crown', 'memory', 'light', 'station', 'machine', 'wolf',
+    'orchard',
+]
+FIRST_NAMES = [
+    'Arthur', 'Haruki', 'Agatha', 'Ursula', 'Stanislaw', 'Toni', 'Isaac',
+    'Margaret', 'Gabriel', 'Virginia', 'Jorge', 'Doris', 'Ivan', 'Octavia',
+]
+LAST_NAMES = [
+    'Hailey', 'Murakami', 'Christie', 'Le Guin', 'Lem', 'Morrison', 'Asimov',
+    'Atwood', 'Marquez', 'Woolf', 'Borges', 'Lessing', 'Bunin', 'Butler',
+]
+USERNAME_PREFIX = 'catalogue_'
+
+
+class Command(BaseCommand):
+    help = ('Generate a reproducible synthetic catalogue: books, users and '
+            'relations whose popularity follows a Zipf-like distribution.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--relations', type=int, default=100000,
+                            help='Relations to draw; duplicates of a (user, '
+                                 'book) pair are dropped.')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent s of the book popularity weights '
+                                 '1 / rank ** s.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete all books and previously generated '
+                                 'users first.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        if options['clear']:
+            Book.objects.all().delete()
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+        users, new_users = self.create_users(options['users'],
+                                             options['seed'], batch_size)
+        books = self.create_books(rng, options['books'], batch_size)
+        relations = self.create_relations(rng, users, books,
+                                          options['relations'],
+                                          options['zipf'], batch_size)
+        for start in range(0, len(books), batch_size):
+            ids = books[start:start + batch_size]
+            with transaction.atomic():
+                rebuild_counters(Book.objects.filter(id__in=ids))
+                invalidate_books(ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(books)} books, {new_users} users and '
+            f'{relations} relations'))
+
+    def create_users(self, count, seed, batch_size):
+        """
+        Return the ids of the users of ``seed`` and how many of them are
+        new; a rerun with the same seed reuses the existing ones.
+        """
+        users = User.objects.filter(
+            username__startswith=f'{USERNAME_PREFIX}{seed}_')
+        existing = users.count()
+        User.objects.bulk_create(
+            (User(username=f'{USERNAME_PREFIX}{seed}_{i}')
+             for i in range(count)),
+            batch_size=batch_size, ignore_conflicts=True)
+        ids = list(users.order_by('id').values_list('id', flat=True))
+        return ids, len(ids) - existing
+
+    def create_books(self, rng, count, batch_size):
+        books = (
+            Book(name=' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 4)))
+                 .capitalize(),
+                 price=Decimal(rng.randint(100, 9999)) / 100,
+                 author_name=f'{rng.choice(FIRST_NAMES)} '
+                             f'{rng.choice(LAST_NAMES)}')
+            for _ in range(count)
+        )
+        created = Book.objects.bulk_create(books, batch_size=batch_size)
+        return [book.id for book in created]
+
+    def create_relations(self, rng, users, books, count, exponent,
+                         batch_size):
+        """
+        Draw ``count`` relations; the book of each is picked by popularity
+        rank, so a few books collect most of the readers. The counters are
+        rebuilt once afterwards, so rows go through the base manager.
+
+        Returns the number of relations inserted: pairs that already exist
+        are skipped by ``ignore_conflicts``.
+        """
+        if not users or not books:
+            return 0
+        relations = UserBookRelation._base_manager
+        existing = relations.count()
+        ranked = books[:]
+        rng.shuffle(ranked)
+        weights = list(accumulate(1 / rank ** exponent
+                                  for rank in range(1, len(ranked) + 1)))
+        seen = set()
+        batch = []
+        for _ in range(count):
+            user_id = rng.choice(users)
+            book_id = ranked[bisect(weights, rng.random() * weights[-1])]
+            if (user_id, book_id) in seen:
+                continue
+            seen.add((user_id, book_id))
+            batch.append(UserBookRelation(
+                user_id=user_id, book_id=book_id,
+                like=rng.random() < 0.3,
+                in_bookmarks=rng.random() < 0.1,
+                rate=rng.choices([None, 1, 2, 3, 4, 5],
+                                 [40, 3, 5, 12, 20, 20])[0]
+            ))
+            if len(batch) >= batch_size:
+                relations.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        relations.bulk_create(batch, ignore_conflicts=True)
+        return relations.count() - existing
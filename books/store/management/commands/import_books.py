@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import APIException
+
+from store.logic import import_books
+from store.streaming import read_csv_records, read_ndjson_records
+
+READERS = {
+    'csv': read_csv_records,
+    'ndjson': read_ndjson_records,
+}
+
+
+class Command(BaseCommand):
+    help = ('Create books from a CSV file with a header or an NDJSON file, '
+            'read as a stream and written in batches. All or nothing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, "-" for stdin.')
+        parser.add_argument('--format', choices=READERS,
+                            help='Defaults to the file extension '
+                                 '(.csv, .ndjson or .jsonl).')
+        parser.add_argument('--owner',
+                            help='Username of the owner of the new books.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or {
+            '.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson',
+        }.get(Path(path).suffix.lower())
+        if file_format is None:
+            raise CommandError('Pass --format, the file extension is not '
+                               'one of .csv, .ndjson or .jsonl.')
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError(f'No user {options["owner"]!r}.')
+
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            created = import_books(READERS[file_format](stream), owner=owner,
+                                   batch_size=options['batch_size'])
+        except APIException as exc:
+            raise CommandError(f'Nothing imported: {exc.detail}')
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} books'))
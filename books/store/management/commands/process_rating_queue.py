@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.rating_queue import DatabaseRatingQueue, get_window
+
+
+class Command(BaseCommand):
+    help = ('Recompute the ratings of books queued in the RatingRecomputation '
+            'table (STORE_RATING_MODE = "deferred" with '
+            'STORE_RATING_QUEUE = "database").')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit.')
+        parser.add_argument('--window', type=float, default=None,
+                            help='Seconds a queued book waits to coalesce '
+                                 'further votes (STORE_RATING_WINDOW).')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        queue = DatabaseRatingQueue()
+        window = options['window']
+        if window is None:
+            window = get_window()
+        if options['once']:
+            processed = queue.flush(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Recomputed {processed} books'))
+            return
+        try:
+            while True:
+                processed = queue.flush(batch_size=options['batch_size'],
+                                        older_than=window)
+                if processed:
+                    self.stdout.write(f'Recomputed {processed} books')
+                time.sleep(window)
+        except KeyboardInterrupt:
+            pass
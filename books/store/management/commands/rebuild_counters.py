@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.cache import invalidate_books
+from store.logic import find_counter_drift, rebuild_counters
+from store.models import Book
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the denormalized rating, likes and readers counters on '
+            'Book from UserBookRelation rows.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of books updated per statement.')
+        parser.add_argument('--check', action='store_true',
+                            help='Only report books whose counters drifted '
+                                 'and exit with an error if there are any.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            return self.check_drift(options['batch_size'])
+        updated = 0
+        for ids in self.iter_batches(options['batch_size']):
+            with transaction.atomic():
+                updated += rebuild_counters(Book.objects.filter(id__in=ids))
+                invalidate_books(ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {updated} books'))
+
+    def check_drift(self, batch_size):
+        drifted = 0
+        for ids in self.iter_batches(batch_size):
+            books = find_counter_drift(Book.objects.filter(id__in=ids))
+            for book in books:
+                drifted += 1
+                self.stdout.write(f'{book}: ' + ', '.join(
+                    f'{name} {getattr(book, name)} != {expected}'
+                    for name, expected in book.expected_counters.items()
+                    if getattr(book, name) != expected
+                ))
+        if drifted:
+            raise CommandError(f'{drifted} books have drifted counters')
+        self.stdout.write(self.style.SUCCESS('No counter drift'))
+
+    def iter_batches(self, batch_size):
+        last_id = 0
+        while True:
+            ids = list(Book.objects.filter(id__gt=last_id).order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
@@ -0,0 +1,75 @@
+from django.db import migrations
+
+# The index as of this migration; store.search may change after it.
+SQLITE_FTS_TABLE = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS store_book_fts USING fts5('
+    "name, author_name, content='store_book', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+SQLITE_FTS_TRIGGERS = {
+    'store_book_fts_ai': (
+        'CREATE TRIGGER IF NOT EXISTS store_book_fts_ai '
+        'AFTER INSERT ON store_book BEGIN '
+        'INSERT INTO store_book_fts(rowid, name, author_name) '
+        'VALUES (new.id, new.name, new.author_name); END'
+    ),
+    'store_book_fts_ad': (
+        'CREATE TRIGGER IF NOT EXISTS store_book_fts_ad '
+        'AFTER DELETE ON store_book BEGIN '
+        "INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name) "
+        "VALUES ('delete', old.id, old.name, old.author_name); END"
+    ),
+    'store_book_fts_au': (
+        'CREATE TRIGGER IF NOT EXISTS store_book_fts_au '
+        'AFTER UPDATE OF name, author_name ON store_book BEGIN '
+        "INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name) "
+        "VALUES ('delete', old.id, old.name, old.author_name); "
+        'INSERT INTO store_book_fts(rowid, name, author_name) '
+        'VALUES (new.id, new.name, new.author_name); END'
+    ),
+}
+SQLITE_FTS_REBUILD = (
+    "INSERT INTO store_book_fts(store_book_fts) VALUES ('rebuild')"
+)
+POSTGRES_INDEX_NAME = 'store_book_search_gin'
+
+
+def get_postgres_index():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return GinIndex(SearchVector('name', 'author_name', config='simple'),
+                    name=POSTGRES_INDEX_NAME)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(SQLITE_FTS_TABLE)
+        for sql in SQLITE_FTS_TRIGGERS.values():
+            schema_editor.execute(sql)
+        schema_editor.execute(SQLITE_FTS_REBUILD)
+    elif connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('store', 'Book'),
+                                get_postgres_index())
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for name in SQLITE_FTS_TRIGGERS:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        schema_editor.execute('DROP TABLE IF EXISTS store_book_fts')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {POSTGRES_INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_book_readers_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:26
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Avg, Count, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def delete_duplicate_relations(apps, schema_editor):
+    """
+    Keep the oldest relation of each (user, book) pair and recount the
+    books that lost rows.
+
+    Runs on the historical models, so no signal touches the counters and
+    only the columns that exist at this point are written.
+    """
+    Book = apps.get_model('store', 'Book')
+    UserBookRelation = apps.get_model('store', 'UserBookRelation')
+    # Read up front: the deletes below change the grouped table.
+    duplicates = list(
+        UserBookRelation.objects.values('user', 'book')
+        .annotate(keep_id=Min('id'), rows=Count('id'))
+        .filter(rows__gt=1).order_by()
+    )
+    book_ids = set()
+    for duplicate in duplicates:
+        UserBookRelation.objects.filter(
+            user=duplicate['user'], book=duplicate['book']
+        ).exclude(id=duplicate['keep_id']).delete()
+        book_ids.add(duplicate['book'])
+    if not book_ids:
+        return
+
+    def aggregate(expression):
+        return Subquery(
+            UserBookRelation.objects.filter(book=OuterRef('pk')).order_by()
+            .values('book').annotate(value=expression).values('value')
+        )
+
+    Book.objects.filter(id__in=book_ids).update(
+        rating=aggregate(Avg('rate')),
+        rating_sum=Coalesce(aggregate(Sum('rate')), 0),
+        rating_count=Coalesce(aggregate(Count('rate')), 0),
+        likes_count=Coalesce(aggregate(Count('pk', filter=Q(like=True))), 0),
+        readers_count=Coalesce(aggregate(Count('pk')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_book_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_relations,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userbookrelation',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='store_relation_user_book_uniq'),
+        ),
+    ]
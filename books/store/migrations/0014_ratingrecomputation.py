@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_userbookrelation_user_book_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingRecomputation',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='store.book')),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -1,7 +1,54 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DEFERRED, F, FilteredRelation, Q, Value
+from django.db.models.functions import Coalesce, Now
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from store.cache import invalidate_books
+
+
+class BookQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Every set-based write is a new version of the books it touches."""
+        kwargs.setdefault('version', F('version') + 1)
+        kwargs.setdefault('updated_at', Now())
+        return super().update(**kwargs)
+
+    def with_user_state(self, user):
+        """
+        Annotate ``is_liked``, ``in_bookmarks`` and ``my_rate`` of ``user``
+        through one LEFT JOIN on its relation to every book.
+        """
+        return self.annotate(
+            my_relation=FilteredRelation('book', condition=Q(book__user=user)),
+            is_liked=Coalesce(F('my_relation__like'), Value(False)),
+            in_bookmarks=Coalesce(F('my_relation__in_bookmarks'),
+                                  Value(False)),
+            my_rate=F('my_relation__rate'),
+        )
 
 
+def histogram_median(counts):
+    """
+    Median of the values ``1..len(counts)`` taken ``counts[i]`` times each,
+    averaged between the two middle values for an even total.
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    middle = [(total - 1) // 2, total // 2]
+    values = []
+    seen = 0
+    for value, count in enumerate(counts, start=1):
+        seen += count
+        while middle and middle[0] < seen:
+            values.append(value)
+            middle.pop(0)
+    return Decimal(sum(values)) / 2
 
 
 class Book(models.Model):
@@ -16,10 +63,132 @@ class Book(models.Model):
                                  decimal_places=2,
                                  default=None,
                                  null=True)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    # Votes per star, one counter per UserBookRelation.RATE_CHOICES value.
+    rate_1_count = models.PositiveIntegerField(default=0)
+    rate_2_count = models.PositiveIntegerField(default=0)
+    rate_3_count = models.PositiveIntegerField(default=0)
+    rate_4_count = models.PositiveIntegerField(default=0)
+    rate_5_count = models.PositiveIntegerField(default=0)
+    likes_count = models.PositiveIntegerField(default=0)
+    readers_count = models.PositiveIntegerField(default=0)
+    # Row version behind the detail ETag and If-Match, bumped by every write
+    # to the row including the counter updates, see BookQuerySet.update.
+    version = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
+
+    readers_preview_size = 5
+    rate_count_fields = {rate: f'rate_{rate}_count' for rate in range(1, 6)}
+    # Maintained by store.logic.update_book_counters and rebuild_counters.
+    counter_fields = ('rating', 'rating_sum', 'rating_count',
+                      *rate_count_fields.values(), 'likes_count',
+                      'readers_count')
+
+    class Meta:
+        # Keyset pagination and the leaderboards order on (field, id), see
+        # BookCursorPagination and BookViewSet.leaderboards.
+        indexes = [
+            models.Index(fields=['price', 'id'],
+                         name='store_book_price_id_idx'),
+            models.Index(fields=['author_name', 'id'],
+                         name='store_book_author_id_idx'),
+            models.Index(fields=['rating', 'id'],
+                         name='store_book_rating_id_idx'),
+            models.Index(fields=['likes_count', 'id'],
+                         name='store_book_likes_id_idx'),
+        ]
 
     def __str__(self):
         return f'ID {self.id}: {self.name}'
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        version = self.version
+        self.version = F('version') + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            # The counters only move by F() deltas; writing back the values
+            # loaded with the book would undo the votes cast since.
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and
+                             field.name not in self.counter_fields]
+        kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            # Behind the row by any write that raced with this one, which
+            # can only fail a later If-Match, never pass a stale one.
+            self.version = version + 1
+
+    def get_rating_histogram(self):
+        """Number of votes per star, as ``{'1': n, ..., '5': n}``."""
+        return {str(rate): getattr(self, name)
+                for rate, name in self.rate_count_fields.items()}
+
+    def get_rating_median(self):
+        """Median vote from the histogram; None without votes."""
+        return histogram_median([getattr(self, name) for name
+                                 in self.rate_count_fields.values()])
+
+    def get_weighted_rating(self):
+        """
+        Bayesian average: the mean of the votes plus
+        ``STORE_RATING_PRIOR_WEIGHT`` votes of ``STORE_RATING_PRIOR_MEAN``,
+        so a few enthusiastic votes do not top a well-rated book.
+        """
+        weight = getattr(settings, 'STORE_RATING_PRIOR_WEIGHT', 10)
+        mean = getattr(settings, 'STORE_RATING_PRIOR_MEAN', 3)
+        if not weight and not self.rating_count:
+            return None
+        return ((Decimal(weight) * Decimal(str(mean)) + self.rating_sum) /
+                (weight + self.rating_count))
+
+    def get_readers_preview(self):
+        """
+        First readers of the book, taken from the ``readers_preview_cache``
+        prefetch when the queryset was built with it.
+        """
+        if hasattr(self, 'readers_preview_cache'):
+            return self.readers_preview_cache
+        return self.readers.order_by('id')[:self.readers_preview_size]
+
+
+class UserBookRelationQuerySet(models.QuerySet):
+    """
+    Keeps the denormalized ``Book`` counters in step with bulk writes that
+    bypass ``UserBookRelation.save`` by recounting every affected book once.
+    """
+    counted_fields = {'book', 'book_id', 'like', 'rate'}
+
+    def update(self, **kwargs):
+        from store.logic import rebuild_counters
+
+        if not self.counted_fields.intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            book_ids = set(self.values_list('book_id', flat=True))
+            rows = super().update(**kwargs)
+            if 'book' in kwargs or 'book_id' in kwargs:
+                book = kwargs.get('book', kwargs.get('book_id'))
+                book_ids.add(getattr(book, 'pk', book))
+            rebuild_counters(Book.objects.filter(id__in=book_ids))
+            invalidate_books(book_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from store.logic import rebuild_counters
+
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            book_ids = {obj.book_id for obj in objs}
+            rebuild_counters(Book.objects.filter(id__in=book_ids))
+            invalidate_books(book_ids)
+        return objs
+
 
 class UserBookRelation(models.Model):
     RATE_CHOICES = (
@@ -31,22 +200,139 @@ class UserBookRelation(models.Model):
     )
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='user')
+    # Indexed by store_relation_book_rate_idx.
     book = models.ForeignKey(Book, on_delete=models.CASCADE,
-                             related_name='book')
+                             related_name='book', db_index=False)
     like = models.BooleanField(default=False)
     in_bookmarks = models.BooleanField(default=False)
     rate = models.PositiveSmallIntegerField(choices=RATE_CHOICES, null=True)
 
+    objects = UserBookRelationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'],
+                                    name='store_relation_user_book_uniq'),
+        ]
+        # Cover the per-book counter aggregates: rating and readers from
+        # (book, rate), likes from the partial index.
+        indexes = [
+            models.Index(fields=['book', 'rate'],
+                         name='store_relation_book_rate_idx'),
+            models.Index(fields=['book'], condition=models.Q(like=True),
+                         name='store_relation_liked_idx'),
+        ]
+
+    tracked_fields = ('like', 'in_bookmarks', 'rate')
+
     def __str__(self):
         return f'{self.user.username}: {self.book.name}, {self.rate}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(
+            field_names, (value for value in values if value is not DEFERRED)
+        ))
+        return instance
+
+    def get_dirty_fields(self):
+        """
+        Tracked fields whose value differs from the one loaded from the
+        database; fields that were never loaded count as dirty.
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        return [name for name in self.tracked_fields
+                if name not in loaded or loaded[name] != getattr(self, name)]
+
+    def get_save_fields(self):
+        """
+        The dirty tracked fields, or None (every field) when any other
+        column, such as ``book`` or ``user``, may have changed.
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.name in self.tracked_fields:
+                continue
+            if (field.attname not in loaded or
+                    loaded[field.attname] != getattr(self, field.attname)):
+                return None
+        return self.get_dirty_fields()
+
+    def get_loaded_values(self, names):
+        loaded = getattr(self, '_loaded_values', {})
+        missing = [name for name in names if name not in loaded]
+        if missing:
+            loaded = {**loaded, **(UserBookRelation.objects.filter(
+                pk=self.pk).values(*missing).first() or {})}
+        return [loaded.get(name) for name in names]
+
     def save(self, *args, **kwargs):
-        from store.logic import set_rating
+        from store.logic import update_book_counters
+
+        creating = self._state.adding
+        if not creating and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = self.get_save_fields()
+        update_fields = kwargs.get('update_fields')
+        saved_fields = [field.attname for field in self._meta.concrete_fields
+                        if update_fields is None or
+                        field.name in update_fields]
+        counted_fields = [name for name in ('rate', 'like')
+                          if name in saved_fields]
+        old = {'rate': None, 'like': False, 'book_id': self.book_id}
+        if not creating:
+            # Moving to another book takes the whole relation with it.
+            loaded_fields = counted_fields
+            if 'book_id' in saved_fields:
+                loaded_fields = ['rate', 'like', 'book_id']
+            old.update(zip(loaded_fields,
+                           self.get_loaded_values(loaded_fields)))
+        new = {**old, **{name: getattr(self, name) for name in counted_fields}}
+        moved = not creating and old['book_id'] != self.book_id
 
-        creating = not self.pk
-        old_rating = self.rate
         super().save(*args, **kwargs)
-        new_rating = self.rate
-        if old_rating != new_rating or creating:
-            set_rating(self.book)
 
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{name: getattr(self, name) for name in saved_fields}
+        }
+        if moved:
+            update_book_counters(old['book_id'], old_rate=old['rate'],
+                                 like_delta=-int(old['like']),
+                                 reader_delta=-1)
+            update_book_counters(self.book_id, new_rate=new['rate'],
+                                 like_delta=int(new['like']),
+                                 reader_delta=1)
+            invalidate_books([old['book_id'], self.book_id])
+            return
+        update_book_counters(self.book_id,
+                             old_rate=old['rate'],
+                             new_rate=new['rate'],
+                             like_delta=int(new['like']) - int(old['like']),
+                             reader_delta=int(creating))
+        if creating or counted_fields:
+            invalidate_books([self.book_id])
+
+
+@receiver(post_delete, sender=UserBookRelation)
+def relation_deleted(sender, instance, origin=None, **kwargs):
+    from store.logic import update_book_counters
+
+    if isinstance(origin, Book) or getattr(origin, 'model', None) is Book:
+        # Cascading from the book itself: its counters are going away too.
+        return
+    update_book_counters(instance.book_id, old_rate=instance.rate,
+                         like_delta=-int(instance.like), reader_delta=-1)
+    invalidate_books([instance.book_id])
+
+
+@receiver([post_save, post_delete], sender=Book)
+def book_changed(sender, instance, **kwargs):
+    invalidate_books([instance.pk])
+
+
+class RatingRecomputation(models.Model):
+    """A book whose rating waits for the deferred recomputation worker."""
+    book = models.OneToOneField(Book, on_delete=models.CASCADE,
+                                primary_key=True, related_name='+')
+    enqueued_at = models.DateTimeField(auto_now_add=True, db_index=True)
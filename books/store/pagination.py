@@ -0,0 +1,238 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, namedtuple
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Cursor = namedtuple('Cursor', ['value', 'pk', 'reverse'])
+
+
+class BookCursorPagination(BasePagination):
+    """
+    Keyset pagination on ``(ordering field, id)``.
+
+    The ordering field is taken from the view's ``OrderingFilter`` so
+    ``?ordering=-price`` keeps working; ``id`` is used as a tiebreaker,
+    which makes every position unique and every page an index range scan
+    instead of an ``OFFSET``. Rows with a NULL ordering field, such as
+    unrated books, are paged where the database's index puts them.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    default_ordering = 'id'
+    rank_ordering = 'search_rank'
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page([
+            obj async for obj in queryset.aiterator(
+                chunk_size=self.page_size + 1)
+        ])
+
+    def paginate_rows(self, queryset, request, columns, view=None):
+        """
+        Like ``paginate_queryset`` but return named tuples of ``columns``
+        (plus the ordering columns) instead of model instances.
+        """
+        queryset = self.get_page_queryset(queryset, request, view)
+        columns = list(columns)
+        columns += [name for name in (self.field, self.tiebreaker)
+                    if name not in columns]
+        return self.set_page(list(queryset.prefetch_related(None)
+                                  .values_list(*columns, named=True)))
+
+    def get_page_queryset(self, queryset, request, view):
+        """Return the unevaluated queryset of the requested page."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(request, queryset,
+                                                        view)
+        self.ordering_field = self.get_ordering_field(queryset, self.field)
+        self.nullable = self.ordering_field.null
+        self.nulls_largest = connections[
+            queryset.db].features.nulls_order_largest
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor.reverse if self.cursor else False
+
+        queryset = queryset.order_by(*self.get_order_by(reverse))
+        if self.cursor:
+            queryset = queryset.filter(self.get_position_filter(reverse))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        reverse = self.cursor.reverse if self.cursor else False
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = self.cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Return ``(field, descending)`` for the first ordering term
+        requested through the view's ordering filter. Without one, search
+        results keep their relevance order.
+        """
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if ordering:
+            term = ordering[0]
+        elif self.rank_ordering in queryset.query.annotations:
+            term = self.rank_ordering
+        else:
+            term = self.default_ordering
+        return term.lstrip('-'), term.startswith('-')
+
+    def get_ordering_field(self, queryset, field):
+        """The model field, or annotation output field, ordered on."""
+        try:
+            return queryset.model._meta.get_field(field)
+        except FieldDoesNotExist:
+            return queryset.query.annotations[field].output_field
+
+    def get_order_by(self, reverse):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        if self.field == self.tiebreaker:
+            return [prefix + self.tiebreaker]
+        return [prefix + self.field, prefix + self.tiebreaker]
+
+    def get_position_filter(self, reverse):
+        descending = self.descending != reverse
+        lookup = 'lt' if descending else 'gt'
+        after_pk = Q(**{f'{self.tiebreaker}__{lookup}': self.cursor.pk})
+        if self.field == self.tiebreaker:
+            return after_pk
+        if not self.nullable:
+            return (
+                Q(**{f'{self.field}__{lookup}': self.cursor.value}) |
+                Q(**{self.field: self.cursor.value}) & after_pk
+            )
+        # NULLs sort after every value when they are the largest and the
+        # scan is ascending, or the smallest and the scan is descending.
+        nulls_last = self.nulls_largest != descending
+        is_null = Q(**{f'{self.field}__isnull': True})
+        if self.cursor.value is None:
+            if nulls_last:
+                return is_null & after_pk
+            return ~is_null | is_null & after_pk
+        position = (
+            Q(**{f'{self.field}__{lookup}': self.cursor.value}) |
+            Q(**{self.field: self.cursor.value}) & after_pk
+        )
+        return position | is_null if nulls_last else position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            value, pk, reverse = json.loads(
+                urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            return Cursor(value=self.decode_value(value), pk=int(pk),
+                          reverse=bool(reverse))
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def decode_value(self, value):
+        """The cursor ``value`` as a value of the ordering field."""
+        if self.field == self.tiebreaker:
+            return None
+        if value is None:
+            if not self.nullable:
+                raise ValueError(f'{self.field} cannot be null')
+            return None
+        if isinstance(value, (dict, list)):
+            raise ValueError(f'Invalid {self.field}: {value!r}')
+        return self.ordering_field.to_python(value)
+
+    def encode_cursor(self, cursor):
+        payload = json.dumps(list(cursor), cls=DjangoJSONEncoder)
+        encoded = urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_cursor_for(self, obj, reverse):
+        value = None
+        if self.field != self.tiebreaker:
+            value = getattr(obj, self.field)
+        return Cursor(value=value, pk=getattr(obj, self.tiebreaker),
+                      reverse=reverse)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(),
+                                      self.cursor_query_param)
+        return self.encode_cursor(self.get_cursor_for(self.page[-1], False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(),
+                                      self.cursor_query_param)
+        return self.encode_cursor(self.get_cursor_for(self.page[0], True))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True,
+                         'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True,
+                             'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ReaderCursorPagination(BookCursorPagination):
+    """
+    Readers of a book are always paged by user id; the book ordering
+    fields do not apply to them.
+    """
+    def get_ordering(self, request, queryset, view):
+        return self.default_ordering, False
@@ -0,0 +1,148 @@
+"""
+Deferred rating recomputation.
+
+With ``settings.STORE_RATING_MODE = 'deferred'`` a relation write no longer
+touches the book row for its rating. The book id is queued once the
+transaction commits, and a worker recomputes each queued book once, however
+many votes arrived in the meantime. ``STORE_RATING_QUEUE`` selects the
+queue:
+
+* ``'thread'`` (default) - an in-process set drained by a daemon thread
+  every ``STORE_RATING_WINDOW`` seconds;
+* ``'database'`` - the ``RatingRecomputation`` table, drained by the
+  ``process_rating_queue`` management command.
+
+The default ``'sync'`` mode applies rating deltas inside the request.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from store.models import Book, RatingRecomputation
+
+logger = logging.getLogger('store.rating_queue')
+
+
+def is_deferred():
+    return getattr(settings, 'STORE_RATING_MODE', 'sync') == 'deferred'
+
+
+def get_window():
+    return getattr(settings, 'STORE_RATING_WINDOW', 1.0)
+
+
+def recompute(book_ids):
+    from store.cache import invalidate_books
+    from store.logic import rebuild_ratings
+
+    book_ids = sorted(book_ids)
+    if book_ids:
+        rebuild_ratings(Book.objects.filter(id__in=book_ids))
+        invalidate_books(book_ids)
+    return len(book_ids)
+
+
+class ThreadRatingQueue:
+    def __init__(self, window=None):
+        self.window = window
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def enqueue(self, book_id):
+        with self.lock:
+            self.pending.add(book_id)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True,
+                                               name='rating-queue')
+                self.thread.start()
+        self.wakeup.set()
+
+    def drain(self):
+        with self.lock:
+            book_ids, self.pending = self.pending, set()
+            self.wakeup.clear()
+        return book_ids
+
+    def requeue(self, book_ids):
+        with self.lock:
+            self.pending |= book_ids
+        self.wakeup.set()
+
+    def flush(self):
+        """
+        Recompute everything pending in the calling thread. The books are
+        queued again if that fails.
+        """
+        book_ids = self.drain()
+        try:
+            return recompute(book_ids)
+        except BaseException:
+            self.requeue(book_ids)
+            raise
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(get_window() if self.window is None else self.window)
+            try:
+                self.flush()
+            except Exception:
+                # Retried after the next window.
+                logger.exception('Rating recomputation failed')
+            finally:
+                connections.close_all()
+
+
+class DatabaseRatingQueue:
+    def enqueue(self, book_id):
+        RatingRecomputation.objects.bulk_create(
+            [RatingRecomputation(book_id=book_id)], ignore_conflicts=True)
+
+    def flush(self, batch_size=500, older_than=None):
+        """
+        Recompute queued books in batches of ``batch_size``; with
+        ``older_than`` only entries queued at least that many seconds ago
+        are taken, which leaves recent ones to absorb more votes.
+        """
+        processed = 0
+        while True:
+            with transaction.atomic():
+                queued = RatingRecomputation.objects.order_by('enqueued_at')
+                if older_than is not None:
+                    queued = queued.filter(enqueued_at__lte=timezone.now() -
+                                           timedelta(seconds=older_than))
+                features = connections[queued.db].features
+                if features.has_select_for_update_skip_locked:
+                    queued = queued.select_for_update(skip_locked=True)
+                book_ids = list(queued.values_list('book_id', flat=True)
+                                [:batch_size])
+                if not book_ids:
+                    return processed
+                RatingRecomputation.objects.filter(
+                    book_id__in=book_ids).delete()
+                processed += recompute(book_ids)
+
+
+_queues = {}
+
+
+def get_rating_queue():
+    name = getattr(settings, 'STORE_RATING_QUEUE', 'thread')
+    if name not in _queues:
+        queue_class = {
+            'thread': ThreadRatingQueue,
+            'database': DatabaseRatingQueue,
+        }[name]
+        _queues[name] = queue_class()
+    return _queues[name]
+
+
+def schedule_recompute(book_id):
+    transaction.on_commit(lambda: get_rating_queue().enqueue(book_id))
@@ -0,0 +1,38 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` that encodes with ``orjson`` when it is installed and
+    the output is compact. The bytes are the same: values orjson has no
+    native encoding for, and datetimes, go through DRF's encoder.
+    """
+    orjson_options = 0
+    if orjson is not None:
+        orjson_options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact or
+                self.ensure_ascii or not self.strict or
+                self.get_indent(accepted_media_type or '',
+                                renderer_context or {})):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        encoder = self.encoder_class()
+        ret = orjson.dumps(data, default=encoder.default,
+                           option=self.orjson_options)
+        # Match JSONRenderer, which escapes these for JavaScript.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace(
+            '\u2029'.encode(), b'\\u2029')
+
+
+def get_renderer_classes():
+    """The configured renderers with ``FastJSONRenderer`` for JSON."""
+    return [FastJSONRenderer if renderer is JSONRenderer else renderer
+            for renderer in api_settings.DEFAULT_RENDERER_CLASSES]
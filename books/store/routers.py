@@ -0,0 +1,120 @@
+"""
+Read replica routing for the store app.
+
+``ReplicaRouter`` sends reads of store models to a replica only while
+``ReplicaRoutingMiddleware`` serves a safe (``GET``, ``HEAD``,
+``OPTIONS``) request; writes, reads inside a transaction on the primary,
+unsafe requests and code outside requests (management commands, the
+rating worker) use the primary. After a successful unsafe request the
+client gets a cookie that keeps its reads on the primary for
+``STORE_REPLICA_STICKY_SECONDS``, so a user sees their own vote right
+away even if the replicas lag. Responses read from a replica are not
+stored in the response cache: an entry is shared by every client under the
+current version, so it must not hold what a lagging replica returned.
+Settings::
+
+    DATABASES = {
+        'default': {...},
+        'replica': {...},
+    }
+    DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+    STORE_READ_REPLICAS = ['replica']
+    MIDDLEWARE += ['store.routers.ReplicaRoutingMiddleware']
+
+Locally two SQLite files will do, e.g. a copy of ``db.sqlite3`` as the
+replica.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+current_replica = ContextVar('store_read_replica', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'STORE_READ_REPLICAS', []))
+
+
+def get_sticky_cookie():
+    return getattr(settings, 'STORE_REPLICA_STICKY_COOKIE', 'store_primary')
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'STORE_REPLICA_STICKY_SECONDS', 10)
+
+
+def reads_from_replica():
+    """Whether store reads made now go to a replica."""
+    return (current_replica.get() is not None and
+            not connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+
+class ReplicaRouter:
+    app_label = 'store'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        if not reads_from_replica():
+            return DEFAULT_DB_ALIAS
+        return current_replica.get()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = current_replica.set(self.choose_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = current_replica.set(self.choose_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.process_response(request, response)
+
+    def choose_replica(self, request):
+        replicas = get_replicas()
+        if (not replicas or request.method not in SAFE_METHODS or
+                get_sticky_cookie() in request.COOKIES):
+            return None
+        return random.choice(replicas)
+
+    def process_response(self, request, response):
+        if (get_replicas() and request.method not in SAFE_METHODS and
+                response.status_code < 400):
+            response.set_cookie(get_sticky_cookie(), '1',
+                                max_age=get_sticky_seconds(), httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,161 @@
+"""
+Read-only fast path for serializing list pages.
+
+A ``RowSerializer`` is compiled once from a DRF serializer class: every
+field becomes a database column and a plain converter equivalent to the
+field's ``to_representation``. Rows are then read with ``values_list``
+and turned into dicts without per-field dispatch, model instances or
+nested serializer instances. The output is the same as the DRF
+serializer's, key order included.
+"""
+import decimal
+from operator import attrgetter
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+
+from store.models import Book, UserBookRelation
+from store.serializers import BooksSerializer
+
+
+def decimal_converter(field):
+    """``DecimalField.to_representation`` with its context built once."""
+    if (field.localize or field.normalize_output or
+            not getattr(field, 'coerce_to_string',
+                        api_settings.COERCE_DECIMAL_TO_STRING)):
+        return field.to_representation
+    if field.decimal_places is None:
+        return '{:f}'.format
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+    return convert
+
+
+def compile_field(field):
+    """
+    Return ``(columns, converter, default)`` for a flat field. Fields that
+    read several columns declare them as ``row_columns`` and convert the
+    tuple of their values with ``from_row``.
+    """
+    if hasattr(field, 'row_columns'):
+        return tuple(field.row_columns), field.from_row, None
+    if isinstance(field, serializers.DecimalField):
+        convert = decimal_converter(field)
+    elif isinstance(field, serializers.IntegerField):
+        convert = int
+    elif isinstance(field, serializers.CharField):
+        convert = str
+    elif isinstance(field, serializers.BooleanField):
+        convert = bool
+    else:
+        raise ImproperlyConfigured(
+            f'{field.__class__.__name__} {field.field_name!r} has no row '
+            f'converter')
+    # A NULL column of a related object stands for the missing object, on
+    # which DRF falls back to the default.
+    default = None
+    if len(field.source_attrs) > 1 and field.default is not empty:
+        default = field.default
+    return ('__'.join(field.source_attrs),), convert, default
+
+
+class RowSerializer:
+    """
+    Compiled, read-only counterpart of ``serializer_class`` for the flat
+    fields. Many-valued nested fields are filled in by ``nested_loaders``:
+    callables taking a list of primary keys and returning a dict of
+    already serialized lists keyed by primary key.
+    """
+    def __init__(self, serializer_class, nested_loaders=None):
+        nested_loaders = nested_loaders or {}
+        self.fields = []
+        self.nested = []
+        self.columns = ['pk']
+        for name, field in serializer_class().fields.items():
+            if name in nested_loaders:
+                self.fields.append((name, None, None, None))
+                self.nested.append((name, nested_loaders[name]))
+                continue
+            columns, convert, default = compile_field(field)
+            self.fields.append((name, attrgetter(*columns), convert, default))
+            self.columns += columns
+
+    def to_representation(self, rows):
+        """
+        Serialize ``rows``, named tuples with at least ``self.columns``,
+        e.g. from ``values_list(*self.columns, named=True)``.
+        """
+        nested = [(name, loader([row.pk for row in rows]))
+                  for name, loader in self.nested]
+        data = []
+        for row in rows:
+            item = {}
+            nested_values = {name: values.get(row.pk, [])
+                             for name, values in nested}
+            for name, get_value, convert, default in self.fields:
+                if get_value is None:
+                    item[name] = nested_values[name]
+                    continue
+                value = get_value(row)
+                if value is None:
+                    value = default
+                item[name] = None if value is None else convert(value)
+            data.append(item)
+        return data
+
+
+class RowListModelMixin:
+    """
+    ``list`` serialized with the view's ``row_serializer`` from a page of
+    ``paginate_rows``.
+    """
+    row_serializer = None
+
+    def get_row_serializer(self):
+        return self.row_serializer
+
+    def list(self, request, *args, **kwargs):
+        row_serializer = self.get_row_serializer()
+        if row_serializer is None or self.paginator is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginator.paginate_rows(queryset, request,
+                                            row_serializer.columns, self)
+        return self.get_paginated_response(
+            row_serializer.to_representation(rows))
+
+
+def load_readers_preview(book_ids):
+    """
+    The first ``Book.readers_preview_size`` readers of every book, by user
+    id, in one query.
+    """
+    relations = UserBookRelation.objects.filter(book_id__in=book_ids).annotate(
+        position=Window(RowNumber(), partition_by=F('book_id'),
+                        order_by=F('user_id').asc())
+    ).filter(position__lte=Book.readers_preview_size).order_by('user_id')
+    previews = {}
+    for book_id, first_name, last_name in relations.values_list(
+            'book_id', 'user__first_name', 'user__last_name'):
+        previews.setdefault(book_id, []).append(
+            {'first_name': str(first_name), 'last_name': str(last_name)})
+    return previews
+
+
+class BookRowSerializer(RowSerializer):
+    def __init__(self, serializer_class=BooksSerializer):
+        super().__init__(serializer_class, nested_loaders={
+            'readers_preview': load_readers_preview,
+        })
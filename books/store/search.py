@@ -0,0 +1,166 @@
+"""
+Full-text search over ``Book.name`` and ``Book.author_name``.
+
+On PostgreSQL the search runs against a GIN index over a ``SearchVector``
+of both columns. On SQLite it uses the ``store_book_fts`` FTS5 table, an
+external-content index over ``store_book`` kept in sync by triggers. Other
+databases, or SQLite builds without FTS5, fall back to the ``icontains``
+lookups of DRF's ``SearchFilter``.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from store.instrumentation import setup_queries
+
+SQLITE_FTS_TABLE = 'store_book_fts'
+SQLITE_FTS_TRIGGERS = {
+    'store_book_fts_ai': (
+        'CREATE TRIGGER IF NOT EXISTS store_book_fts_ai '
+        'AFTER INSERT ON store_book BEGIN '
+        'INSERT INTO store_book_fts(rowid, name, author_name) '
+        'VALUES (new.id, new.name, new.author_name); END'
+    ),
+    'store_book_fts_ad': (
+        'CREATE TRIGGER IF NOT EXISTS store_book_fts_ad '
+        'AFTER DELETE ON store_book BEGIN '
+        "INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name) "
+        "VALUES ('delete', old.id, old.name, old.author_name); END"
+    ),
+    'store_book_fts_au': (
+        'CREATE TRIGGER IF NOT EXISTS store_book_fts_au '
+        'AFTER UPDATE OF name, author_name ON store_book BEGIN '
+        "INSERT INTO store_book_fts(store_book_fts, rowid, name, author_name) "
+        "VALUES ('delete', old.id, old.name, old.author_name); "
+        'INSERT INTO store_book_fts(rowid, name, author_name) '
+        'VALUES (new.id, new.name, new.author_name); END'
+    ),
+}
+POSTGRES_INDEX_NAME = 'store_book_search_gin'
+SEARCH_CONFIG = 'simple'
+
+_sqlite_index_available = {}
+
+
+def _sqlite_objects(cursor):
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE name LIKE 'store_book_fts%'")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def install_sqlite_index(connection, create_table=True):
+    """
+    Create the FTS5 table and its triggers when they are missing and
+    rebuild the index if anything had to be (re)created. SQLite drops the
+    triggers whenever a migration remakes ``store_book``, so this also runs
+    after every ``migrate``.
+    """
+    with connection.cursor() as cursor:
+        existing = _sqlite_objects(cursor)
+        if SQLITE_FTS_TABLE not in existing:
+            if not create_table:
+                return
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5('
+                "name, author_name, content='store_book', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+        missing = [sql for name, sql in SQLITE_FTS_TRIGGERS.items()
+                   if name not in existing]
+        for sql in missing:
+            cursor.execute(sql)
+        if missing or SQLITE_FTS_TABLE not in existing:
+            cursor.execute(f'INSERT INTO {SQLITE_FTS_TABLE}'
+                           f"({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+    _sqlite_index_available.pop(connection.alias, None)
+
+
+def uninstall_sqlite_index(connection):
+    with connection.cursor() as cursor:
+        for name in SQLITE_FTS_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+    _sqlite_index_available.pop(connection.alias, None)
+
+
+def get_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector('name', 'author_name', config=SEARCH_CONFIG)
+
+
+def get_postgres_index():
+    from django.contrib.postgres.indexes import GinIndex
+
+    return GinIndex(get_search_vector(), name=POSTGRES_INDEX_NAME)
+
+
+def reinstall_search_index(sender, using, **kwargs):
+    """``post_migrate`` receiver restoring the SQLite triggers."""
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        install_sqlite_index(connection, create_table=False)
+
+
+def sqlite_index_available(connection):
+    if connection.alias not in _sqlite_index_available:
+        with setup_queries(), connection.cursor() as cursor:
+            _sqlite_index_available[connection.alias] = (
+                SQLITE_FTS_TABLE in _sqlite_objects(cursor))
+    return _sqlite_index_available[connection.alias]
+
+
+def get_tokens(terms):
+    return [token.lower()
+            for term in terms for token in re.findall(r'\w+', term)]
+
+
+class BookSearchFilter(SearchFilter):
+    """
+    ``?search=`` through the full-text index. Every word of the query must
+    prefix-match a word of the name or author; matches are annotated with
+    ``search_rank`` (lower is better) which ``BookCursorPagination`` uses as
+    the default ordering.
+    """
+    rank_annotation = 'search_rank'
+
+    def filter_queryset(self, request, queryset, view):
+        tokens = get_tokens(self.get_search_terms(request))
+        if not tokens:
+            return super().filter_queryset(request, queryset, view)
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            return self.filter_postgresql(queryset, tokens)
+        if (connection.vendor == 'sqlite' and
+                sqlite_index_available(connection)):
+            return self.filter_sqlite(queryset, tokens)
+        return super().filter_queryset(request, queryset, view)
+
+    def filter_sqlite(self, queryset, tokens):
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        # Join the FTS table instead of using an IN subquery so that the
+        # match drives the query and bm25() is computed once per match.
+        return queryset.extra(
+            tables=[SQLITE_FTS_TABLE],
+            where=[f'{SQLITE_FTS_TABLE}.rowid = "store_book"."id"',
+                   f'{SQLITE_FTS_TABLE} MATCH %s'],
+            params=[match]
+        ).annotate(**{
+            self.rank_annotation: RawSQL(f'bm25({SQLITE_FTS_TABLE})', (),
+                                          output_field=FloatField())
+        }).order_by(self.rank_annotation, 'id')
+
+    def filter_postgresql(self, queryset, tokens):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        vector = get_search_vector()
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens),
+                            search_type='raw', config=SEARCH_CONFIG)
+        return queryset.annotate(search_document=vector).filter(
+            search_document=query
+        ).annotate(**{
+            self.rank_annotation: SearchRank(vector, query) * -1
+        }).order_by(self.rank_annotation, 'id')
@@ -11,26 +11,132 @@ class BookReaderSerializer(ModelSerializer):
         fields = ('first_name', 'last_name')
 
 
+class RatingHistogramField(serializers.DictField):
+    """``Book.get_rating_histogram``, read from the per-star counters."""
+    row_columns = tuple(Book.rate_count_fields.values())
+
+    def __init__(self, **kwargs):
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, book):
+        return book.get_rating_histogram()
+
+    def from_row(self, counts):
+        return dict(zip(map(str, Book.rate_count_fields), counts))
+
+
 class BooksSerializer(ModelSerializer):
     # likes_count = serializers.SerializerMethodField()
-    annotated_likes = serializers.IntegerField(read_only=True)
+    annotated_likes = serializers.IntegerField(source='likes_count',
+                                               read_only=True)
     rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
     owner_name = serializers.CharField(source='owner.username',
                                        default='',
                                        read_only=True
                                        )
-    readers = BookReaderSerializer(many=True, read_only=True)
+    readers_preview = BookReaderSerializer(source='get_readers_preview',
+                                           many=True, read_only=True)
+    readers_count = serializers.IntegerField(read_only=True)
+    rating_histogram = RatingHistogramField()
 
     class Meta:
         model = Book
         fields = ('id', 'name', 'price', 'author_name',
-                  'annotated_likes', 'rating', 'owner_name', 'readers')
+                  'annotated_likes', 'rating', 'owner_name',
+                  'readers_preview', 'readers_count', 'rating_histogram')
 
     # def get_likes_count(self, instance):
     #     return UserBookRelation.objects.filter(book=instance, like=True).count()
 
 
+class UserBookStateSerializer(BooksSerializer):
+    """``BooksSerializer`` plus ``Book.objects.with_user_state`` fields."""
+    is_liked = serializers.BooleanField(read_only=True)
+    in_bookmarks = serializers.BooleanField(read_only=True)
+    my_rate = serializers.IntegerField(read_only=True)
+
+    class Meta(BooksSerializer.Meta):
+        fields = BooksSerializer.Meta.fields + ('is_liked', 'in_bookmarks',
+                                                'my_rate')
+
+
 class UserBooksRelationsSerializer(ModelSerializer):
     class Meta:
         model = UserBookRelation
         fields = ('book', 'like', 'in_bookmarks', 'rate')
+
+
+class UserBookRelationBulkItemSerializer(serializers.Serializer):
+    book = serializers.IntegerField(min_value=1)
+    like = serializers.BooleanField(required=False)
+    in_bookmarks = serializers.BooleanField(required=False)
+    rate = serializers.ChoiceField(choices=UserBookRelation.RATE_CHOICES,
+                                   allow_null=True, required=False)
+
+
+class UserBookRelationBulkSerializer(serializers.Serializer):
+    max_rows = 1000
+
+    relations = UserBookRelationBulkItemSerializer(many=True,
+                                                   allow_empty=False,
+                                                   max_length=max_rows)
+
+    def validate_relations(self, relations):
+        book_ids = {row['book'] for row in relations}
+        existing = set(Book.objects.filter(id__in=book_ids)
+                       .values_list('id', flat=True))
+        missing = sorted(book_ids - existing)
+        if missing:
+            raise serializers.ValidationError(
+                f'Books do not exist: {", ".join(map(str, missing))}.')
+        return relations
+
+
+class BookBulkSerializer(serializers.Serializer):
+    """
+    Books picked by ``ids``, or by the list filter and search parameters
+    (the ``filters`` of the context) when there are none, and for ``PATCH``
+    the ``changes`` to apply to all of them.
+    """
+    max_rows = 1000
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1),
+                                allow_empty=False, max_length=max_rows,
+                                required=False)
+    changes = serializers.DictField(required=False)
+
+    def validate_changes(self, changes):
+        serializer = BooksSerializer(data=changes, partial=True)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data:
+            raise serializers.ValidationError('No field to change.')
+        return serializer.validated_data
+
+    def validate(self, attrs):
+        request = self.context['request']
+        if 'ids' not in attrs and not self.context.get('filters'):
+            raise serializers.ValidationError(
+                'Pick the books by ids or by the list filter parameters.')
+        if request.method == 'PATCH' and 'changes' not in attrs:
+            raise serializers.ValidationError(
+                {'changes': ['This field is required.']})
+        return attrs
+
+
+class RatingStatsSerializer(serializers.Serializer):
+    """Rating distribution of a book, all from its stored counters."""
+    id = serializers.IntegerField(read_only=True)
+    count = serializers.IntegerField(source='rating_count', read_only=True)
+    mean = serializers.DecimalField(max_digits=3, decimal_places=2,
+                                    source='rating', read_only=True)
+    median = serializers.DecimalField(max_digits=3, decimal_places=2,
+                                      source='get_rating_median',
+                                      read_only=True)
+    weighted = serializers.DecimalField(max_digits=3, decimal_places=2,
+                                        source='get_weighted_rating',
+                                        read_only=True)
+    histogram = RatingHistogramField()
+
+    columns = ('id', 'rating', 'rating_sum', 'rating_count',
+               *Book.rate_count_fields.values())
@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+CSV_CONTENT_TYPE = 'text/csv'
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    Yield lists of at most ``chunk_size`` objects read through a server-side
+    cursor; ``prefetch_related`` lookups are resolved once per chunk.
+    """
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ndjson(queryset, serializer_class, chunk_size=500, context=None):
+    """
+    Serialize ``queryset`` page by page and yield one NDJSON block per page,
+    so the full result set is never held in memory.
+    """
+    for chunk in iter_chunks(queryset, chunk_size):
+        rows = serializer_class(chunk, many=True, context=context).data
+        yield ''.join(
+            json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+def get_flat_fields(serializer_class):
+    """Names of the fields of ``serializer_class`` that fit a CSV cell."""
+    return [name for name, field in serializer_class().fields.items()
+            if not isinstance(field, (serializers.BaseSerializer,
+                                      serializers.DictField,
+                                      serializers.ListField))]
+
+
+def iter_csv(queryset, serializer_class, chunk_size=500, context=None):
+    """
+    CSV counterpart of ``iter_ndjson``: a header, then one block of rows
+    per page. Nested fields are left out of the file.
+    """
+    fields = get_flat_fields(serializer_class)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for chunk in iter_chunks(queryset, chunk_size):
+        for row in serializer_class(chunk, many=True, context=context).data:
+            writer.writerow(['' if row[name] is None else row[name]
+                             for name in fields])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_lines(stream):
+    """Decoded lines of a binary file-like object, read one at a time."""
+    for line in iter(stream.readline, b''):
+        yield line.decode('utf-8')
+
+
+def read_csv_records(stream):
+    """Yield one dict per row of a CSV ``stream`` with a header."""
+    try:
+        yield from csv.DictReader(iter_lines(stream))
+    except (csv.Error, UnicodeDecodeError) as exc:
+        raise ParseError(f'CSV parse error - {exc}')
+
+
+def read_ndjson_records(stream):
+    """Yield one object per non-empty line of an NDJSON ``stream``."""
+    for number, line in enumerate(iter_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error on line {number} - {exc}')
+
+
+RECORD_READERS = {
+    CSV_CONTENT_TYPE: read_csv_records,
+    NDJSON_CONTENT_TYPE: read_ndjson_records,
+}
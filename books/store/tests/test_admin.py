@@ -0,0 +1,105 @@
+from unittest.mock import patch
+
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.admin import EstimatedCountPaginator, estimate_count
+from store.logic import find_counter_drift
+from store.models import Book, UserBookRelation
+
+
+class AdminTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(self.admin)
+
+    def create_books(self, size):
+        Book.objects.all().delete()
+        User.objects.filter(is_superuser=False).delete()
+        readers = User.objects.bulk_create(
+            User(username=f'reader_{i}') for i in range(3))
+        books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=10, author_name='Author',
+                 owner=readers[0])
+            for i in range(size))
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=reader, book=book, like=True, rate=4)
+            for book in books for reader in readers)
+        return books
+
+    def count_queries(self, url, data=None):
+        # Warm the content type and permission caches first.
+        self.client.get(url, data)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(200, response.status_code)
+        return len(queries)
+
+    def test_changelist_queries(self):
+        for name in ['store_book_changelist',
+                     'store_userbookrelation_changelist']:
+            url = reverse(f'admin:{name}')
+            with self.subTest(name=name):
+                self.create_books(2)
+                small = self.count_queries(url)
+                small_search = self.count_queries(url, {'q': 'Book'})
+                self.create_books(30)
+                self.assertEqual(small, self.count_queries(url))
+                self.assertEqual(small_search,
+                                 self.count_queries(url, {'q': 'Book'}))
+
+    def test_change_form_queries(self):
+        book = self.create_books(2)[0]
+        relation = UserBookRelation.objects.filter(book=book).first()
+        small = self.count_queries(reverse(
+            'admin:store_userbookrelation_change', args=(relation.id,)))
+        self.create_books(30)
+        relation = UserBookRelation.objects.first()
+        self.assertEqual(small, self.count_queries(reverse(
+            'admin:store_userbookrelation_change', args=(relation.id,))))
+
+    def test_estimated_count(self):
+        self.create_books(3)
+        paginator = EstimatedCountPaginator(Book.objects.order_by('id'), 2)
+        self.assertEqual(3, paginator.count)
+        with patch('store.admin.estimate_count', return_value=500000):
+            paginator = EstimatedCountPaginator(Book.objects.order_by('id'),
+                                                2)
+            with self.assertNumQueries(0):
+                self.assertEqual(500000, paginator.count)
+            paginator = EstimatedCountPaginator(
+                Book.objects.filter(price=10).order_by('id'), 2)
+            self.assertEqual(3, paginator.count)
+
+    def test_estimate_count_from_statistics(self):
+        self.create_books(3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(3, estimate_count(Book, 'default'))
+
+    def test_actions(self):
+        books = self.create_books(5)
+        Book.objects.update(rating=1, likes_count=0, readers_count=0)
+        url = reverse('admin:store_book_changelist')
+        selected = [book.id for book in books[:3]]
+        for action in ['recompute_ratings', 'recount_relations']:
+            with self.subTest(action=action):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.post(url, {
+                        'action': action,
+                        helpers.ACTION_CHECKBOX_NAME: selected,
+                    })
+                self.assertEqual(302, response.status_code)
+                updates = [query for query in queries
+                           if query['sql'].startswith('UPDATE "store_book"')]
+                self.assertEqual(1, len(updates))
+        self.assertEqual(
+            {book.id for book in books[3:]},
+            {book.id for book in find_counter_drift()})
+        book = Book.objects.get(pk=selected[0])
+        self.assertEqual('4.00', str(book.rating))
+        self.assertEqual(3, book.likes_count)
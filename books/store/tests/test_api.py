@@ -1,16 +1,22 @@
 import json
+from base64 import urlsafe_b64encode
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
 from django.db import connection
-from django.db.models import Count, Case, When, Avg
+from django.test import override_settings
 from  django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.exceptions import ErrorDetail
 from rest_framework.test import APITestCase
 
-from store.models import Book, UserBookRelation
-from store.serializers import BooksSerializer
+from store.cache import get_cache
+from store.logic import find_counter_drift
+from store.models import Book, RatingRecomputation, UserBookRelation
+from store.serializers import (BookBulkSerializer, BooksSerializer,
+                               UserBookStateSerializer)
+from store.views import BookViewSet
 
 
 class BookApiTestCase(APITestCase):
@@ -25,15 +31,7 @@ class BookApiTestCase(APITestCase):
         self.book3 = Book.objects.create(name='Mallholland Drive', price=1088.00,
                                          author_name='David Linch',
                                          owner=self.user)
-        self.books = Book.objects.all().annotate(annotated_likes=Count(
-                Case(
-                    When(
-                        book__like=True,  # related_name in UserBookRelation, field book
-                        then=1
-                    )
-                )
-            )
-        ).order_by('id')
+        self.books = Book.objects.all().order_by('id')
         UserBookRelation.objects.create(
             user=self.user, book=self.book1, like=True, rate=5)
 
@@ -45,57 +43,217 @@ class BookApiTestCase(APITestCase):
             print(f'queries {len(queries)}')
         serializer_data = BooksSerializer(self.books, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(serializer_data, response.data)
+        self.assertEqual(serializer_data, response.data['results'])
         self.assertEqual(serializer_data[0]['rating'], '5.00')
         self.assertEqual(serializer_data[0]['annotated_likes'], 1)
 
     def test_get_filter(self):
         url = reverse('book-list')
         response = self.client.get(url, data={'price': '88.50'})
-        books = Book.objects.filter(id__in=[self.book2.id]).annotate(annotated_likes=Count(
-            Case(
-                When(
-                    book__like=True,  # related_name in UserBookRelation, field book
-                    then=1
-                )
-            )
-        )
-        ).order_by('id')
+        books = Book.objects.filter(id__in=[self.book2.id]).order_by('id')
         serializer_data = BooksSerializer(books, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(serializer_data, response.data)
+        self.assertEqual(serializer_data, response.data['results'])
 
     def test_get_search(self):
         url = reverse('book-list')
         response = self.client.get(url, data={'search': 'David Linch'})
-        books = Book.objects.filter(id__in=[self.book1.id, self.book3.id]).annotate(annotated_likes=Count(
-            Case(
-                When(
-                    book__like=True,  # related_name in UserBookRelation, field book
-                    then=1
-                )
-            )
-        )
-        ).order_by('id')
+        books = Book.objects.filter(id__in=[self.book1.id, self.book3.id]).order_by('id')
         serializer_data = BooksSerializer(books, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(serializer_data, response.data)
+        self.assertEqual(serializer_data, sorted(response.data['results'],
+                                                 key=lambda book: book['id']))
+
+    def test_get_search_ranking(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'search': 'david linch'})
+        self.assertEqual([self.book3.id, self.book1.id],
+                         [book['id'] for book in response.data['results']])
+
+        response = self.client.get(url, data={'search': 'david linch',
+                                              'ordering': '-price',
+                                              'page_size': 1})
+        self.assertEqual([self.book3.id],
+                         [book['id'] for book in response.data['results']])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([self.book1.id],
+                         [book['id'] for book in response.data['results']])
+
+    def test_get_search_paging_by_rank(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'search': 'david',
+                                              'page_size': 1})
+        ids = [book['id'] for book in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [book['id'] for book in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual([self.book3.id, self.book1.id], ids)
+
+    def test_get_search_prefix(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'search': 'Mallh'})
+        self.assertEqual([self.book3.id],
+                         [book['id'] for book in response.data['results']])
+        response = self.client.get(url, data={'search': 'airp haigh'})
+        self.assertEqual([self.book2.id],
+                         [book['id'] for book in response.data['results']])
+        self.book2.name = 'Hangar'
+        self.book2.save()
+        response = self.client.get(url, data={'search': 'airp'})
+        self.assertEqual([], response.data['results'])
 
     def test_get_ordering(self):
         url = reverse('book-list')
         response = self.client.get(url, data={'ordering': '-price'})
-        books = Book.objects.all().annotate(annotated_likes=Count(
-            Case(
-                When(
-                    book__like=True,  # related_name in UserBookRelation, field book
-                    then=1
-                )
-            )
-        )
-        ).order_by('-price')
+        books = Book.objects.all().order_by('-price')
         serializer_data = BooksSerializer(books, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
-        self.assertEqual(serializer_data, response.data)
+        self.assertEqual(serializer_data, response.data['results'])
+
+    def test_get_cursor_pagination(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'page_size': 2})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.book1.id, self.book2.id],
+                         [book['id'] for book in response.data['results']])
+        self.assertIsNone(response.data['previous'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(response.data['next'])
+            self.assertEqual(2, len(queries))
+        self.assertEqual([self.book3.id],
+                         [book['id'] for book in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([self.book1.id, self.book2.id],
+                         [book['id'] for book in response.data['results']])
+        self.assertIsNone(response.data['previous'])
+
+    def test_get_cursor_pagination_ordering(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'ordering': 'author_name',
+                                              'page_size': 1})
+        ids = [book['id'] for book in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [book['id'] for book in response.data['results']]
+        self.assertEqual([self.book1.id, self.book2.id, self.book3.id], ids)
+
+        response = self.client.get(url, data={'ordering': '-price',
+                                              'page_size': 2})
+        response = self.client.get(response.data['next'])
+        self.assertEqual([self.book1.id],
+                         [book['id'] for book in response.data['results']])
+
+    def test_get_filter_ranges(self):
+        url = reverse('book-list')
+        UserBookRelation.objects.create(user=User.objects.create(
+            username='reader'), book=self.book2, rate=3)
+        for params, expected in [
+            ({'price__gte': '80', 'price__lte': '100'}, [self.book2]),
+            ({'rating__gte': '4'}, [self.book1]),
+            ({'rating__lte': '4'}, [self.book2]),
+            ({'rating__isnull': 'true'}, [self.book3]),
+            ({'likes_count__gte': '1'}, [self.book1]),
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get(url, data=params)
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+                self.assertEqual([book.id for book in expected],
+                                 [book['id'] for book in
+                                  response.data['results']])
+
+    def test_get_cursor_pagination_nullable(self):
+        url = reverse('book-list')
+        UserBookRelation.objects.create(user=User.objects.create(
+            username='reader'), book=self.book3, rate=3)
+        Book.objects.create(name='Wheels', price=10,
+                            author_name='Arthur Haighley')
+        for ordering in ['rating', '-rating', 'likes_count', '-likes_count']:
+            with self.subTest(ordering=ordering):
+                tiebreaker = '-id' if ordering.startswith('-') else 'id'
+                expected = list(Book.objects.order_by(ordering, tiebreaker)
+                                .values_list('id', flat=True))
+                response = self.client.get(url, data={'ordering': ordering,
+                                                      'page_size': 1})
+                ids = [book['id'] for book in response.data['results']]
+                while response.data['next']:
+                    response = self.client.get(response.data['next'])
+                    ids += [book['id'] for book in response.data['results']]
+                self.assertEqual(expected, ids)
+
+                while response.data['previous']:
+                    response = self.client.get(response.data['previous'])
+                    ids = ids[:-1]
+                    self.assertEqual(ids[-1:], [
+                        book['id'] for book in response.data['results']])
+                self.assertEqual(1, len(ids))
+
+    def test_get_cursor_invalid(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'cursor': 'garbage'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        for ordering, value in [('price', 'abc'), ('price', {}),
+                                ('rating', [1]), ('rating', 'NaN'),
+                                ('price', None), ('author_name', None),
+                                ('author_name', {})]:
+            with self.subTest(ordering=ordering, value=value):
+                cursor = urlsafe_b64encode(json.dumps(
+                    [value, self.book1.id, False]).encode()).decode()
+                response = self.client.get(url, data={'ordering': ordering,
+                                                      'cursor': cursor})
+                self.assertEqual(status.HTTP_404_NOT_FOUND,
+                                 response.status_code)
+
+    def test_get_stream(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'stream': 'ndjson',
+                                              'ordering': '-price'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        serializer_data = BooksSerializer(self.books.order_by('-price'),
+                                          many=True).data
+        self.assertEqual(json.loads(json.dumps(serializer_data)),
+                         [json.loads(line) for line in lines])
+
+    def test_get_readers_preview(self):
+        users = User.objects.bulk_create(
+            User(username=f'reader_{i}') for i in range(10))
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=user, book=self.book2) for user in users)
+        url = reverse('book-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            self.assertEqual(2, len(queries))
+        book2 = response.data['results'][1]
+        self.assertEqual(Book.readers_preview_size,
+                         len(book2['readers_preview']))
+        self.assertEqual(10, book2['readers_count'])
+
+    def test_get_readers(self):
+        users = User.objects.bulk_create(
+            User(username=f'reader_{i}', first_name=f'Reader {i}')
+            for i in range(5))
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=user, book=self.book2) for user in users)
+        url = reverse('book-readers', args=(self.book2.id,))
+        response = self.client.get(url, data={'page_size': 3,
+                                              'ordering': 'price'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        names = [reader['first_name'] for reader in response.data['results']]
+        response = self.client.get(response.data['next'])
+        names += [reader['first_name'] for reader in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual([f'Reader {i}' for i in range(5)], names)
+
+    def test_get_readers_not_found(self):
+        url = reverse('book-readers', args=(self.book3.id + 100,))
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = self.client.get(reverse('book-readers', args=('abc',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
 
     def test_create(self):
         self.assertEqual(3, Book.objects.all().count())
@@ -182,6 +340,200 @@ class BookApiTestCase(APITestCase):
         self.assertEqual(300, self.book1.price)
 
 
+class LeaderboardApiTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.users = User.objects.bulk_create(
+            User(username=f'test_user{i}') for i in range(3))
+        self.books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=10, author_name='Arthur Haighley')
+            for i in range(4))
+        votes = [(0, 0, 5, True), (1, 0, 3, True), (0, 1, 5, False),
+                 (1, 2, 4, True), (2, 2, None, True), (0, 2, None, True)]
+        for user, book, rate, like in votes:
+            UserBookRelation.objects.create(user=self.users[user],
+                                            book=self.books[book],
+                                            rate=rate, like=like)
+
+    def get_ids(self, url, data=None):
+        response = self.client.get(url, data)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return [book['id'] for book in response.data['results']]
+
+    def test_top_rated(self):
+        url = reverse('book-top-rated')
+        book0, book1, book2, book3 = [book.id for book in self.books]
+        # 5.00, 4.00 and 4.00: ties go to the newest book.
+        self.assertEqual([book1, book2, book0], self.get_ids(url))
+        self.assertEqual([book1], self.get_ids(url, {'limit': 1}))
+
+        self.client.force_login(self.users[2])
+        self.client.patch(reverse('userbookrelation-detail', args=(book3,)),
+                          {'rate': 5}, format='json')
+        self.assertEqual([book3, book1], self.get_ids(url, {'limit': 2}))
+
+    def test_most_liked(self):
+        url = reverse('book-most-liked')
+        book0, book1, book2, book3 = [book.id for book in self.books]
+        self.assertEqual([book2, book0], self.get_ids(url))
+        response = self.client.get(url)
+        self.assertEqual(BooksSerializer(Book.objects.get(pk=book2)).data,
+                         response.data['results'][0])
+
+    def test_limit(self):
+        url = reverse('book-most-liked')
+        self.assertEqual(2, len(self.get_ids(url, {'limit': 0})))
+        self.assertEqual(2, len(self.get_ids(url, {'limit': 'all'})))
+        with patch.object(BookViewSet, 'max_leaderboard_size', 1):
+            self.assertEqual(1, len(self.get_ids(url, {'limit': 50})))
+
+
+class BookBulkApiTestCase(APITestCase):
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.owner, self.other, self.staff = User.objects.bulk_create([
+            User(username='owner'), User(username='other'),
+            User(username='staff', is_staff=True)])
+        self.books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=10 + i % 2, author_name='Author',
+                 owner=self.other if i == 3 else self.owner)
+            for i in range(4))
+        self.ids = [book.id for book in self.books]
+        self.url = reverse('book-bulk')
+
+    def test_update_ids(self):
+        self.client.force_authenticate(self.owner)
+        detail_url = reverse('book-detail', args=(self.ids[0],))
+        etag = self.client.get(detail_url)['ETag']
+        missing = self.ids[-1] + 1
+        response = self.client.patch(self.url, {
+            'ids': [*self.ids, missing],
+            'changes': {'price': '5.00', 'rating': '5.00'},
+        }, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'updated': self.ids[:3], 'not_found': [missing],
+                          'forbidden': [self.ids[3]]}, response.data)
+        self.assertEqual(
+            ['5.00', '5.00', '5.00', '11.00'],
+            [str(book.price) for book in Book.objects.order_by('id')])
+        # Read-only fields are ignored; the versions and caches move on.
+        self.assertFalse(Book.objects.filter(rating__isnull=False).exists())
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual('5.00', response.data['price'])
+
+        self.client.force_authenticate(self.staff)
+        response = self.client.patch(self.url, {
+            'ids': self.ids, 'changes': {'author_name': 'Staff'}},
+            format='json')
+        self.assertEqual(self.ids, response.data['updated'])
+
+    def test_update_filtered(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.patch(self.url + '?price=11',
+                                     {'changes': {'name': 'Odd'}},
+                                     format='json')
+        self.assertEqual({'updated': [self.ids[1]]}, response.data)
+        self.assertEqual(['Book 0', 'Odd', 'Book 2', 'Book 3'], list(
+            Book.objects.order_by('id').values_list('name', flat=True)))
+
+        with patch.object(BookBulkSerializer, 'max_rows', 2):
+            response = self.client.patch(self.url + '?search=author',
+                                         {'changes': {'name': 'Odd'}},
+                                         format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_delete(self):
+        reader = User.objects.create(username='reader')
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=reader, book=book, like=True, rate=3)
+            for book in self.books)
+        RatingRecomputation.objects.create(book=self.books[0])
+        self.client.force_authenticate(self.owner)
+        response = self.client.delete(self.url, {'ids': self.ids[2:]},
+                                      format='json')
+        self.assertEqual({'deleted': [self.ids[2]], 'not_found': [],
+                          'forbidden': [self.ids[3]]}, response.data)
+        response = self.client.delete(self.url + '?price=10')
+        self.assertEqual({'deleted': [self.ids[0]]}, response.data)
+        self.assertEqual([self.ids[1], self.ids[3]], list(
+            Book.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(2, UserBookRelation.objects.count())
+        self.assertFalse(RatingRecomputation.objects.exists())
+
+    def test_invalid(self):
+        response = self.client.patch(self.url, {'ids': self.ids},
+                                     format='json')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+        self.client.force_authenticate(self.owner)
+        for data in [{'ids': self.ids},
+                     {'changes': {'price': 1}},
+                     {'ids': self.ids, 'changes': {}},
+                     {'ids': self.ids, 'changes': {'price': 'free'}},
+                     {'ids': [], 'changes': {'price': 1}}]:
+            with self.subTest(data=data):
+                response = self.client.patch(self.url, data, format='json')
+                self.assertEqual(status.HTTP_400_BAD_REQUEST,
+                                 response.status_code)
+        # Only filter and search parameters pick books without ids.
+        for params in ['?page_size=5', '?ordering=price', '?price=',
+                       '?unknown=1', '?cursor=abc']:
+            with self.subTest(params=params):
+                response = self.client.delete(self.url + params)
+                self.assertEqual(status.HTTP_400_BAD_REQUEST,
+                                 response.status_code)
+                response = self.client.patch(self.url + params,
+                                             {'changes': {'price': 1}},
+                                             format='json')
+                self.assertEqual(status.HTTP_400_BAD_REQUEST,
+                                 response.status_code)
+        self.assertEqual(4, Book.objects.count())
+        self.assertEqual({10, 11}, set(
+            Book.objects.values_list('price', flat=True)))
+
+
+class RatingStatsApiTestCase(APITestCase):
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.book = Book.objects.create(name='Hotel', price=1,
+                                        author_name='Arthur Haighley')
+        users = User.objects.bulk_create(
+            User(username=f'test_user{i}') for i in range(4))
+        for user, rate in zip(users, [5, 4, 4, 1]):
+            UserBookRelation.objects.create(user=user, book=self.book,
+                                            rate=rate)
+        self.url = reverse('book-rating-stats', args=(self.book.id,))
+
+    @override_settings(STORE_RATING_PRIOR_WEIGHT=6,
+                       STORE_RATING_PRIOR_MEAN=3)
+    def test_stats(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual({
+            'id': self.book.id,
+            'count': 4,
+            'mean': '3.50',
+            'median': '4.00',
+            'weighted': '3.20',
+            'histogram': {'1': 1, '2': 0, '3': 0, '4': 2, '5': 1},
+        }, response.data)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        response = self.client.get(reverse('book-detail',
+                                           args=(self.book.id,)))
+        self.assertEqual(response.data['rating_histogram'],
+                         self.client.get(self.url).data['histogram'])
+
+    def test_not_found(self):
+        response = self.client.get(reverse('book-rating-stats',
+                                           args=(self.book.id + 1,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_non_numeric_pk(self):
+        response = self.client.get(reverse('book-rating-stats',
+                                           args=('abc',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
 class UserBookRelationApiTestCase(APITestCase):
     def setUp(self) -> None:
         self.user1 = User.objects.create(username='test_user1')
@@ -220,6 +572,24 @@ class UserBookRelationApiTestCase(APITestCase):
                                                 user=self.user1)
         self.assertTrue(relation.in_bookmarks)
 
+    def test_like_does_not_touch_rating(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book1,
+                                        rate=4)
+        url = reverse('userbookrelation-detail', args=(self.book1.id,))
+        json_data = json.dumps({'like': True})
+        self.client.force_login(self.user1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(url, data=json_data,
+                                         content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        book_updates = [query['sql'] for query in queries
+                        if query['sql'].startswith('UPDATE "store_book"')]
+        self.assertEqual(1, len(book_updates))
+        self.assertNotIn('rating', book_updates[0])
+        self.book1.refresh_from_db()
+        self.assertEqual('4.00', str(self.book1.rating))
+        self.assertEqual(1, self.book1.likes_count)
+
     def test_rate(self):
         url = reverse('userbookrelation-detail', args=(self.book1.id,))
         data = {
@@ -257,3 +627,181 @@ class UserBookRelationApiTestCase(APITestCase):
             ]
             }, response.data
         )
+
+    def test_bulk(self):
+        UserBookRelation.objects.create(user=self.user1, book=self.book1,
+                                        like=True, rate=2)
+        url = reverse('userbookrelation-bulk')
+        data = {
+            'relations': [
+                {'book': self.book1.id, 'rate': 4},
+                {'book': self.book2.id, 'like': True, 'in_bookmarks': True},
+                {'book': self.book3.id, 'rate': 5},
+                {'book': self.book3.id, 'like': True},
+            ]
+        }
+        json_data = json.dumps(data)
+        self.client.force_login(self.user1)
+        response = self.client.post(url, data=json_data,
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([
+            {'book': self.book1.id, 'like': True, 'in_bookmarks': False,
+             'rate': 4},
+            {'book': self.book2.id, 'like': True, 'in_bookmarks': True,
+             'rate': None},
+            {'book': self.book3.id, 'like': True, 'in_bookmarks': False,
+             'rate': 5},
+        ], response.data)
+        self.assertEqual(3, UserBookRelation.objects.count())
+        self.book1.refresh_from_db()
+        self.assertEqual('4.00', str(self.book1.rating))
+        self.assertEqual(1, self.book1.likes_count)
+        self.book3.refresh_from_db()
+        self.assertEqual('5.00', str(self.book3.rating))
+        self.assertEqual(1, self.book3.likes_count)
+        self.assertEqual(1, self.book3.readers_count)
+
+    def test_bulk_queries_per_batch(self):
+        books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=10, author_name='Author')
+            for i in range(30))
+        url = reverse('userbookrelation-bulk')
+        self.client.force_login(self.user1)
+
+        def post(rows):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    url, data=json.dumps({'relations': rows}),
+                    content_type='application/json')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            return len(queries)
+
+        small = post([{'book': book.id, 'rate': 3} for book in books[:3]])
+        large = post([{'book': book.id, 'rate': 4} for book in books])
+        self.assertEqual(small, large)
+        # One INSERT per set of provided fields, one recount for them all.
+        mixed = post([{'book': books[0].id, 'rate': 2},
+                      {'book': books[1].id, 'like': True},
+                      {'book': books[2].id, 'like': True, 'rate': 1}])
+        self.assertEqual(small + 2, mixed)
+        self.assertEqual([], find_counter_drift())
+
+    def test_bulk_missing_book(self):
+        url = reverse('userbookrelation-bulk')
+        data = {'relations': [{'book': self.book1.id, 'like': True},
+                              {'book': self.book3.id + 100, 'like': True}]}
+        self.client.force_login(self.user1)
+        response = self.client.post(url, data=json.dumps(data),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn(str(self.book3.id + 100),
+                      str(response.data['relations']))
+        self.assertFalse(UserBookRelation.objects.exists())
+
+    def test_bulk_not_authenticated(self):
+        url = reverse('userbookrelation-bulk')
+        data = {'relations': [{'book': self.book1.id, 'like': True}]}
+        response = self.client.post(url, data=json.dumps(data),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+
+class LibraryApiTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.user1 = User.objects.create(username='test_user1')
+        self.user2 = User.objects.create(username='test_user2')
+        self.book1 = Book.objects.create(name='Hotel David Linch', price=77.33,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user1)
+        self.book2 = Book.objects.create(name='Airport', price=88.50,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user2)
+        self.book3 = Book.objects.create(name='Mallholland Drive', price=1088.00,
+                                         author_name='David Linch',
+                                         owner=self.user1)
+        self.book4 = Book.objects.create(name='Lost Highway', price=10,
+                                         author_name='David Linch')
+        UserBookRelation.objects.create(user=self.user1, book=self.book1,
+                                        like=True)
+        UserBookRelation.objects.create(user=self.user1, book=self.book2,
+                                        in_bookmarks=True)
+        UserBookRelation.objects.create(user=self.user1, book=self.book3,
+                                        rate=4)
+        # Touched but neither liked, bookmarked nor rated.
+        UserBookRelation.objects.create(user=self.user1, book=self.book4)
+        UserBookRelation.objects.create(user=self.user2, book=self.book4,
+                                        like=True, in_bookmarks=True, rate=1)
+
+    def get_state(self, data):
+        return [(book['id'], book['is_liked'], book['in_bookmarks'],
+                 book['my_rate']) for book in data['results']]
+
+    def test_library(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(reverse('library-list'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([(self.book1.id, True, False, None),
+                          (self.book2.id, False, True, None),
+                          (self.book3.id, False, False, 4)],
+                         self.get_state(response.data))
+        serializer_data = UserBookStateSerializer(
+            Book.objects.with_user_state(self.user1).filter(
+                id__in=[self.book1.id, self.book2.id, self.book3.id]
+            ).order_by('id'), many=True).data
+        self.assertEqual(serializer_data, response.data['results'])
+
+    def test_library_shelf(self):
+        self.client.force_login(self.user1)
+        url = reverse('library-list')
+        response = self.client.get(url, {'shelf': 'bookmarked'})
+        self.assertEqual([(self.book2.id, False, True, None)],
+                         self.get_state(response.data))
+        response = self.client.get(url, {'shelf': 'rated',
+                                         'ordering': '-price'})
+        self.assertEqual([self.book3.id],
+                         [book['id'] for book in response.data['results']])
+        response = self.client.get(url, {'shelf': 'read'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_library_pagination(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(reverse('library-list'),
+                                   {'ordering': '-price', 'page_size': 2})
+        ids = [book['id'] for book in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [book['id'] for book in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual([self.book3.id, self.book2.id, self.book1.id], ids)
+
+    def test_library_not_authenticated(self):
+        response = self.client.get(reverse('library-list'))
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_book_user_state(self):
+        url = reverse('book-list')
+        response = self.client.get(url, {'user_state': 1})
+        self.assertNotIn('is_liked', response.data['results'][0])
+
+        self.client.force_login(self.user2)
+        response = self.client.get(url)
+        self.assertNotIn('is_liked', response.data['results'][0])
+        response = self.client.get(url, {'user_state': 1})
+        self.assertEqual([(self.book1.id, False, False, None),
+                          (self.book2.id, False, False, None),
+                          (self.book3.id, False, False, None),
+                          (self.book4.id, True, True, 1)],
+                         self.get_state(response.data))
+        self.assertNotIn('ETag', response)
+
+        # Not served from another user's cached response.
+        self.client.force_login(self.user1)
+        response = self.client.get(url, {'user_state': 1})
+        self.assertEqual([(self.book1.id, True, False, None),
+                          (self.book2.id, False, True, None),
+                          (self.book3.id, False, False, 4),
+                          (self.book4.id, False, False, None)],
+                         self.get_state(response.data))
+        response = self.client.get(
+            reverse('book-detail', args=(self.book3.id,)), {'user_state': 1})
+        self.assertEqual(4, response.data['my_rate'])
@@ -0,0 +1,151 @@
+from operator import itemgetter
+
+from django.contrib.auth.models import User
+from django.test import modify_settings, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store.cache import get_cache
+from store.models import Book, UserBookRelation
+
+
+@modify_settings(MIDDLEWARE={
+    'append': 'store.instrumentation.QueryBudgetMiddleware'})
+class AsyncBookApiTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(username='test_user')
+        self.book1 = Book.objects.create(name='Hotel David Linch', price=77.33,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user)
+        self.book2 = Book.objects.create(name='Airport', price=88.50,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user)
+        self.book3 = Book.objects.create(name='Mallholland Drive',
+                                         price=1088.00,
+                                         author_name='David Linch',
+                                         owner=self.user)
+        UserBookRelation.objects.create(user=self.user, book=self.book1,
+                                        like=True, rate=5)
+
+    def assertSameAsSync(self, sync_url, async_url, data=None):
+        expected = self.client.get(sync_url, data)
+        get_cache().clear()
+        with self.assertNumQueries(2):
+            response = self.client.get(async_url, data)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(expected.content.replace(b'/book/', b'/async/book/'),
+                         response.content)
+        return response
+
+    def test_list(self):
+        url = reverse('async-book-list')
+        self.assertSameAsSync(reverse('book-list'), url)
+        self.assertSameAsSync(reverse('book-list'), url, {'price': '88.50'})
+        self.assertSameAsSync(reverse('book-list'), url,
+                              {'ordering': '-price', 'page_size': 2})
+        self.assertSameAsSync(reverse('book-list'), url,
+                              {'search': 'david linch'})
+
+    def test_list_pages(self):
+        url = reverse('async-book-list')
+        response = self.client.get(url, {'ordering': '-price',
+                                         'page_size': 2})
+        ids = [book['id'] for book in response.json()['results']]
+        response = self.client.get(response.json()['next'])
+        ids += [book['id'] for book in response.json()['results']]
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual([self.book3.id, self.book2.id, self.book1.id], ids)
+
+    def test_list_invalid_cursor(self):
+        response = self.client.get(reverse('async-book-list'),
+                                   {'cursor': 'garbage'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertEqual({'detail': 'Invalid cursor'}, response.json())
+
+    def test_list_not_modified(self):
+        url = reverse('async-book-list')
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+    def test_detail(self):
+        self.assertSameAsSync(reverse('book-detail', args=(self.book1.id,)),
+                              reverse('async-book-detail',
+                                      args=(self.book1.id,)))
+        response = self.client.get(reverse('async-book-detail',
+                                           args=(self.book3.id + 100,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_user_state(self):
+        self.client.force_login(self.user)
+        for url, data in [
+                (reverse('async-book-detail', args=(self.book1.id,)), None),
+                (reverse('async-book-list'), {'page_size': 1})]:
+            with self.subTest(url=url):
+                book = self.client.get(url, data).json()
+                self.assertNotIn('is_liked', book.get('results', [book])[0])
+                book = self.client.get(url, {**(data or {}),
+                                             'user_state': 1}).json()
+                self.assertEqual(
+                    (True, 5), itemgetter('is_liked', 'my_rate')(
+                        book.get('results', [book])[0]))
+
+    async def test_detail_async_client(self):
+        response = await self.async_client.get(
+            reverse('async-book-detail', args=(self.book1.id,)))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('5.00', response.json()['rating'])
+
+    async def test_relation(self):
+        url = reverse('async-userbookrelation-detail', args=(self.book2.id,))
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.patch(
+            url, {'rate': 4, 'like': True}, content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'book': self.book2.id, 'like': True,
+                          'in_bookmarks': False, 'rate': 4}, response.json())
+
+        response = await self.async_client.patch(
+            url, {'rate': 2}, content_type='application/json')
+        metrics = response.asgi_request.query_metrics
+        self.assertEqual(3, metrics.view_queries)
+        self.assertEqual(2, metrics.auth_queries)
+        self.assertEqual(2, response.json()['rate'])
+        await self.book2.arefresh_from_db()
+        self.assertEqual('2.00', str(self.book2.rating))
+        self.assertEqual(1, self.book2.likes_count)
+        self.assertEqual(1, self.book2.readers_count)
+
+    @override_settings(STORE_RELATION_THROTTLE_BURST=1,
+                       STORE_RELATION_THROTTLE_RATE=0.01)
+    def test_relation_throttled(self):
+        url = reverse('async-userbookrelation-detail', args=(self.book2.id,))
+        self.client.force_login(self.user)
+        response = self.client.patch(url, {'like': True}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.client.patch(url, {'like': False}, format='json')
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS,
+                         response.status_code)
+
+    def test_relation_errors(self):
+        url = reverse('async-userbookrelation-detail', args=(self.book2.id,))
+        response = self.client.patch(url, {'rate': 4}, format='json')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+        self.client.force_login(self.user)
+        response = self.client.patch(url, {'rate': 6}, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'rate': ['"6" is not a valid choice.']},
+                         response.json())
+        response = self.client.patch(
+            reverse('async-userbookrelation-detail',
+                    args=(self.book3.id + 100,)),
+            {'rate': 4}, format='json')
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_405_METHOD_NOT_ALLOWED,
+                         response.status_code)
@@ -0,0 +1,72 @@
+import json
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store.cache import get_cache
+from store.models import Book, UserBookRelation
+
+
+class BookCacheTestCase(APITestCase):
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.user = User.objects.create(username='test_user')
+        self.book1 = Book.objects.create(name='Hotel David Linch', price=77.33,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user)
+        self.book2 = Book.objects.create(name='Airport', price=88.50,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user)
+
+    def test_list_cached(self):
+        url = reverse('book-list')
+        response = self.client.get(url, data={'ordering': '-price',
+                                              'page_size': 5})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, data={'page_size': 5,
+                                                'ordering': '-price'})
+        self.assertEqual(response.data, cached.data)
+        self.assertEqual(response['ETag'], cached['ETag'])
+
+    def test_list_not_modified(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+    def test_list_invalidated_by_relation(self):
+        url = reverse('book-list')
+        etag = self.client.get(url)['ETag']
+        UserBookRelation.objects.create(user=self.user, book=self.book1,
+                                        like=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual(1, response.data['results'][0]['annotated_likes'])
+
+    def test_detail_invalidated_by_update(self):
+        url = reverse('book-detail', args=(self.book1.id,))
+        other_url = reverse('book-detail', args=(self.book2.id,))
+        self.client.get(url)
+        other_etag = self.client.get(other_url)['ETag']
+
+        self.client.force_login(self.user)
+        self.client.patch(url, data=json.dumps({'price': 10}),
+                          content_type='application/json')
+        self.client.logout()
+
+        response = self.client.get(url)
+        self.assertEqual('10.00', response.data['price'])
+        response = self.client.get(other_url, HTTP_IF_NONE_MATCH=other_etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+    def test_detail_not_found_not_cached(self):
+        url = reverse('book-detail', args=(self.book2.id + 100,))
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertNotIn('ETag', response)
@@ -0,0 +1,179 @@
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from store.cache import get_cache
+from store.coalescing import RelationWriteBuffer
+from store.models import Book, UserBookRelation
+from store.throttling import BurstRateThrottle
+
+
+@override_settings(STORE_RELATION_THROTTLE_BURST=3,
+                   STORE_RELATION_THROTTLE_RATE=0.5)
+class RelationThrottleTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(username='test_user')
+        self.book = Book.objects.create(name='Airport', price=88.50,
+                                        author_name='Arthur Haighley')
+        self.url = reverse('userbookrelation-detail', args=(self.book.id,))
+
+    def toggle(self, user=None):
+        self.client.force_authenticate(user or self.user)
+        return self.client.patch(self.url, {'like': True}, format='json')
+
+    @patch('store.throttling.time.time')
+    def test_burst(self, now):
+        # A bucket of 3 tokens, refilled at one token every 2 seconds.
+        now.return_value = 1000
+        for _ in range(3):
+            self.assertEqual(status.HTTP_200_OK, self.toggle().status_code)
+        response = self.toggle()
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS,
+                         response.status_code)
+        self.assertEqual('2', response['Retry-After'])
+        # Other users have buckets of their own.
+        other = User.objects.create(username='other')
+        self.assertEqual(status.HTTP_200_OK, self.toggle(other).status_code)
+
+        now.return_value = 1002
+        self.assertEqual(status.HTTP_200_OK, self.toggle().status_code)
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS,
+                         self.toggle().status_code)
+
+        # Idle for long enough, the bucket fills back up to the burst only.
+        now.return_value = 1100
+        for _ in range(3):
+            self.assertEqual(status.HTTP_200_OK, self.toggle().status_code)
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS,
+                         self.toggle().status_code)
+
+    @patch('store.throttling.time.time')
+    def test_no_double_burst(self, now):
+        # A fixed window would allow 3 more right after its boundary.
+        now.return_value = 1005.9
+        for _ in range(3):
+            self.assertEqual(status.HTTP_200_OK, self.toggle().status_code)
+        now.return_value = 1006.1
+        self.assertEqual(status.HTTP_429_TOO_MANY_REQUESTS,
+                         self.toggle().status_code)
+
+    def test_concurrent_requests(self):
+        request = Request(APIRequestFactory().patch(self.url))
+        request.user = self.user
+        barrier = threading.Barrier(10)
+        allowed = []
+
+        def take():
+            barrier.wait()
+            allowed.append(BurstRateThrottle().allow_request(request, None))
+
+        threads = [threading.Thread(target=take) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, allowed.count(True))
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_dummy_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.toggle()
+
+    def test_disabled(self):
+        with override_settings(STORE_RELATION_THROTTLE_RATE=None):
+            for _ in range(5):
+                self.assertEqual(status.HTTP_200_OK,
+                                 self.toggle().status_code)
+
+
+@override_settings(STORE_RELATION_COALESCE_WINDOW=1)
+class RelationCoalescingTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(username='test_user')
+        self.other = User.objects.create(username='other')
+        self.book = Book.objects.create(name='Airport', price=88.50,
+                                        author_name='Arthur Haighley')
+        UserBookRelation.objects.create(user=self.user, book=self.book,
+                                        in_bookmarks=True)
+        self.url = reverse('userbookrelation-detail', args=(self.book.id,))
+        self.buffer = RelationWriteBuffer()
+        patcher = patch('store.coalescing._buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The flushes are run by the tests.
+        patcher = patch.object(self.buffer, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_authenticate(self.user)
+
+    def patch_relation(self, data):
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def get_state(self, url, data=None):
+        response = self.client.get(url, data)
+        book = response.data['results'][0] if 'results' in response.data \
+            else response.data
+        return book['is_liked'], book['in_bookmarks'], book['my_rate']
+
+    def test_burst_written_once(self):
+        with self.assertNumQueries(1):
+            self.patch_relation({'like': True})
+        with self.assertNumQueries(0):
+            self.patch_relation({'like': False, 'rate': 2})
+            data = self.patch_relation({'like': True, 'rate': 5})
+        self.assertEqual({'book': self.book.id, 'like': True,
+                          'in_bookmarks': True, 'rate': 5}, data)
+        self.book.refresh_from_db()
+        self.assertEqual(0, self.book.likes_count)
+
+        self.assertEqual(1, self.buffer.flush())
+        relation = UserBookRelation.objects.get(user=self.user)
+        self.assertEqual((True, True, 5), (relation.like,
+                                           relation.in_bookmarks,
+                                           relation.rate))
+        self.book.refresh_from_db()
+        self.assertEqual(1, self.book.likes_count)
+        self.assertEqual('5.00', str(self.book.rating))
+        self.assertEqual(0, self.buffer.flush())
+
+    def test_pending_state_visible(self):
+        self.patch_relation({'like': True, 'rate': 4})
+        self.client.force_authenticate(self.other)
+        self.patch_relation({'in_bookmarks': True})
+        self.assertEqual((False, True, None), self.get_state(
+            reverse('book-list'), {'user_state': 1}))
+
+        self.client.force_authenticate(self.user)
+        UserBookRelation.objects.create(user=self.other, book=self.book,
+                                        like=True)
+        expected = (True, True, 4)
+        for url in [reverse('book-list'),
+                    reverse('book-detail', args=(self.book.id,)),
+                    reverse('book-most-liked')]:
+            with self.subTest(url=url):
+                self.assertEqual(expected,
+                                 self.get_state(url, {'user_state': 1}))
+        self.assertEqual(expected, self.get_state(reverse('library-list')))
+        self.assertEqual(2, self.buffer.flush())
+        self.assertEqual(expected, self.get_state(reverse('library-list')))
+
+    def test_errors(self):
+        response = self.client.patch(self.url, {'rate': 6}, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.patch(
+            reverse('userbookrelation-detail', args=(self.book.id + 1,)),
+            {'like': True}, format='json')
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertEqual({}, self.buffer.pending)
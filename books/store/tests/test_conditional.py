@@ -0,0 +1,107 @@
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store.cache import get_cache, invalidate_books
+from store.models import Book, UserBookRelation
+
+
+class ConditionalRequestTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(username='test_user')
+        self.book = Book.objects.create(name='Airport', price=88.50,
+                                        author_name='Arthur Haighley',
+                                        owner=self.user)
+        self.url = reverse('book-detail', args=(self.book.id,))
+
+    def test_version_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual('W/"1"', response['ETag'])
+        self.assertEqual(http_date(self.book.updated_at.timestamp()),
+                         response['Last-Modified'])
+        # Replayed from the cache.
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(response['ETag'], cached['ETag'])
+        self.assertEqual(response['Last-Modified'], cached['Last-Modified'])
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        get_cache().clear()
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED,
+                         not_modified.status_code)
+        self.assertEqual(response['ETag'], not_modified['ETag'])
+        # Weak comparison.
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH='"1"')
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED,
+                         not_modified.status_code)
+        not_modified = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED,
+                         not_modified.status_code)
+
+        response = self.client.get(reverse('book-detail',
+                                           args=(self.book.id + 1,)),
+                                   HTTP_IF_NONE_MATCH='W/"1"')
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_etag_over_modified_since(self):
+        response = self.client.get(self.url)
+        last_modified = response['Last-Modified']
+        # A second write within the same second as the first.
+        Book.objects.filter(pk=self.book.pk).update(name='Renamed',
+                                                    version=2)
+        invalidate_books([self.book.pk])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='W/"1"',
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('Renamed', response.data['name'])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='W/"1"',
+                                   HTTP_IF_MODIFIED_SINCE=http_date(0))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='W/"2"',
+                                   HTTP_IF_MODIFIED_SINCE=http_date(0))
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+    def test_modified_by_relation(self):
+        etag = self.client.get(self.url)['ETag']
+        UserBookRelation.objects.create(user=self.user, book=self.book,
+                                        rate=4)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('W/"2"', response['ETag'])
+        self.assertEqual('4.00', response.data['rating'])
+
+        Book.objects.filter(pk=self.book.pk).update(name='Renamed')
+        invalidate_books([self.book.pk])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='W/"2"')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('Renamed', response.data['name'])
+
+    def test_if_match(self):
+        self.client.force_login(self.user)
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'price': 10}, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('W/"2"', response['ETag'])
+        self.assertEqual(2, Book.objects.get(pk=self.book.pk).version)
+
+        # A second client still holding the first version loses.
+        response = self.client.patch(self.url, {'price': 20}, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(status.HTTP_412_PRECONDITION_FAILED,
+                         response.status_code)
+        response = self.client.delete(self.url, HTTP_IF_MATCH=etag)
+        self.assertEqual(status.HTTP_412_PRECONDITION_FAILED,
+                         response.status_code)
+        self.assertEqual(10, Book.objects.get(pk=self.book.pk).price)
+
+        response = self.client.delete(self.url, HTTP_IF_MATCH='W/"2"')
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
@@ -0,0 +1,142 @@
+import csv
+import io
+import json
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
+from store.logic import import_books
+from store.models import Book
+from store.serializers import BooksSerializer
+from store.views import BookViewSet
+
+CSV_BODY = ('name,price,author_name\n'
+            'Airport,88.50,Arthur Haighley\n'
+            '"Hotel, ""David"" Linch",77.33,Arthur Haighley\n'
+            'Mallholland Drive,1088.00,David Linch\n')
+
+
+class BookImportExportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test_user')
+        self.url = reverse('book-import-books')
+
+    def post(self, body, content_type):
+        return self.client.generic('POST', self.url, body.encode('utf-8'),
+                                   content_type=content_type)
+
+    def test_import_csv(self):
+        self.client.force_login(self.user)
+        with patch.object(BookViewSet, 'import_batch_size', 2), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.post(CSV_BODY, 'text/csv; charset=utf-8')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual({'created': 3}, response.data)
+        inserts = [query for query in queries
+                   if query['sql'].startswith('INSERT INTO "store_book"')]
+        self.assertEqual(2, len(inserts))
+        self.assertEqual(
+            [('Airport', '88.50', self.user.id),
+             ('Hotel, "David" Linch', '77.33', self.user.id),
+             ('Mallholland Drive', '1088.00', self.user.id)],
+            [(book.name, str(book.price), book.owner_id)
+             for book in Book.objects.order_by('id')])
+        response = self.client.get(reverse('book-list'), {'search': 'linch'})
+        self.assertEqual(2, len(response.data['results']))
+
+    def test_import_ndjson(self):
+        self.client.force_login(self.user)
+        body = ''.join(json.dumps(row) + '\n' for row in [
+            {'name': 'Airport', 'price': '88.50', 'author_name': 'Haighley'},
+            {'name': 'Lost Highway', 'price': 10, 'author_name': 'Linch',
+             'rating': '5.00'},
+        ]) + '\n'
+        response = self.post(body, 'application/x-ndjson')
+        self.assertEqual({'created': 2}, response.data)
+        # Read-only fields are ignored.
+        self.assertIsNone(Book.objects.get(name='Lost Highway').rating)
+
+    def test_import_invalid(self):
+        self.client.force_login(self.user)
+        body = CSV_BODY + 'Broken,not a price,Nobody\n'
+        with patch.object(BookViewSet, 'import_batch_size', 2):
+            response = self.post(body, 'text/csv')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'records': {'4': {
+            'price': ['A valid number is required.']}}}, response.json())
+        self.assertFalse(Book.objects.exists())
+
+        response = self.post('{"name": "Airport"}\n{broken\n',
+                             'application/x-ndjson')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn('line 2', response.data['detail'])
+
+    def test_import_errors(self):
+        response = self.post(CSV_BODY, 'text/csv')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+        self.client.force_login(self.user)
+        response = self.post(CSV_BODY, 'application/xml')
+        self.assertEqual(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                         response.status_code)
+        response = self.post('', 'text/csv')
+        self.assertEqual({'created': 0}, response.data)
+
+    def test_import_reads_in_batches(self):
+        consumed = []
+
+        def records():
+            for number in range(1, 100):
+                consumed.append(number)
+                yield {'name': 'Book', 'price': 'bad', 'author_name': ''}
+
+        with self.assertRaises(ValidationError):
+            import_books(records(), batch_size=10)
+        self.assertEqual(10, len(consumed))
+
+    def test_export_csv(self):
+        self.client.force_authenticate(self.user)
+        self.post(CSV_BODY, 'text/csv')
+        with patch.object(BookViewSet, 'stream_chunk_size', 2), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-list'),
+                                       {'stream': 'csv', 'ordering': 'price'})
+            content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual('text/csv', response['Content-Type'])
+        rows = list(csv.DictReader(io.StringIO(content)))
+        expected = BooksSerializer(Book.objects.order_by('price'),
+                                   many=True).data
+        self.assertEqual(
+            [{name: '' if value is None else str(value)
+              for name, value in row.items()
+              if name not in ('readers_preview', 'rating_histogram')}
+             for row in expected],
+            rows)
+        # The books, then the readers preview of each chunk of two.
+        self.assertEqual(3, len(queries))
+
+        # Exported files import back as they are.
+        Book.objects.all().delete()
+        response = self.post(content, 'text/csv')
+        self.assertEqual({'created': 3}, response.data)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write(CSV_BODY)
+            file.flush()
+            out = io.StringIO()
+            call_command('import_books', file.name, '--owner', 'test_user',
+                         '--batch-size', '2', stdout=out)
+            self.assertIn('Imported 3 books', out.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('import_books', file.name, '--owner', 'nobody')
+            with self.assertRaises(CommandError):
+                call_command('import_books', file.name, '--format', 'ndjson')
+        self.assertEqual(3, Book.objects.filter(owner=self.user).count())
@@ -0,0 +1,144 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, Q
+from django.test import TestCase, TransactionTestCase
+
+from store.models import Book, UserBookRelation
+from store.views import BookViewSet
+
+
+class IndexUsageTestCase(TestCase):
+    """The hot lookups are answered from an index, not a table scan."""
+    def setUp(self):
+        self.user = User.objects.create(username='test_user')
+        self.book = Book.objects.create(name='Airport', price=88.50,
+                                        author_name='Arthur Haighley')
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # The test tables are too small for the planner to bother.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_filter_price(self):
+        self.assertUsesIndex(Book.objects.filter(price=88.50).order_by('id'),
+                             'store_book_price_id_idx')
+
+    def test_keyset_ordering(self):
+        books = Book.objects.filter(
+            Q(price__gt=10) | Q(price=10, id__gt=self.book.id)
+        ).order_by('price', 'id')[:21]
+        self.assertUsesIndex(books, 'store_book_price_id_idx')
+        books = Book.objects.order_by('-author_name', '-id')[:21]
+        self.assertUsesIndex(books, 'store_book_author_id_idx')
+        books = Book.objects.order_by('rating', 'id')[:21]
+        self.assertUsesIndex(books, 'store_book_rating_id_idx')
+        books = Book.objects.filter(
+            Q(rating__lt=4) | Q(rating=4, id__lt=self.book.id) |
+            Q(rating__isnull=True)
+        ).order_by('-rating', '-id')[:21]
+        self.assertUsesIndex(books, 'store_book_rating_id_idx')
+        books = Book.objects.filter(likes_count__gte=1).order_by(
+            '-likes_count', '-id')[:21]
+        self.assertUsesIndex(books, 'store_book_likes_id_idx')
+
+    def test_leaderboards(self):
+        for name, index_name in [('top_rated', 'store_book_rating_id_idx'),
+                                 ('most_liked', 'store_book_likes_id_idx')]:
+            condition, ordering = BookViewSet.leaderboards[name]
+            self.assertUsesIndex(
+                Book.objects.filter(condition).order_by(*ordering)[:10],
+                index_name)
+
+    def test_relation_counters(self):
+        relations = UserBookRelation.objects.filter(book=self.book)
+        self.assertUsesIndex(relations.filter(rate__isnull=False)
+                             .values('rate'),
+                             'store_relation_book_rate_idx')
+        self.assertUsesIndex(relations.filter(like=True).values('book')
+                             .annotate(likes=Count('pk')),
+                             'store_relation_liked_idx')
+
+    def test_relation_lookup(self):
+        index_name = 'store_relation_user_book_uniq'
+        if connection.vendor == 'sqlite':
+            # Table level UNIQUE constraints are backed by an autoindex.
+            index_name = 'sqlite_autoindex_store_userbookrelation'
+        self.assertUsesIndex(
+            UserBookRelation.objects.filter(user=self.user, book=self.book),
+            index_name)
+
+
+class DedupeRelationsMigrationTestCase(TransactionTestCase):
+    """0013 deletes duplicate relations before adding the constraint."""
+    before = [('store', '0012_book_search_index')]
+    after = [('store', '0013_userbookrelation_user_book_uniq')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_dedupe(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        User = apps.get_model('auth', 'User')
+        Book = apps.get_model('store', 'Book')
+        UserBookRelation = apps.get_model('store', 'UserBookRelation')
+        user = User.objects.create(username='test_user')
+        other = User.objects.create(username='test_other')
+        book = Book.objects.create(name='Airport', price=88.50,
+                                   author_name='Arthur Haighley',
+                                   readers_count=4, likes_count=2,
+                                   rating_sum=6, rating_count=2, rating=3)
+        keep = UserBookRelation.objects.create(user=user, book=book, rate=5)
+        UserBookRelation.objects.create(user=user, book=book, like=True,
+                                        rate=1)
+        UserBookRelation.objects.create(user=user, book=book)
+        UserBookRelation.objects.create(user=other, book=book, like=True)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        UserBookRelation = apps.get_model('store', 'UserBookRelation')
+        self.assertEqual(
+            [keep.id], list(UserBookRelation.objects.filter(user=user.id)
+                            .values_list('id', flat=True)))
+        book = apps.get_model('store', 'Book').objects.get(id=book.id)
+        self.assertEqual(2, book.readers_count)
+        self.assertEqual(1, book.likes_count)
+        self.assertEqual(5, book.rating_sum)
+        self.assertEqual(1, book.rating_count)
+        self.assertEqual('5.00', str(book.rating))
+
+
+class SearchIndexMigrationTestCase(TransactionTestCase):
+    """0012 builds the search index over the books already there."""
+    before = [('store', '0011_book_readers_count')]
+    after = [('store', '0012_book_search_index')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_search_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Checks the SQLite FTS5 table.')
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        Book = executor.loader.project_state(self.before).apps.get_model(
+            'store', 'Book')
+        book = Book.objects.create(name='Airport', price=88.50,
+                                   author_name='Arthur Haighley')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM store_book_fts '
+                           "WHERE store_book_fts MATCH 'haighley'")
+            self.assertEqual([(book.id,)], cursor.fetchall())
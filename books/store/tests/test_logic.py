@@ -1,8 +1,17 @@
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from store.logic import set_rating
-from store.models import Book, UserBookRelation
+from store.logic import find_counter_drift, set_rating, update_rating
+from store.models import (Book, RatingRecomputation, UserBookRelation,
+                          histogram_median)
+from store.rating_queue import ThreadRatingQueue
 
 
 class SetRatingTestCase(TestCase):
@@ -33,3 +42,353 @@ class SetRatingTestCase(TestCase):
         self.book1.refresh_from_db()
         self.assertEqual('4.67', str(self.book1.rating))
 
+    def test_rating_counters(self):
+        self.book1.refresh_from_db()
+        self.assertEqual(14, self.book1.rating_sum)
+        self.assertEqual(3, self.book1.rating_count)
+        self.assertEqual('4.67', str(self.book1.rating))
+
+
+class UpdateRatingTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='test_user1')
+        self.user2 = User.objects.create(username='test_user2')
+        self.book1 = Book.objects.create(name='Hotel',
+                                         price=77.33,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user1)
+        self.relation1 = UserBookRelation.objects.create(
+            user=self.user1, book=self.book1, rate=5)
+        self.relation2 = UserBookRelation.objects.create(
+            user=self.user2, book=self.book1, rate=2)
+
+    def test_change_rate(self):
+        self.relation2.rate = 4
+        self.relation2.save()
+        self.book1.refresh_from_db()
+        self.assertEqual(9, self.book1.rating_sum)
+        self.assertEqual(2, self.book1.rating_count)
+        self.assertEqual('4.50', str(self.book1.rating))
+
+    def test_unset_rate(self):
+        self.relation2.rate = None
+        self.relation2.save()
+        self.book1.refresh_from_db()
+        self.assertEqual(5, self.book1.rating_sum)
+        self.assertEqual(1, self.book1.rating_count)
+        self.assertEqual('5.00', str(self.book1.rating))
+
+    def test_delete_relations(self):
+        self.relation1.delete()
+        self.book1.refresh_from_db()
+        self.assertEqual('2.00', str(self.book1.rating))
+        UserBookRelation.objects.all().delete()
+        self.book1.refresh_from_db()
+        self.assertEqual(0, self.book1.rating_sum)
+        self.assertEqual(0, self.book1.rating_count)
+        self.assertIsNone(self.book1.rating)
+
+    def test_update_rating_noop(self):
+        with self.assertNumQueries(0):
+            update_rating(self.book1.id, 3, 3)
+
+    def test_rebuild_counters(self):
+        Book.objects.update(rating=None, rating_sum=0, rating_count=0)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.book1.refresh_from_db()
+        self.assertEqual(7, self.book1.rating_sum)
+        self.assertEqual(2, self.book1.rating_count)
+        self.assertEqual('3.50', str(self.book1.rating))
+
+    def test_save_without_changes(self):
+        relation = UserBookRelation.objects.get(pk=self.relation2.pk)
+        with self.assertNumQueries(0):
+            relation.save()
+
+    def test_save_like_only(self):
+        relation = UserBookRelation.objects.get(pk=self.relation2.pk)
+        relation.like = True
+        with CaptureQueriesContext(connection) as queries:
+            relation.save()
+        self.assertEqual(2, len(queries))
+        self.assertIn('"like"', queries[0]['sql'])
+        self.assertNotIn('"rate"', queries[0]['sql'])
+        self.assertNotIn('rating', queries[1]['sql'])
+        self.book1.refresh_from_db()
+        self.assertEqual(1, self.book1.likes_count)
+
+    def test_save_rate_change_detection(self):
+        relation = UserBookRelation.objects.get(pk=self.relation2.pk)
+        relation.rate = 3
+        with self.assertNumQueries(2):
+            relation.save()
+        relation.rate = 3
+        with self.assertNumQueries(0):
+            relation.save()
+        self.book1.refresh_from_db()
+        self.assertEqual('4.00', str(self.book1.rating))
+
+
+class LikesCountTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='test_user1')
+        self.user2 = User.objects.create(username='test_user2')
+        self.book1 = Book.objects.create(name='Hotel',
+                                         price=77.33,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user1)
+        self.book2 = Book.objects.create(name='Airport',
+                                         price=88.50,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user2)
+        self.relation1 = UserBookRelation.objects.create(
+            user=self.user1, book=self.book1, like=True)
+        self.relation2 = UserBookRelation.objects.create(
+            user=self.user2, book=self.book1, like=True, rate=4)
+
+    def assertLikes(self, book, likes_count):
+        book.refresh_from_db()
+        self.assertEqual(likes_count, book.likes_count)
+
+    def test_like_unlike(self):
+        self.assertLikes(self.book1, 2)
+        self.relation1.like = False
+        self.relation1.save()
+        self.assertLikes(self.book1, 1)
+        self.relation1.like = True
+        self.relation1.save()
+        self.assertLikes(self.book1, 2)
+
+    def test_delete(self):
+        self.relation2.delete()
+        self.assertLikes(self.book1, 1)
+        self.user1.delete()
+        self.assertLikes(self.book1, 0)
+
+    def test_queryset_update(self):
+        UserBookRelation.objects.filter(user=self.user1).update(like=False)
+        self.assertLikes(self.book1, 1)
+        UserBookRelation.objects.filter(user=self.user2).update(
+            book=self.book2)
+        self.assertLikes(self.book1, 0)
+        self.assertLikes(self.book2, 1)
+        self.book2.refresh_from_db()
+        self.assertEqual('4.00', str(self.book2.rating))
+
+    def test_book_save_keeps_counters(self):
+        book = Book.objects.get(pk=self.book1.pk)
+        # A vote lands between loading the book and saving it.
+        UserBookRelation.objects.create(
+            user=User.objects.create(username='test_user3'),
+            book=self.book1, like=True, rate=2)
+        book.name = 'Renamed'
+        book.save()
+        self.book1.refresh_from_db()
+        self.assertEqual('Renamed', self.book1.name)
+        self.assertEqual((3, 3, 2, '3.00'), (
+            self.book1.likes_count, self.book1.readers_count,
+            self.book1.rating_count, str(self.book1.rating)))
+        self.assertEqual([], find_counter_drift())
+
+    def test_move_to_other_book(self):
+        relation = UserBookRelation.objects.get(pk=self.relation2.pk)
+        relation.book = self.book2
+        relation.save()
+        self.assertEqual(self.book2.id, UserBookRelation.objects.get(
+            pk=relation.pk).book_id)
+        self.assertLikes(self.book1, 1)
+        self.assertLikes(self.book2, 1)
+        self.book1.refresh_from_db()
+        self.book2.refresh_from_db()
+        self.assertEqual((1, 0, None), (self.book1.readers_count,
+                                        self.book1.rating_count,
+                                        self.book1.rating))
+        self.assertEqual((1, 1, '4.00'), (self.book2.readers_count,
+                                          self.book2.rate_4_count,
+                                          str(self.book2.rating)))
+
+        # Created in this process, never loaded: saved whole.
+        self.relation1.book = self.book2
+        self.relation1.like = False
+        self.relation1.save()
+        self.assertLikes(self.book1, 0)
+        self.assertLikes(self.book2, 1)
+        self.assertEqual([], find_counter_drift())
+
+    def test_bulk_create(self):
+        user3 = User.objects.create(username='test_user3')
+        UserBookRelation.objects.bulk_create([
+            UserBookRelation(user=user3, book=self.book1, like=True),
+            UserBookRelation(user=user3, book=self.book2, like=True, rate=5),
+        ])
+        self.assertLikes(self.book1, 3)
+        self.assertLikes(self.book2, 1)
+        self.book2.refresh_from_db()
+        self.assertEqual('5.00', str(self.book2.rating))
+
+    def test_drift_check(self):
+        self.assertEqual([], find_counter_drift())
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+
+        Book.objects.filter(pk=self.book1.pk).update(likes_count=7)
+        self.assertEqual([self.book1.id],
+                         [book.id for book in find_counter_drift()])
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', '--check', stdout=StringIO())
+
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertLikes(self.book1, 2)
+        self.assertEqual([], find_counter_drift())
+
+
+class RatingHistogramTestCase(TestCase):
+    def setUp(self):
+        self.users = User.objects.bulk_create(
+            User(username=f'user_{i}') for i in range(4))
+        self.book = Book.objects.create(name='Hotel', price=1,
+                                        author_name='Arthur Haighley')
+
+    def assertHistogram(self, counts):
+        self.book.refresh_from_db()
+        self.assertEqual(dict(zip('12345', counts)),
+                         self.book.get_rating_histogram())
+        self.assertEqual([], find_counter_drift())
+
+    def test_relation_writes(self):
+        relations = [UserBookRelation.objects.create(
+            user=user, book=self.book, rate=rate)
+            for user, rate in zip(self.users, [5, 5, 3, None])]
+        self.assertHistogram([0, 0, 1, 0, 2])
+        relations[0].rate = 1
+        relations[0].save()
+        relations[3].rate = 2
+        relations[3].save()
+        self.assertHistogram([1, 1, 1, 0, 1])
+        relations[1].delete()
+        relations[2].rate = None
+        relations[2].save()
+        self.assertHistogram([1, 1, 0, 0, 0])
+        UserBookRelation.objects.filter(book=self.book).update(rate=4)
+        self.assertHistogram([0, 0, 0, 3, 0])
+
+    def test_rebuild(self):
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=user, book=self.book, rate=rate)
+            for user, rate in zip(self.users, [2, 2, 4, None]))
+        Book.objects.update(rate_2_count=0)
+        self.assertEqual([self.book.id],
+                         [book.id for book in find_counter_drift()])
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertHistogram([0, 2, 0, 1, 0])
+
+    def test_median(self):
+        for counts, median in [([0, 0, 0, 0, 0], None),
+                               ([0, 0, 1, 0, 0], '3'),
+                               ([1, 0, 0, 0, 1], '3'),
+                               ([1, 1, 0, 0, 0], '1.5'),
+                               ([2, 0, 0, 0, 1], '1'),
+                               ([0, 0, 0, 3, 4], '5')]:
+            with self.subTest(counts=counts):
+                self.assertEqual(median, None if histogram_median(counts)
+                                 is None else str(histogram_median(counts)))
+
+    @override_settings(STORE_RATING_PRIOR_WEIGHT=2, STORE_RATING_PRIOR_MEAN=3)
+    def test_weighted_rating(self):
+        self.assertEqual(Decimal(3), self.book.get_weighted_rating())
+        self.book.rating_sum, self.book.rating_count = 10, 2
+        self.assertEqual(Decimal(4), self.book.get_weighted_rating())
+        with override_settings(STORE_RATING_PRIOR_WEIGHT=0):
+            self.assertEqual(Decimal(5), self.book.get_weighted_rating())
+            self.book.rating_sum, self.book.rating_count = 0, 0
+            self.assertIsNone(self.book.get_weighted_rating())
+
+
+class DeferredRatingTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='test_user1')
+        self.user2 = User.objects.create(username='test_user2')
+        self.book1 = Book.objects.create(name='Hotel',
+                                         price=77.33,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user1)
+        self.book2 = Book.objects.create(name='Airport',
+                                         price=88.50,
+                                         author_name='Arthur Haighley',
+                                         owner=self.user2)
+
+    def vote(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            relation = UserBookRelation.objects.create(
+                user=self.user1, book=self.book1, like=True, rate=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserBookRelation.objects.create(
+                user=self.user2, book=self.book1, rate=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            relation.rate = 4
+            relation.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            UserBookRelation.objects.create(
+                user=self.user2, book=self.book2, rate=1)
+
+    @override_settings(STORE_RATING_MODE='deferred',
+                       STORE_RATING_QUEUE='database')
+    def test_database_queue(self):
+        self.vote()
+        self.book1.refresh_from_db()
+        self.assertIsNone(self.book1.rating)
+        self.assertEqual(1, self.book1.likes_count)
+        self.assertEqual(2, RatingRecomputation.objects.count())
+
+        call_command('process_rating_queue', '--once', stdout=StringIO())
+        self.assertFalse(RatingRecomputation.objects.exists())
+        self.book1.refresh_from_db()
+        self.assertEqual('3.00', str(self.book1.rating))
+        self.assertEqual(2, self.book1.rating_count)
+        self.book2.refresh_from_db()
+        self.assertEqual('1.00', str(self.book2.rating))
+
+    @override_settings(STORE_RATING_MODE='deferred',
+                       STORE_RATING_QUEUE='thread')
+    def test_thread_queue_coalesces(self):
+        queue = ThreadRatingQueue()
+        with patch('store.rating_queue.get_rating_queue', return_value=queue), \
+                patch.object(queue, 'enqueue', side_effect=queue.pending.add):
+            self.vote()
+        self.assertEqual({self.book1.id, self.book2.id}, queue.pending)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(2, queue.flush())
+        self.book1.refresh_from_db()
+        self.assertEqual('3.00', str(self.book1.rating))
+        self.assertEqual(set(), queue.pending)
+
+    def test_thread_queue_failure(self):
+        queue = ThreadRatingQueue()
+        queue.pending = {self.book1.id, self.book2.id}
+        with patch('store.rating_queue.recompute',
+                   side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            queue.flush()
+        self.assertEqual({self.book1.id, self.book2.id}, queue.pending)
+        self.assertTrue(queue.wakeup.is_set())
+        self.assertEqual(2, queue.flush())
+
+
+class GenerateCatalogueTestCase(TestCase):
+    def generate(self, *args):
+        out = StringIO()
+        call_command('generate_catalogue', '--books', '20', '--users', '5',
+                     '--relations', '60', *args, stdout=out)
+        return out.getvalue()
+
+    def test_rerun_reports_created_rows(self):
+        out = self.generate()
+        relations = UserBookRelation.objects.count()
+        self.assertIn(f'Generated 20 books, 5 users and {relations} '
+                      f'relations', out)
+        # The users of the seed already exist.
+        out = self.generate()
+        self.assertIn(f'Generated 20 books, 0 users and '
+                      f'{UserBookRelation.objects.count() - relations} '
+                      f'relations', out)
+        self.assertEqual([], list(find_counter_drift()))
@@ -0,0 +1,82 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.permissions import BasePermission
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from store.models import Book
+from store.permissions import filter_permitted
+from store.views import BookViewSet
+
+
+class BookWritePermissionTestCase(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.other = User.objects.create(username='other')
+        self.book = Book.objects.create(name='Airport', price=88.50,
+                                        author_name='Arthur Haighley',
+                                        owner=self.owner)
+        self.url = reverse('book-detail', args=(self.book.id,))
+
+    def test_denied_with_one_query(self):
+        self.client.force_authenticate(self.other)
+        with self.assertNumQueries(1):
+            response = self.client.patch(self.url, {'price': 1},
+                                         format='json')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+        with self.assertNumQueries(1):
+            response = self.client.delete(self.url)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_owner_not_fetched(self):
+        self.client.force_authenticate(self.owner)
+        # The book, the UPDATE and the readers preview of the response.
+        with self.assertNumQueries(3):
+            response = self.client.patch(self.url, {'price': 1},
+                                         format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('owner', response.data['owner_name'])
+
+
+class IsOwnerOnly(BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return obj.owner_id == request.user.pk
+
+
+class FilterPermittedTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        self.other = User.objects.create(username='other')
+        Book.objects.bulk_create([
+            Book(name='Airport', price=1, author_name='', owner=self.owner),
+            Book(name='Lost Highway', price=1, author_name='',
+                 owner=self.other),
+            Book(name='Orphan', price=1, author_name=''),
+        ])
+
+    def permitted(self, method, user):
+        request = getattr(APIRequestFactory(), method)('/book/bulk/')
+        request.user = user
+        view = BookViewSet(request=request)
+        with self.assertNumQueries(0):
+            queryset = filter_permitted(request, view, Book.objects.all())
+        return sorted(queryset.values_list('name', flat=True))
+
+    def test_filter_permitted(self):
+        everything = ['Airport', 'Lost Highway', 'Orphan']
+        self.assertEqual(everything, self.permitted('get', AnonymousUser()))
+        self.assertEqual([], self.permitted('patch', AnonymousUser()))
+        self.assertEqual(['Airport'], self.permitted('patch', self.owner))
+        self.assertEqual(['Lost Highway'], self.permitted('delete',
+                                                          self.other))
+        self.assertEqual(everything, self.permitted('delete', self.staff))
+
+    def test_per_object_fallback(self):
+        request = APIRequestFactory().patch('/book/bulk/')
+        request.user = self.owner
+        view = BookViewSet(request=request, permission_classes=[IsOwnerOnly])
+        queryset = filter_permitted(request, view, Book.objects.all())
+        self.assertEqual(['Airport'],
+                         list(queryset.values_list('name', flat=True)))
@@ -0,0 +1,265 @@
+import logging
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import modify_settings, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store.cache import get_cache
+from store.instrumentation import check_middleware
+from store.models import Book, UserBookRelation
+from store.views import BookViewSet, LibraryViewSet, UserBookRelationView
+
+MIDDLEWARE = 'store.instrumentation.QueryBudgetMiddleware'
+
+
+@modify_settings(MIDDLEWARE={'append': MIDDLEWARE})
+class QueryBudgetTestCase(APITestCase):
+    """
+    Holds every store endpoint to its query budget, on every path through
+    it. The counts must not grow with the number of books, readers or
+    relations.
+    """
+    dataset_sizes = [1, 10, 50]
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.readers = User.objects.bulk_create(
+            User(username=f'reader_{i}') for i in range(8))
+
+    def create_books(self, size):
+        Book.objects.all().delete()
+        books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=10 + i % 3,
+                 author_name=f'Author {i % 4}', owner=self.user)
+            for i in range(size))
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=reader, book=book, like=bool(i % 2),
+                             rate=1 + i % 5)
+            for book in books for i, reader in enumerate(self.readers))
+        return books
+
+    def assertQueries(self, queries, method, url, data=None, **headers):
+        """
+        The request runs exactly ``queries`` queries, within its budget.
+
+        The counts are pinned here rather than read from the views, so a
+        budget raised to hide a regression still fails the test.
+        """
+        get_cache().clear()
+        with self.assertNoLogs('store.instrumentation', logging.WARNING):
+            response = getattr(self.client, method)(url, data, format='json',
+                                                    **headers)
+        self.assertLess(response.status_code, 400)
+        # As counted by the middleware: the view's queries, not auth ones.
+        self.assertEqual(queries,
+                         response.wsgi_request.query_metrics.view_queries)
+        return response
+
+    def test_budgets(self):
+        """Each budget is the worst path of its action below."""
+        self.assertEqual({
+            'list': 2, 'retrieve': 3, 'readers': 2, 'rating_stats': 1,
+            'top_rated': 2, 'most_liked': 2, 'create': 2, 'update': 4,
+            'partial_update': 4, 'destroy': 5, 'bulk': 2, 'bulk_delete': 6,
+        }, BookViewSet.query_budgets)
+        self.assertEqual({'list': 2}, LibraryViewSet.query_budgets)
+        self.assertEqual({'update': 6, 'partial_update': 6, 'bulk': 11},
+                         UserBookRelationView.query_budgets)
+
+    def test_read_budgets(self):
+        for size in self.dataset_sizes:
+            with self.subTest(size=size):
+                books = self.create_books(size)
+                list_url = reverse('book-list')
+                detail_url = reverse('book-detail', args=(books[-1].id,))
+                self.client.get(list_url, {'search': 'book'})
+
+                # The page, then the readers previews.
+                response = self.assertQueries(2, 'get', list_url)
+                self.assertEqual(min(size, 20), len(response.data['results']))
+                self.assertQueries(2, 'get',
+                                   response.data['next'] or list_url)
+                etag = self.assertQueries(2, 'get', detail_url)['ETag']
+                # Only the version is read for a 304.
+                self.assertQueries(1, 'get', detail_url,
+                                   HTTP_IF_NONE_MATCH=etag)
+                self.assertQueries(3, 'get', detail_url,
+                                   HTTP_IF_NONE_MATCH='W/"0"')
+                self.assertQueries(2, 'get', list_url, {'price': '10.00'})
+                self.assertQueries(2, 'get', list_url,
+                                   {'search': 'book author'})
+                self.assertQueries(2, 'get', list_url, {'ordering': '-price'})
+                self.assertQueries(
+                    2, 'get', reverse('book-readers', args=(books[-1].id,)))
+                self.assertQueries(
+                    1, 'get',
+                    reverse('book-rating-stats', args=(books[-1].id,)))
+                self.assertQueries(2, 'get', reverse('book-top-rated'))
+                self.assertQueries(2, 'get', reverse('book-most-liked'))
+
+    def test_user_state_budgets(self):
+        self.client.force_authenticate(self.readers[1])
+        for size in self.dataset_sizes:
+            with self.subTest(size=size):
+                self.create_books(size)
+                response = self.assertQueries(2, 'get',
+                                              reverse('library-list'))
+                self.assertEqual(min(size, 20), len(response.data['results']))
+                self.assertQueries(2, 'get', response.data['next'] or
+                                   reverse('library-list'))
+                self.assertQueries(2, 'get', reverse('book-list'),
+                                   {'user_state': 1})
+
+    def test_write_budgets(self):
+        self.client.force_authenticate(self.user)
+        for size in self.dataset_sizes:
+            with self.subTest(size=size):
+                books = self.create_books(size)
+                data = {'name': 'New', 'price': '5.00', 'author_name': 'Me'}
+                created = self.assertQueries(2, 'post', reverse('book-list'),
+                                             data)
+                url = reverse('book-detail', args=(books[-1].id,))
+                # The book, the UPDATE and the readers preview.
+                self.assertQueries(3, 'put', url, data)
+                self.assertQueries(3, 'patch', url, {'price': '6.00'})
+                etag = self.client.get(url)['ETag']
+                etag = self.assertQueries(3, 'patch', url, {'price': '6.50'},
+                                          HTTP_IF_MATCH=etag)['ETag']
+                self.assertQueries(3, 'put', url, data, HTTP_IF_MATCH=etag)
+                # The book, its relations, then one DELETE per table.
+                self.assertQueries(5, 'delete', url)
+                url = reverse('book-detail', args=(created.data['id'],))
+                self.assertQueries(4, 'delete', url,
+                                   HTTP_IF_MATCH=self.client.get(url)['ETag'])
+                ids = [created.data['id'], *(book.id for book in books)]
+                # With a single book there is none left to change.
+                left = size > 1
+                self.assertQueries(2 if left else 1, 'patch',
+                                   reverse('book-bulk'),
+                                   {'ids': ids, 'changes': {'price': '7.00'}})
+                self.assertQueries(2 if left else 1, 'patch',
+                                   reverse('book-bulk') + '?price=7',
+                                   {'changes': {'price': '8.00'}})
+                self.assertQueries(6 if left else 1, 'delete',
+                                   reverse('book-bulk'), {'ids': ids})
+
+    def test_staff_write_budgets(self):
+        """Staff writes return books owned by someone else."""
+        self.client.force_authenticate(
+            User.objects.create(username='staff', is_staff=True))
+        for size in self.dataset_sizes:
+            with self.subTest(size=size):
+                books = self.create_books(size)
+                data = {'name': 'New', 'price': '5.00', 'author_name': 'Me'}
+                url = reverse('book-detail', args=(books[-1].id,))
+                # Plus the owner's row.
+                self.assertQueries(4, 'put', url, data)
+                etag = self.client.get(url)['ETag']
+                self.assertQueries(4, 'patch', url, {'price': '6.00'},
+                                   HTTP_IF_MATCH=etag)
+                self.assertQueries(5, 'delete', url)
+                left = size > 1
+                self.assertQueries(2 if left else 1, 'patch',
+                                   reverse('book-bulk') + '?price=10',
+                                   {'changes': {'price': '8.00'}})
+                self.assertQueries(6 if left else 1, 'delete',
+                                   reverse('book-bulk') + '?price=8')
+
+    def test_relation_budgets(self):
+        self.client.force_authenticate(self.readers[0])
+        for size in self.dataset_sizes:
+            with self.subTest(size=size):
+                books = self.create_books(size)
+                url = reverse('userbookrelation-detail', args=(books[-1].id,))
+                # The relation, its UPDATE and the counters.
+                self.assertQueries(3, 'patch', url,
+                                   {'rate': 2, 'like': True})
+                UserBookRelation.objects.filter(book=books[-1]).delete()
+                # The first vote also checks the book and creates the row.
+                self.assertQueries(6, 'patch', url,
+                                   {'rate': 2, 'like': True})
+                # The PUT response loads the book back.
+                self.assertQueries(4, 'put', url,
+                                   {'book': books[-1].id, 'rate': 3})
+                bulk_url = reverse('userbookrelation-bulk')
+                self.assertQueries(
+                    4, 'post', bulk_url,
+                    {'relations': [{'book': book.id, 'rate': 4}
+                                   for book in books]})
+                # Every set of provided fields.
+                shapes = [{}, {'like': True}, {'in_bookmarks': True},
+                          {'rate': 1}, {'like': True, 'in_bookmarks': True},
+                          {'like': True, 'rate': 2},
+                          {'in_bookmarks': True, 'rate': 3},
+                          {'like': False, 'in_bookmarks': False, 'rate': 4}]
+                self.assertQueries(
+                    3 + min(size, len(shapes)), 'post', bulk_url,
+                    {'relations': [{'book': book.id,
+                                    **shapes[i % len(shapes)]}
+                                   for i, book in enumerate(books)]})
+
+
+@modify_settings(MIDDLEWARE={'append': MIDDLEWARE})
+class QueryBudgetMiddlewareTestCase(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(username='owner')
+        Book.objects.create(name='Airport', price=88.50,
+                            author_name='Arthur Haighley', owner=self.user)
+
+    @override_settings(DEBUG=True)
+    def test_server_timing(self):
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="2 queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+
+    @override_settings(DEBUG=False)
+    def test_log(self):
+        with self.assertLogs('store.instrumentation', logging.INFO) as logs:
+            response = self.client.get(reverse('book-list'))
+        self.assertNotIn('Server-Timing', response)
+        metrics = logs.records[0].query_metrics
+        self.assertEqual('book-list', metrics['view'])
+        self.assertEqual(2, metrics['queries'])
+        self.assertEqual(2, metrics['budget'])
+        self.assertEqual(200, metrics['status'])
+
+    @override_settings(DEBUG=False)
+    def test_auth_queries_excluded(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('store.instrumentation', logging.INFO) as logs:
+            self.client.get(reverse('book-list'))
+        metrics = logs.records[0].query_metrics
+        self.assertEqual(2, metrics['queries'])
+        self.assertEqual(2, metrics['auth_queries'])
+
+    @override_settings(DEBUG=False)
+    def test_setup_queries_excluded(self):
+        with patch.dict('store.search._sqlite_index_available', clear=True), \
+                self.assertLogs('store.instrumentation', logging.INFO) as logs:
+            self.client.get(reverse('book-list'), {'search': 'airport'})
+        metrics = logs.records[0].query_metrics
+        self.assertEqual(2, metrics['queries'])
+        self.assertEqual(1, metrics['setup_queries'])
+
+    @override_settings(DEBUG=False)
+    def test_over_budget(self):
+        budgets = dict(BookViewSet.query_budgets, list=1)
+        with patch.object(BookViewSet, 'query_budgets', budgets), \
+                self.assertLogs('store.instrumentation',
+                                logging.WARNING) as logs:
+            self.client.get(reverse('book-list'))
+        self.assertEqual(['GET /book/ ran 2 queries, budget is 1'],
+                         [record.getMessage() for record in logs.records])
+
+    def test_missing_middleware_check(self):
+        self.assertEqual([], check_middleware(None))
+        with modify_settings(MIDDLEWARE={'remove': MIDDLEWARE}):
+            self.assertEqual(['store.W001'],
+                             [error.id for error in check_middleware(None)])
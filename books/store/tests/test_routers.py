@@ -0,0 +1,126 @@
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.test import TransactionTestCase, modify_settings, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from store.cache import get_cache
+from store.models import Book, UserBookRelation
+from store.routers import ReplicaRouter, current_replica
+
+REPLICA = 'replica'
+
+
+@override_settings(DATABASE_ROUTERS=['store.routers.ReplicaRouter'],
+                   STORE_READ_REPLICAS=[REPLICA])
+@modify_settings(MIDDLEWARE={
+    'append': 'store.routers.ReplicaRoutingMiddleware'})
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """
+    A second in-memory SQLite database stands in for the replica. It is
+    added here rather than in ``DATABASES`` so the suite runs with the
+    default settings. Nothing replicates to it: rows copied there by hand
+    tell which database a response was read from.
+    """
+    # Resolved in setUpClass, once the replica is defined.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        connections.settings[REPLICA] = connections.configure_settings({
+            'default': connections.settings['default'],
+            REPLICA: {'ENGINE': 'django.db.backends.sqlite3',
+                      'NAME': ':memory:',
+                      'TEST': {'NAME': 'file:store_replica?mode=memory'
+                                       '&cache=shared'}},
+        })[REPLICA]
+        connections[REPLICA].creation.create_test_db(verbosity=0,
+                                                     serialize=False)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].creation.destroy_test_db(':memory:', verbosity=0)
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.user = User.objects.create(username='test_user')
+        self.book = Book.objects.create(name='Airport', price=88.50,
+                                        author_name='Arthur Haighley')
+        # The replica lags: it has the book but not its relations.
+        User.objects.using(REPLICA).bulk_create(User.objects.all())
+        Book.objects.using(REPLICA).bulk_create(Book.objects.all())
+        self.url = reverse('book-detail', args=(self.book.id,))
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual('default', router.db_for_read(Book))
+        token = current_replica.set(REPLICA)
+        try:
+            self.assertEqual(REPLICA, router.db_for_read(Book))
+            self.assertIsNone(router.db_for_read(User))
+            self.assertEqual('default', router.db_for_write(Book))
+            with transaction.atomic():
+                self.assertEqual('default', router.db_for_read(Book))
+        finally:
+            current_replica.reset(token)
+
+    def test_reads_from_replica(self):
+        Book.objects.filter(pk=self.book.pk).update(name='Renamed')
+        response = self.client.get(self.url)
+        self.assertEqual('Airport', response.data['name'])
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual(['Airport'],
+                         [book['name'] for book in response.data['results']])
+
+    def test_read_your_writes(self):
+        self.client.force_login(self.user)
+        response = self.client.patch(
+            reverse('userbookrelation-detail', args=(self.book.id,)),
+            {'rate': 4}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertIn('store_primary', response.cookies)
+        self.assertEqual(0, UserBookRelation.objects.using(REPLICA).count())
+
+        response = self.client.get(self.url)
+        self.assertEqual('4.00', response.data['rating'])
+
+        # Other clients keep reading the replica.
+        get_cache().clear()
+        response = APIClient().get(self.url)
+        self.assertIsNone(response.data['rating'])
+
+    def test_replica_responses_not_cached(self):
+        self.client.force_login(self.user)
+        self.client.patch(
+            reverse('userbookrelation-detail', args=(self.book.id,)),
+            {'rate': 4}, format='json')
+        urls = [self.url, reverse('book-list'),
+                reverse('async-book-detail', args=(self.book.id,))]
+        # Another client reads the lagging replica first.
+        for url in urls:
+            self.assertEqual(status.HTTP_200_OK,
+                             APIClient().get(url).status_code)
+        details = [self.client.get(url).json() for url in urls]
+        self.assertEqual(['4.00'] * 3, [details[0]['rating'],
+                                        details[1]['results'][0]['rating'],
+                                        details[2]['rating']])
+
+    def test_failed_write_not_sticky(self):
+        self.client.force_login(self.user)
+        response = self.client.patch(
+            reverse('userbookrelation-detail', args=(self.book.id,)),
+            {'rate': 6}, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertNotIn('store_primary', response.cookies)
+
+    def test_replica_not_configured(self):
+        with override_settings(STORE_READ_REPLICAS=[]):
+            Book.objects.filter(pk=self.book.pk).update(name='Renamed')
+            response = self.client.get(self.url)
+        self.assertEqual('Renamed', response.data['name'])
@@ -1,9 +1,14 @@
 from django.contrib.auth.models import User
-from django.db.models import Count, Case, When, Avg
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 
 from store.models import Book, UserBookRelation
+from store.renderers import FastJSONRenderer
+from store.row_serializers import BookRowSerializer, RowSerializer
 from store.serializers import BooksSerializer
+from store.views import BookViewSet
 
 
 class BooksSerializerTestCase(TestCase):
@@ -25,15 +30,7 @@ class BooksSerializerTestCase(TestCase):
                                          price=88.50,
                                          author_name='Arthur Haighley',
                                          owner=self.user2)
-        self.books = Book.objects.all().annotate(annotated_likes=Count(
-                Case(
-                    When(
-                        book__like=True,  # related_name in UserBookRelation, field book
-                        then=1
-                    )
-                )
-            )
-        ).order_by('id')
+        self.books = Book.objects.all().order_by('id')
         UserBookRelation.objects.create(
             user=self.user1, book=self.book1, like=True, rate=5)
         UserBookRelation.objects.create(
@@ -41,6 +38,7 @@ class BooksSerializerTestCase(TestCase):
         user_book_3 = UserBookRelation.objects.create(
             user=self.user3, book=self.book1, like=True)
         user_book_3.rate = 4
+        user_book_3.save()
         UserBookRelation.objects.create(
             user=self.user1, book=self.book2, like=True, rate=3)
         UserBookRelation.objects.create(
@@ -59,7 +57,7 @@ class BooksSerializerTestCase(TestCase):
                 'annotated_likes': 3,
                 'rating': '4.67',
                 'owner_name': 'test_user1',
-                'readers': [
+                'readers_preview': [
                     {
                         'first_name': 'Ivan',
                         'last_name': 'Petrov'
@@ -72,7 +70,9 @@ class BooksSerializerTestCase(TestCase):
                         'first_name': 'Sergey',
                         'last_name': 'Smyshlyaev'
                     }
-                ]
+                ],
+                'readers_count': 3,
+                'rating_histogram': {'1': 0, '2': 0, '3': 0, '4': 1, '5': 2}
              },
             {
                 'id': self.book2.id,
@@ -82,7 +82,7 @@ class BooksSerializerTestCase(TestCase):
                 'annotated_likes': 2,
                 'rating': '3.50',
                 'owner_name': 'test_user2',
-                'readers': [
+                'readers_preview': [
                     {
                         'first_name': 'Ivan',
                         'last_name': 'Petrov'
@@ -95,9 +95,63 @@ class BooksSerializerTestCase(TestCase):
                         'first_name': 'Sergey',
                         'last_name': 'Smyshlyaev'
                     }
-                ]
+                ],
+                'readers_count': 3,
+                'rating_histogram': {'1': 0, '2': 0, '3': 1, '4': 1, '5': 0}
             }
         ]
         self.assertEqual(expected_data, data)
 
+    def test_readers_preview_capped(self):
+        users = User.objects.bulk_create(
+            User(username=f'reader_{i}') for i in range(10))
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=user, book=self.book1) for user in users)
+        self.book1.refresh_from_db()
+        data = BooksSerializer(self.book1).data
+        self.assertEqual(Book.readers_preview_size,
+                         len(data['readers_preview']))
+        self.assertEqual(13, data['readers_count'])
 
+
+class BookRowSerializerTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='test_owner')
+        readers = User.objects.bulk_create(
+            User(username=f'reader_{i}', first_name=f'Ива\u2028н {i}',
+                 last_name='Пе"тров</script>') for i in range(7))
+        self.book1 = Book.objects.create(name='Hotel\u2029"Ла"',
+                                         price=77.3,
+                                         author_name='Arthur Haighley',
+                                         owner=self.owner)
+        self.book2 = Book.objects.create(name='Airport', price=1000,
+                                         author_name='Arthur Haighley')
+        Book.objects.create(name='Empty', price='0.05', author_name='')
+        for i, user in enumerate(readers):
+            UserBookRelation.objects.create(user=user, book=self.book1,
+                                            like=i % 2 == 0, rate=i % 5 + 1)
+        UserBookRelation.objects.create(user=readers[0], book=self.book2,
+                                        like=True)
+
+    def assertSameBytes(self, queryset):
+        books = list(queryset)
+        rows = list(queryset.prefetch_related(None).values_list(
+            *BookRowSerializer().columns, named=True))
+        self.assertEqual(
+            JSONRenderer().render(BooksSerializer(books, many=True).data),
+            FastJSONRenderer().render(
+                BookRowSerializer().to_representation(rows)))
+
+    def test_same_as_serializer(self):
+        self.assertSameBytes(BookViewSet.queryset)
+        self.assertSameBytes(BookViewSet.queryset.order_by('-price'))
+
+    def test_no_rows(self):
+        self.assertEqual([], BookRowSerializer().to_representation([]))
+
+    def test_unsupported_field(self):
+        class DateSerializer(serializers.Serializer):
+            created = serializers.DateTimeField()
+
+        with self.assertRaises(ImproperlyConfigured):
+            RowSerializer(DateSerializer)
@@ -0,0 +1,100 @@
+"""
+Token bucket throttling for the relation writes.
+
+Every user (or client address, for anonymous requests) has a bucket of
+``STORE_RELATION_THROTTLE_BURST`` tokens, refilled at
+``STORE_RELATION_THROTTLE_RATE`` tokens per second up to the burst. Each
+write takes a token; a write that finds the bucket empty is refused with
+``429 Too Many Requests`` and told how long until the next token. A UI
+that toggles a like a few times in a row stays within the burst, while
+a client hammering the endpoint is held to the rate, across any span of
+time.
+
+A bucket is one ``(tokens, refilled_at)`` entry in the
+``STORE_CACHE_ALIAS`` cache, refilled by the time elapsed since
+``refilled_at`` whenever it is read. The read and the write back happen
+under a short lock taken with ``add``, so concurrent writes cannot spend
+the same token; a write that cannot get the lock is refused rather than
+let through. The buckets are shared between processes when the cache
+is, and the cache must keep them: a dummy cache raises
+``ImproperlyConfigured`` instead of silently letting every write
+through. ``STORE_RELATION_THROTTLE_RATE = None`` turns throttling off.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.throttling import BaseThrottle
+
+from store.cache import get_cache
+
+LOCK_TIMEOUT = 1
+LOCK_WAIT = 0.5
+LOCK_POLL = 0.001
+
+
+class BurstRateThrottle(BaseThrottle):
+    scope = 'relation'
+    burst_setting = 'STORE_RELATION_THROTTLE_BURST'
+    rate_setting = 'STORE_RELATION_THROTTLE_RATE'
+    default_burst = 30
+    default_rate = 5
+
+    def get_burst(self):
+        return getattr(settings, self.burst_setting, self.default_burst)
+
+    def get_rate(self):
+        return getattr(settings, self.rate_setting, self.default_rate)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return f'store:throttle:{self.scope}:{ident}'
+
+    def get_cache(self):
+        cache = get_cache()
+        if isinstance(cache, DummyCache):
+            raise ImproperlyConfigured(
+                f'{type(self).__name__} needs a cache that keeps its '
+                f'buckets; set {self.rate_setting} = None to turn it off.')
+        return cache
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        rate = self.get_rate()
+        if rate is None:
+            return True
+        cache = self.get_cache()
+        key = self.get_cache_key(request, view)
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(lock, 1, timeout=LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                self.wait_seconds = 1 / rate
+                return False
+            time.sleep(LOCK_POLL)
+        try:
+            return self.take(cache, key, rate, self.get_burst())
+        finally:
+            cache.delete(lock)
+
+    def take(self, cache, key, rate, burst):
+        now = time.time()
+        tokens, refilled_at = cache.get(key, (burst, now))
+        tokens = min(burst, tokens + max(0, now - refilled_at) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        else:
+            self.wait_seconds = (1 - tokens) / rate
+        # Kept until the bucket would be full again anyway.
+        timeout = math.ceil((burst - tokens) / rate) + 1
+        cache.set(key, (tokens, now), timeout=timeout)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
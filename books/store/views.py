@@ -1,51 +1,437 @@
+from functools import reduce
+from io import BytesIO
+from operator import or_
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from django.db.models import Count, Case, When, Avg
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.mixins import UpdateModelMixin
+from rest_framework import status
+from rest_framework.filters import OrderingFilter
+from rest_framework.generics import get_object_or_404
+from rest_framework.decorators import action
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+from rest_framework.mixins import ListModelMixin, UpdateModelMixin
+from rest_framework.pagination import _positive_int
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
+from store.cache import (BOOK_VERSION_KEY, CATALOGUE_VERSION_KEY,
+                         CachedResponseMixin)
+from store.coalescing import (buffer_relation_changes, get_relation_buffer,
+                              show_pending_changes)
+from store.conditional import RowVersionMixin
+from store.logic import (delete_books, import_books, update_books,
+                         upsert_relations)
 from store.models import Book, UserBookRelation
-from store.permissions import IsOwnerOrStuffOrReadOnly
-from store.serializers import BooksSerializer, UserBooksRelationsSerializer
-
-
-class BookViewSet(ModelViewSet):
-    queryset = Book.objects.all().annotate(annotated_likes=Count(
-                Case(
-                    When(
-                        book__like=True,  # related_name in UserBookRelation, field book
-                        then=1
-                    )
-                )
-            )
-        ).select_related('owner').prefetch_related('readers').order_by('id')
+from store.pagination import BookCursorPagination, ReaderCursorPagination
+from store.permissions import IsOwnerOrStuffOrReadOnly, filter_permitted
+from store.renderers import get_renderer_classes
+from store.row_serializers import BookRowSerializer, RowListModelMixin
+from store.search import BookSearchFilter
+from store.serializers import (BookBulkSerializer, BookReaderSerializer,
+                               BooksSerializer, RatingStatsSerializer,
+                               UserBookRelationBulkItemSerializer,
+                               UserBookRelationBulkSerializer,
+                               UserBooksRelationsSerializer,
+                               UserBookStateSerializer)
+from store.streaming import (CSV_CONTENT_TYPE, NDJSON_CONTENT_TYPE,
+                             RECORD_READERS, iter_csv, iter_ndjson)
+from store.throttling import BurstRateThrottle
+
+
+class BookViewSet(CachedResponseMixin, RowVersionMixin, RowListModelMixin,
+                  ModelViewSet):
+    queryset = Book.objects.all().select_related('owner').prefetch_related(
+        Prefetch('readers',
+                 queryset=User.objects.order_by('id')[
+                     :Book.readers_preview_size],
+                 to_attr='readers_preview_cache')
+    ).order_by('id')
     serializer_class = BooksSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # List pages skip model instances and DRF fields, see row_serializers.
+    row_serializer = BookRowSerializer()
+    user_state_row_serializer = BookRowSerializer(UserBookStateSerializer)
+    renderer_classes = get_renderer_classes()
+    pagination_class = BookCursorPagination
+    filter_backends = [DjangoFilterBackend, BookSearchFilter, OrderingFilter]
     permission_classes = [IsOwnerOrStuffOrReadOnly]
-    filter_fields = ['price']
+    # Every filter and ordering runs on a stored column with a (field, id)
+    # index, see Book.Meta.indexes.
+    filterset_fields = {
+        'price': ['exact', 'gte', 'lte'],
+        'rating': ['exact', 'gte', 'lte', 'isnull'],
+        'likes_count': ['exact', 'gte', 'lte'],
+    }
     search_fields = ['name', 'author_name']
-    ordering_fields = ['price', 'author_name']
+    ordering_fields = ['price', 'author_name', 'rating', 'likes_count']
+    stream_query_param = 'stream'
+    stream_formats = {
+        'ndjson': (iter_ndjson, NDJSON_CONTENT_TYPE),
+        'csv': (iter_csv, CSV_CONTENT_TYPE),
+    }
+    stream_chunk_size = 500
+    import_batch_size = 1000
+    write_actions = {'update', 'partial_update', 'destroy', 'bulk',
+                     'bulk_delete'}
+    # ?user_state=1 adds the is_liked, in_bookmarks and my_rate of an
+    # authenticated user to every book.
+    user_state_query_param = 'user_state'
+    # The denormalized counters are kept up to date on every vote, so a
+    # leaderboard is the first ?limit= entries of an index.
+    leaderboards = {
+        'top_rated': (Q(rating__isnull=False), ['-rating', '-id']),
+        'most_liked': (Q(likes_count__gt=0), ['-likes_count', '-id']),
+    }
+    leaderboard_size = 10
+    max_leaderboard_size = 100
+    # The worst path through each action, see test_query_budget: a stale
+    # If-None-Match costs the version check on top of the retrieve, an
+    # If-Match write a transaction and a locked read, and a staff write to
+    # someone else's book the owner's row.
+    query_budgets = {
+        'list': 2,
+        'retrieve': 3,
+        'readers': 2,
+        'rating_stats': 1,
+        'top_rated': 2,
+        'most_liked': 2,
+        'create': 2,
+        'update': 4,
+        'partial_update': 4,
+        'destroy': 5,
+        'bulk': 2,
+        # Up to 100 books; the collector deletes them 100 at a time.
+        'bulk_delete': 6,
+    }
+
+    def with_user_state(self):
+        return (self.request.user.is_authenticated and
+                self.request.query_params.get(self.user_state_query_param)
+                in ('1', 'true'))
+
+    def is_cacheable(self, request):
+        return not self.with_user_state()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.write_actions:
+            # The writes are authorized on owner_id; the update response
+            # loads the readers preview itself, see get_object.
+            return queryset.select_related(None).prefetch_related(None)
+        if self.with_user_state():
+            queryset = queryset.with_user_state(self.request.user)
+        return queryset
+
+    def get_object(self):
+        book = super().get_object()
+        if (self.action in self.write_actions and
+                book.owner_id == self.request.user.pk):
+            # Already loaded for the permission check.
+            book.owner = self.request.user
+        return book
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve') and self.with_user_state():
+            return UserBookStateSerializer
+        return super().get_serializer_class()
+
+    def get_row_serializer(self):
+        if self.with_user_state():
+            return self.user_state_row_serializer
+        return self.row_serializer
+
+    def get_paginated_response(self, data):
+        if self.with_user_state():
+            show_pending_changes(self.request.user, data)
+        return super().get_paginated_response(data)
+
+    def list(self, request, *args, **kwargs):
+        stream_format = request.query_params.get(self.stream_query_param)
+        if stream_format in self.stream_formats:
+            return self.stream_list(request, stream_format)
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.is_cacheable(request):
+            response = self.get_not_modified_response(request, *args,
+                                                      **kwargs)
+            if response is not None:
+                return response
+        response = super().retrieve(request, *args, **kwargs)
+        if self.with_user_state() and response.status_code == 200:
+            show_pending_changes(request.user, [response.data])
+        return response
+
+    def stream_list(self, request, stream_format):
+        queryset = self.filter_queryset(self.get_queryset())
+        iter_rows, content_type = self.stream_formats[stream_format]
+        return StreamingHttpResponse(
+            iter_rows(queryset, self.get_serializer_class(),
+                      chunk_size=self.stream_chunk_size,
+                      context=self.get_serializer_context()),
+            content_type=content_type
+        )
+
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[IsAuthenticated])
+    def import_books(self, request):
+        """
+        Create books from a CSV (``text/csv``, with a header) or NDJSON
+        (``application/x-ndjson``) body, read as a stream.
+        """
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in RECORD_READERS:
+            raise UnsupportedMediaType(content_type)
+        # An empty body has no stream.
+        stream = request.stream or BytesIO()
+        created = import_books(RECORD_READERS[content_type](stream),
+                               owner=request.user,
+                               batch_size=self.import_batch_size)
+        return Response({'created': created}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['patch'],
+            serializer_class=BookBulkSerializer,
+            permission_classes=[IsAuthenticated, IsOwnerOrStuffOrReadOnly])
+    def bulk(self, request):
+        """
+        Apply the same ``changes`` to many books at once. Books given by
+        ``ids`` that do not exist or that the user may not change are
+        reported and skipped; picked by the list filter or search
+        parameters, only the user's own books match.
+        """
+        ids, changes = self.get_bulk_request()
+        with transaction.atomic():
+            result, book_ids = self.get_bulk_books(ids)
+            update_books(book_ids, changes)
+        return Response({'updated': book_ids, **result})
+
+    @bulk.mapping.delete
+    def bulk_delete(self, request):
+        """Delete many books at once, picked as by ``PATCH``."""
+        ids, _ = self.get_bulk_request()
+        with transaction.atomic():
+            result, book_ids = self.get_bulk_books(ids)
+            delete_books(book_ids)
+        return Response({'deleted': book_ids, **result})
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('bulk', 'bulk_delete'):
+            context['filters'] = self.get_bulk_filters()
+        return context
+
+    def get_bulk_filters(self):
+        """
+        The filter and search parameters of the request with a value; a
+        bulk request without ``ids`` needs one of them. Paging, ordering
+        and unknown parameters pick nothing.
+        """
+        names = {BookSearchFilter.search_param}
+        filterset_class = DjangoFilterBackend().get_filterset_class(
+            self, self.get_queryset())
+        if filterset_class is not None:
+            names.update(filterset_class.base_filters)
+        params = self.request.query_params
+        return {name: value for name, value in params.items()
+                if name in names and value}
+
+    def get_bulk_request(self):
+        serializer = self.get_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        return (serializer.validated_data.get('ids'),
+                serializer.validated_data.get('changes'))
+
+    def get_bulk_books(self, ids):
+        """
+        The ids of the books a bulk request may change, locked until the
+        transaction ends, and the report on the ``ids`` it may not.
+        """
+        queryset = self.get_queryset()
+        if ids is None:
+            books = filter_permitted(self.request, self,
+                                     self.filter_queryset(queryset))
+            limit = BookBulkSerializer.max_rows
+            book_ids = list(books.select_for_update().order_by('id')
+                            .values_list('id', flat=True)[:limit + 1])
+            if len(book_ids) > limit:
+                raise ValidationError([f'More than {limit} books match, '
+                                       f'narrow the filter down.'])
+            return {}, book_ids
+        permitted = filter_permitted(self.request, self, queryset)
+        rows = dict(queryset.filter(id__in=ids).select_for_update()
+                    .annotate(permitted=Exists(
+                        permitted.filter(pk=OuterRef('pk'))))
+                    .values_list('id', 'permitted'))
+        return {
+            'not_found': sorted(set(ids).difference(rows)),
+            'forbidden': sorted(pk for pk, allowed in rows.items()
+                                if not allowed),
+        }, sorted(pk for pk, allowed in rows.items() if allowed)
+
+    @action(detail=True, pagination_class=ReaderCursorPagination,
+            serializer_class=BookReaderSerializer)
+    def readers(self, request, pk=None):
+        book = get_object_or_404(Book.objects.only('pk'), pk=pk)
+        page = self.paginate_queryset(User.objects.filter(reader=book))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, url_path='rating-stats',
+            serializer_class=RatingStatsSerializer)
+    def rating_stats(self, request, pk=None):
+        """Vote count, mean, median, weighted score and per-star counts."""
+        return self.get_cached_response([BOOK_VERSION_KEY.format(pk)],
+                                        self.get_rating_stats, request, pk)
+
+    def get_rating_stats(self, request, pk):
+        book = get_object_or_404(
+            Book.objects.only(*RatingStatsSerializer.columns), pk=pk)
+        return Response(self.get_serializer(book).data)
+
+    @action(detail=False, url_path='top-rated')
+    def top_rated(self, request):
+        return self.get_cached_response([CATALOGUE_VERSION_KEY],
+                                        self.leaderboard, request)
+
+    @action(detail=False, url_path='most-liked')
+    def most_liked(self, request):
+        return self.get_cached_response([CATALOGUE_VERSION_KEY],
+                                        self.leaderboard, request)
+
+    def leaderboard(self, request):
+        condition, ordering = self.leaderboards[self.action]
+        try:
+            size = _positive_int(request.query_params['limit'], strict=True,
+                                 cutoff=self.max_leaderboard_size)
+        except (KeyError, ValueError):
+            size = self.leaderboard_size
+        row_serializer = self.get_row_serializer()
+        rows = list(self.get_queryset().filter(condition).order_by(*ordering)
+                    .prefetch_related(None)
+                    .values_list(*row_serializer.columns, named=True)[:size])
+        data = row_serializer.to_representation(rows)
+        if self.with_user_state():
+            show_pending_changes(request.user, data)
+        return Response({'results': data})
 
     def perform_create(self, serializer):
         serializer.validated_data['owner'] = self.request.user
         serializer.save()
 
 
+class LibraryViewSet(RowListModelMixin, ListModelMixin, GenericViewSet):
+    """
+    The books the current user liked, bookmarked or rated, with their
+    state; ``?shelf=`` narrows it down to one of them.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = UserBookStateSerializer
+    row_serializer = BookRowSerializer(UserBookStateSerializer)
+    renderer_classes = get_renderer_classes()
+    pagination_class = BookCursorPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['price', 'author_name', 'rating', 'likes_count']
+    shelf_query_param = 'shelf'
+    shelves = {
+        'liked': Q(like=True),
+        'bookmarked': Q(in_bookmarks=True),
+        'rated': Q(rate__isnull=False),
+    }
+    query_budgets = {
+        'list': 2,
+    }
+
+    def get_paginated_response(self, data):
+        show_pending_changes(self.request.user, data)
+        return super().get_paginated_response(data)
+
+    def get_queryset(self):
+        shelf = self.request.query_params.get(self.shelf_query_param)
+        if shelf is None:
+            condition = reduce(or_, self.shelves.values())
+        elif shelf in self.shelves:
+            condition = self.shelves[shelf]
+        else:
+            raise ValidationError({self.shelf_query_param: [
+                f'Must be one of: {", ".join(self.shelves)}.']})
+        # Driven by the user's relations, not by a scan of every book.
+        relations = UserBookRelation.objects.filter(
+            condition, user=self.request.user).values('book_id')
+        return (Book.objects.with_user_state(self.request.user)
+                .filter(id__in=relations).select_related('owner')
+                .order_by('id'))
+
+
 class UserBookRelationView(UpdateModelMixin, GenericViewSet):
     permission_classes = [IsAuthenticated]
     queryset = UserBookRelation.objects.all()
     serializer_class = UserBooksRelationsSerializer
     lookup_field = 'book'
+    lookup_value_regex = '[0-9]+'
+    throttle_classes = [BurstRateThrottle]
+    # A first vote creates the relation (inside a savepoint) before
+    # updating it, all in the transaction holding its lock. With write
+    # coalescing a PATCH costs one query at most, see store.coalescing.
+    query_budgets = {
+        'update': 6,
+        'partial_update': 6,
+        # One INSERT per set of provided fields, eight at most.
+        'bulk': 11,
+    }
+
+    def partial_update(self, request, *args, **kwargs):
+        if get_relation_buffer() is None:
+            return super().partial_update(request, *args, **kwargs)
+        serializer = UserBookRelationBulkItemSerializer(
+            data={**dict(request.data.items()), 'book': kwargs['book']})
+        serializer.is_valid(raise_exception=True)
+        changes = dict(serializer.validated_data)
+        book_id = changes.pop('book')
+        state = buffer_relation_changes(request.user, book_id, changes)
+        return Response({'book': book_id, **state})
+
+    def update(self, request, *args, **kwargs):
+        # The like and rate deltas are taken from the relation as loaded,
+        # so it stays locked until they are applied. The relation is kept
+        # even when the data is invalid.
+        partial = kwargs.pop('partial', False)
+        with transaction.atomic():
+            serializer = self.get_serializer(self.get_object(),
+                                             data=request.data,
+                                             partial=partial)
+            if serializer.is_valid():
+                self.perform_update(serializer)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.data)
 
     def get_object(self):
-        obj, created = UserBookRelation.objects.get_or_create(
-            user=self.request.user,
-            book_id=self.kwargs['book']
-        )
-        # print(f'created {created}')
-        return obj
+        relations = UserBookRelation.objects.select_for_update()
+        lookup = {'user': self.request.user, 'book_id': self.kwargs['book']}
+        try:
+            return relations.get(**lookup)
+        except UserBookRelation.DoesNotExist:
+            # The foreign key is only checked on commit.
+            get_object_or_404(Book.objects.only('pk'),
+                              pk=self.kwargs['book'])
+        try:
+            with transaction.atomic():
+                return UserBookRelation.objects.create(**lookup)
+        except IntegrityError:
+            # Created by a concurrent request in the meantime.
+            return relations.get(**lookup)
+
+    @action(detail=False, methods=['post'],
+            serializer_class=UserBookRelationBulkSerializer)
+    def bulk(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        relations = upsert_relations(request.user,
+                                     serializer.validated_data['relations'])
+        return Response(UserBooksRelationsSerializer(relations, many=True).data)
 
 
 def auth(request):